@@ -0,0 +1,46 @@
+''' Benchmark - laps per minute against the number of trains sharing one layout, with the block signals from lego_trains/block_signals.py.
+
+The Train from lesson 4 is run on the simulated layout in lego_trains/layout_sim.py (no track or Bluetooth hubs needed),
+once for each number of trains from 1 up to one less than the number of blocks. For each run the laps completed by all
+the trains together per minute, the time the trains spent stopped at a marker and the number of conflicts (two trains
+in the same block, which should always be 0) are printed.
+
+Usage:
+    python3 benchmarks/bench_block_throughput.py --seconds 15 --speed-scale 0.05
+'''
+
+import argparse
+import logging
+import os
+import sys
+
+import curio
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lesson4
+from lego_trains.block_signals import BlockSignals
+from lego_trains.layout_sim import simulate_layout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=15, help='how long to run the layout for each number of trains')
+    parser.add_argument('--speed-scale', type=float, default=0.05, help='blocks per second for each unit of motor speed')
+    parser.add_argument('--marker-length', type=float, default=0.1, help='length of each marker, as a fraction of a block')
+    args = parser.parse_args()
+
+    ''' The trains' own messages are not needed here '''
+    logging.getLogger().setLevel(logging.WARNING)
+
+    for trains in range(1, len(lesson4.MARKER_COLOURS)):
+        ''' Each run gets its own signals, so nothing is left over from the run before '''
+        signals = BlockSignals(lesson4.MARKER_COLOURS)
+        result = curio.run(simulate_layout, lesson4.Train, signals, trains, args.seconds, args.marker_length, args.speed_scale)
+        print(f'{trains} trains: {result.laps_per_minute:.1f} laps/minute, stopped {result.held_seconds:.1f}s, '
+              f'conflicts {result.conflicts}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+''' Benchmark - Bluetooth writes and stop latency with and without the motor command layer (lego_trains/motor_commands.py).
+
+A chattering controller sets the motor speed on every sensor reading (at --reading-rate readings a second, with the
+speed jittering between a few values) and then stops the train. The simulated hub (lego_trains/sim_hub.py) only
+delivers --link-rate messages a second, like a real Bluetooth link, so any extra messages queue up.
+
+The same controller is run twice: once calling the motor directly, and once through the command layer (self.motor).
+For each run the number of messages written and the time from the stop command to the stop reaching the hub are printed.
+
+Usage:
+    python3 benchmarks/bench_command_coalescing.py --seconds 1 --reading-rate 200 --link-rate 20
+'''
+
+import argparse
+import logging
+import os
+import random
+import sys
+
+import curio
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bricknil import attach
+from bricknil.sensor import TrainMotor
+from lego_trains.train import TrainHub
+from lego_trains.sim_hub import simulate, clock
+
+
+''' This builds a Train whose run function is the chattering controller '''
+def make_train(seconds, reading_rate, direct):
+    @attach(TrainMotor, name='motor')
+    class ChatteringTrain(TrainHub):
+        async def run(self):
+            ''' direct sends to the motor itself (as the lessons did before the command layer), otherwise self.motor is used '''
+            motor = self.peripherals['motor'] if direct else self.motor
+            for _ in range(int(seconds * reading_rate)):
+                await motor.set_speed(random.choice((28, 30, 30, 32)))
+                await curio.sleep(1 / reading_rate)
+
+            self.stop_requested = clock()
+            await motor.set_speed(0)
+
+    return ChatteringTrain
+
+''' This runs the controller once and returns the messages written, the stop latency and the command layer counters '''
+async def run_once(seconds, reading_rate, link_rate, direct):
+    sim = await simulate(make_train(seconds, reading_rate, direct), link_rate=link_rate)
+    await sim.wait_delivered()
+
+    ''' The stop is the last message sent in both runs, so its delivery time is the last one '''
+    stop_latency = sim.delivered[-1][1] - sim.hub.stop_requested
+    return sim.ble_writes, stop_latency, sim.hub.commands.counters()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=1.0)
+    parser.add_argument('--reading-rate', type=float, default=200, help='sensor readings (and speed commands) a second')
+    parser.add_argument('--link-rate', type=float, default=20, help='messages a second the simulated Bluetooth link can deliver')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    for label, direct in (('direct', True), ('command layer', False)):
+        writes, stop_latency, counters = curio.run(run_once, args.seconds, args.reading_rate, args.link_rate, direct)
+        line = f'{label}: {writes} messages written, stop reached the hub after {stop_latency * 1000:.0f}ms'
+        if not direct:
+            line += ', ' + ', '.join(f'{name} {count}' for name, count in counters.items())
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
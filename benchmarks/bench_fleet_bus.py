@@ -0,0 +1,98 @@
+''' Benchmark - the fan-out latency of a fleet-wide command (lego_trains/command_bus.py), as the number of hubs grows.
+
+For each number of hubs in --hubs, lesson 2's Train is run on that many simulated hubs (see lego_trains/sim_hub.py), where
+every message takes --write-ms milliseconds (plus up to --jitter-ms) to send, like a Bluetooth write that waits for the hub.
+While the trains run, each one also sends its own speed commands --chatter times a second (normal traffic, which keeps
+the hub's command queue busy, see lego_trains/motor_commands.py). An emergency stop is then sent to every hub --repeats times
+(with a resume after each one):
+    * hub by hub: each train's motor is sent set_speed(0) in turn, the way it would be done without the bus
+    * bus: the fleet command bus fans the stop out to every hub at once
+and the time from issuing the stop until it has been queued for the last hub is printed (p50 and the slowest),
+with the number of hubs it was queued for (queued means handed to the hub's command layer, see command_bus.py).
+
+Usage:
+    python3 benchmarks/bench_fleet_bus.py --hubs 1,10,50,100,200 --repeats 20
+'''
+
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+import curio
+
+''' This lets the benchmark import the lessons and modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lesson2
+from lego_trains.command_bus import FleetBus
+from lego_trains.sim_hub import SimHub
+from lego_trains.train import create_train
+
+
+''' This is the train's own traffic: a new speed every so often, as a run function reacting to its sensor would send '''
+async def chatter(hub, rate, rng):
+    await curio.sleep(rng.uniform(0, 1 / rate))
+    while True:
+        await hub.motor.set_speed(rng.choice((15, 20, 25)))
+        await curio.sleep(1 / rate)
+
+''' This runs the trains for one number of hubs and returns the stop times (in seconds) hub by hub and with the bus, and the hubs the stop was queued for '''
+async def run(args, hubs):
+    rng = random.Random(hubs)
+    sims = []
+    tasks = []
+    for i in range(hubs):
+        train = create_train(lesson2.Train, {'hub_name': f'sim_train_{i}', 'ble_id': f'00:00:00:00:{i // 256:02x}:{i % 256:02x}'})
+        sim = SimHub(train, write_delay=(args.write_ms + rng.uniform(0, args.jitter_ms)) / 1000)
+        await sim.connect()
+        sims.append(sim)
+        tasks.append(await curio.spawn(train.run))
+        tasks.append(await curio.spawn(chatter, train, args.chatter, rng))
+    trains = [sim.hub for sim in sims]
+    bus = FleetBus(trains)
+    await curio.sleep(0.2)
+
+    one_by_one = []
+    fan_out = []
+    queued = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        for train in trains:
+            await train.motor.set_speed(0)
+        one_by_one.append(time.perf_counter() - start)
+        await curio.sleep(0.1)
+
+        receipts = await bus.stop()
+        fan_out.append(bus.last_fan_out)
+        queued.append(sum(receipt['queued'] for receipt in receipts))
+        await bus.resume()
+        await curio.sleep(0.1)
+
+    for task in tasks:
+        await task.cancel()
+    return one_by_one, fan_out, min(queued)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hubs', default='1,10,50,100,200', help='numbers of hubs, separated by commas')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--write-ms', type=float, default=20, help='time to send one message to a hub')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='largest extra time to send a message (different for each hub)')
+    parser.add_argument('--chatter', type=float, default=10, help='speed commands each train sends a second')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f'{"hubs":>6} {"hub by hub ms":>14} {"bus p50 ms":>11} {"bus max ms":>11} {"queued":>7}')
+    for hubs in [int(n) for n in args.hubs.split(',')]:
+        one_by_one, fan_out, queued = curio.run(run, args, hubs)
+        print(f'{hubs:>6} {statistics.median(one_by_one) * 1000:>14.1f} {statistics.median(fan_out) * 1000:>11.1f} '
+              f'{max(fan_out) * 1000:>11.1f} {queued:>7}')
+
+
+if __name__ == '__main__':
+    main()
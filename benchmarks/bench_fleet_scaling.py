@@ -0,0 +1,148 @@
+''' Benchmark - how the lessons' control loops scale as the fleet grows, with N simulated trains in one process.
+
+For each lesson and each fleet size, N Trains (the lesson's own Train class, with its real TrainMotor, VisionSensor and LED
+attached to simulated hubs, see lego_trains/sim_hub.py) run their real run() and train_sensor_change for --seconds seconds.
+Each train is sent a synthetic stream of sensor readings at --rate readings a second (colours for lesson 2, distances for
+lesson 3, lesson 1 has no sensor). Each run is done in a new Python process, and reports:
+    * loop lag: how late a task that sleeps for 10ms wakes up (p50/p99/max), i.e. how long the curio loop was busy with other things
+    * CPU per train: processor time used per train per second
+    * memory per train: memory allocated per Train instance, with its attachments and SimHub (measured with tracemalloc)
+    * notifications: sensor readings delivered to train_sensor_change per second (and the number sent per second)
+
+The results are printed as a table, and written as JSON (one object per run) with --json, so they can be compared between versions.
+
+Usage:
+    python3 benchmarks/bench_fleet_scaling.py --lessons lesson2,lesson3 --trains 10,100,1000 --rate 10 --json scaling.json
+'''
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+''' This lets the benchmark import the lessons and modules from the top level folder of the repository '''
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+''' These are the synthetic readings each train is sent, in a loop (they never include lesson 2's stop colour or lesson 3's stop distance,
+so the trains keep running) '''
+STREAMS = {'lesson2': ('sense_color', [0, 7, 0, 6]),
+           'lesson3': ('sense_distance', [5, 1, 5, 8])}
+
+''' This is how often the lag probe wakes up, in seconds '''
+PROBE_INTERVAL = 0.01
+
+
+''' This runs one lesson with the given number of trains, and returns the results as a dict (run in the child process) '''
+def run_fleet(lesson_name, trains, rate, seconds):
+    import curio
+    from lego_trains.sim_hub import SimHub, percentile
+
+    lesson = importlib.import_module(lesson_name)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    ''' The memory used by the trains is measured while they are created and connected '''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sims = [SimHub(lesson.Train(f'train_{i}', ble_id=f'00:00:00:00:{i // 256:02x}:{i % 256:02x}')) for i in range(trains)]
+
+    async def connect_all():
+        for sim in sims:
+            await sim.connect()
+
+    curio.run(connect_all)
+    memory_per_train = (tracemalloc.get_traced_memory()[0] - before) / trains
+    tracemalloc.stop()
+
+    lags = []
+    stream = STREAMS.get(lesson_name)
+
+    ''' Each train is sent its readings from its own task, like a hub sending notifications on its own timing '''
+    async def feed(sim, offset):
+        capability, values = stream
+        start = time.monotonic() + offset
+        i = 0
+        while True:
+            ''' If the loop has fallen behind, sleep(0) still lets the other tasks run '''
+            await curio.sleep(max(0, start + i / rate - time.monotonic()))
+            await sim.feed(capability, values[i % len(values)])
+            i += 1
+
+    ''' This sleeps for PROBE_INTERVAL over and over, and records how late it wakes up '''
+    async def probe():
+        while True:
+            start = time.monotonic()
+            await curio.sleep(PROBE_INTERVAL)
+            lags.append(time.monotonic() - start - PROBE_INTERVAL)
+
+    async def main():
+        tasks = [await curio.spawn(probe)]
+        if stream is not None:
+            ''' The trains' readings are spread out over the first interval, rather than all arriving at the same moment '''
+            tasks += [await curio.spawn(feed, sim, i / trains / rate) for i, sim in enumerate(sims)]
+        tasks += [await curio.spawn(sim.hub.run) for sim in sims]
+        await curio.sleep(seconds)
+
+        ''' Every task is told to stop before waiting for any of them (the feeders first), otherwise a fleet that has fallen behind
+        keeps feeding readings while each task is waited for in turn '''
+        for task in tasks:
+            await task.cancel(blocking=False)
+        for task in tasks:
+            await task.wait()
+
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    curio.run(main)
+    elapsed = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    notifications = sum(len(sim.notifications) for sim in sims)
+    sent = notifications + sum(sim.not_sent for sim in sims)
+    return {'lesson': lesson_name, 'trains': trains, 'rate': rate, 'seconds': round(elapsed, 3),
+            'lag_p50_ms': percentile(lags, 50) * 1000, 'lag_p99_ms': percentile(lags, 99) * 1000, 'lag_max_ms': max(lags) * 1000,
+            'cpu_ms_per_train_per_s': cpu / trains / elapsed * 1000, 'memory_kb_per_train': memory_per_train / 1024,
+            'notifications_per_s': notifications / elapsed, 'readings_sent_per_s': sent / elapsed,
+            'commands': sum(len(sim.commands) for sim in sims)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lessons', default='lesson1,lesson2,lesson3')
+    parser.add_argument('--trains', default='10,100,1000', help='fleet sizes to run, separated by commas')
+    parser.add_argument('--rate', type=float, default=10, help='sensor readings per second sent to each train')
+    parser.add_argument('--seconds', type=float, default=5, help='how long to run each fleet for')
+    parser.add_argument('--json', help='file to write the results to, as JSON')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        ''' This is the child process, it runs one lesson and fleet size and prints the result as JSON '''
+        lesson_name, trains = args.child.split(':')
+        print(json.dumps(run_fleet(lesson_name, int(trains), args.rate, args.seconds)), flush=True)
+        os._exit(0)
+
+    results = []
+    print(f'{"lesson":8} {"trains":>6} {"lag p50/p99/max ms":>22} {"CPU ms/train/s":>15} {"KB/train":>9} {"notifications/s":>16}')
+    for lesson_name in args.lessons.split(','):
+        for trains in [int(n) for n in args.trains.split(',')]:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', f'{lesson_name}:{trains}',
+                                     '--rate', str(args.rate), '--seconds', str(args.seconds)],
+                                    cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            lag = f'{result["lag_p50_ms"]:.2f}/{result["lag_p99_ms"]:.2f}/{result["lag_max_ms"]:.1f}'
+            print(f'{lesson_name:8} {trains:>6} {lag:>22} {result["cpu_ms_per_train_per_s"]:>15.3f} '
+                  f'{result["memory_kb_per_train"]:>9.1f} {result["notifications_per_s"]:>16.0f}', flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
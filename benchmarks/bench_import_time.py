@@ -0,0 +1,92 @@
+''' Benchmark - cold start import time of each entry point, measured with python -X importtime.
+
+Each entry point is imported in a fresh Python process a number of times, and the median time spent importing
+(not counting the modules every Python process imports at start up) is printed.
+
+The command line tool and the mapping file / scan helpers must not import bricknil, curio, pydantic or bleak.
+The benchmark exits with an error if one of them does, or if an entry point takes longer than its budget,
+so it can be used to guard the start up time.
+
+Run it from the top level folder of the repository:
+
+    python3 benchmarks/bench_import_time.py --repeats 5 '''
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+''' The top level folder of the repository, the imports are run from here (the same as the lessons) '''
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+''' These modules are slow to import and are only needed to talk to the hubs '''
+HEAVY_MODULES = {'bricknil', 'curio', 'pydantic', 'bleak'}
+
+''' These are the entry points: (module to import, heavy modules allowed, budget in milliseconds) '''
+ENTRY_POINTS = [
+    ('lego_trains', False, 20),
+    ('lego_trains.__main__', False, 100),
+    ('lego_trains.hub_registry', False, 100),
+    ('lego_trains.hubs', False, 100),
+    ('scan_hubs', False, 150),
+    ('lego_trains.train', True, 1500),
+    ('lesson1', True, 1500),
+    ('lesson2', True, 1500),
+    ('lesson3', True, 1500),
+    ('lesson4', True, 1500),
+]
+
+
+''' This imports the module in a new Python process and returns the time spent importing (in microseconds) and the top level packages imported '''
+def import_time(module_name):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    total = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        ''' Each line looks like "import time:       123 |        456 |   package.module" (nested imports are indented) '''
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        packages.add(name.strip().split('.')[0])
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+    return total, packages
+
+''' This returns the median import time of a module, minus the median of the modules every Python process imports anyway '''
+def median_import_time(module_name, repeats, baseline=0):
+    times = []
+    for _ in range(repeats):
+        total, packages = import_time(module_name)
+        times.append(total)
+    return max(statistics.median(times) - baseline, 0), packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--no-budget', action='store_true', help='only report the times, do not fail if an entry point is over its budget')
+    args = parser.parse_args()
+
+    ''' Python imports a few modules itself before running any code (encodings, site ...), these are measured once and left out '''
+    baseline, _ = median_import_time('sys', args.repeats)
+
+    failures = []
+    for module_name, heavy_allowed, budget_ms in ENTRY_POINTS:
+        elapsed, packages = median_import_time(module_name, args.repeats, baseline)
+        heavy = sorted(packages & HEAVY_MODULES)
+        print(f'{module_name}: {elapsed / 1000:.1f}ms (budget {budget_ms}ms), heavy imports: {", ".join(heavy) or "none"}')
+
+        if heavy and not heavy_allowed:
+            failures.append(f'{module_name} imports {", ".join(heavy)}')
+        if elapsed / 1000 > budget_ms and not args.no_budget:
+            failures.append(f'{module_name} took {elapsed / 1000:.1f}ms, over its budget of {budget_ms}ms')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
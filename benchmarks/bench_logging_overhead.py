@@ -0,0 +1,84 @@
+''' Benchmark - time the control loop spends logging, with logging.basicConfig and with the queue-backed setup in lego_trains/train_logging.py.
+
+A loop logs a sensor value --messages times (the same as logging.info(self.colour) in the run loop of lesson 2)
+to a slow output (each write takes --write-ms milliseconds, like a terminal over SSH or a Raspberry Pi's serial console).
+Each setup is run in a new Python process, and the time each logging call took on the loop's thread is printed (p50/p99/total).
+
+Usage:
+    python3 benchmarks/bench_logging_overhead.py --messages 2000 --write-ms 0.2
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+''' This is the slow output, every write sleeps for a while before it returns '''
+class SlowStream:
+    def __init__(self, write_seconds):
+        self.write_seconds = write_seconds
+
+    def write(self, text):
+        time.sleep(self.write_seconds)
+
+    def flush(self):
+        pass
+
+
+''' This logs the messages with one of the setups, and returns the time each logging call took '''
+def run_setup(setup, messages, write_seconds):
+    import logging
+    stream = SlowStream(write_seconds)
+
+    if setup == 'basicConfig':
+        logging.basicConfig(level=logging.INFO, stream=stream)
+        log = lambda value: logging.info(value)
+    else:
+        from lego_trains.train_logging import setup_logging, HubLog
+        setup_logging(logging.INFO, stream=stream)
+        hub_log = HubLog('train_1')
+        if setup == 'queue':
+            log = lambda value: logging.info('%s', value)
+        else:
+            ''' Only logs the value when it changes (the sensor reading repeats, as it would while the train is on one colour) '''
+            log = lambda value: hub_log.changed('colour', value)
+
+    timings = []
+    for i in range(messages):
+        value = (i // 20) % 3
+        start = time.perf_counter()
+        log(value)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--write-ms', type=float, default=0.2, help='time each write to the output takes, in milliseconds')
+    parser.add_argument('--setup', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.setup:
+        ''' This is the child process, it runs one setup and prints the timings '''
+        timings = sorted(run_setup(args.setup, args.messages, args.write_ms / 1000))
+        p50 = timings[len(timings) // 2]
+        p99 = timings[int(len(timings) * 0.99)]
+        print(f'{args.setup}: p50 {p50 * 1e6:.1f}us, p99 {p99 * 1e6:.1f}us, total {sum(timings) * 1000:.1f}ms in the loop', flush=True)
+
+        ''' Exits without waiting for the background thread to write the rest of the queue to the slow output '''
+        os._exit(0)
+
+    for setup in ('basicConfig', 'queue', 'queue + log on change'):
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--setup', setup,
+                        '--messages', str(args.messages), '--write-ms', str(args.write_ms)], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+''' Benchmark - the cost of leaving the loop monitor (lego_trains/loop_monitor.py) switched on.
+
+--tasks tasks each switch in and out of the curio loop (await curio.sleep(0)) as fast as they can for --seconds seconds,
+once without the monitor and once with it (every task tracked, as a train's run and sensor tasks would be).
+The time per task switch is printed for both, along with the time taken to build one scrape of the metrics for --hubs hubs.
+
+Usage:
+    python3 benchmarks/bench_loop_monitor.py --tasks 100 --seconds 3 --hubs 100
+'''
+
+import argparse
+import os
+import sys
+import time
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import curio
+
+from lego_trains.hub_metrics import HubMetrics, HUB_METRICS
+from lego_trains.loop_monitor import LoopMonitor, TaskTimes
+
+
+''' This runs the tasks for the given number of seconds and returns the number of task switches '''
+def run_tasks(tasks, seconds, monitor=None):
+    switches = [0] * tasks
+
+    async def switch(i):
+        while True:
+            await curio.sleep(0)
+            switches[i] += 1
+
+    async def main():
+        running = []
+        for i in range(tasks):
+            running.append(await curio.spawn(switch, i))
+            if monitor is not None:
+                monitor.track(running[-1], f'train_{i}', 'run')
+        if monitor is not None:
+            await curio.spawn(monitor.watchdog, daemon=True)
+        await curio.sleep(seconds)
+        for task in running:
+            await task.cancel()
+
+    curio.run(main, activations=[monitor] if monitor is not None else None)
+    return sum(switches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--hubs', type=int, default=100, help='number of hubs in the metrics scrape')
+    args = parser.parse_args()
+
+    results = {}
+    for label, monitor in (('without monitor', None), ('with monitor', LoopMonitor())):
+        switches = run_tasks(args.tasks, args.seconds, monitor)
+        results[label] = args.seconds / switches
+        print(f'{label}: {switches / args.seconds:.0f} task switches a second, {results[label] * 1e6:.2f}us per switch')
+    print(f'monitor overhead: {(results["with monitor"] - results["without monitor"]) * 1e9:.0f}ns per task switch')
+
+    ''' A scrape is built inside the curio loop, so this is how long it holds up the trains '''
+    monitor = LoopMonitor()
+    for i in range(args.hubs):
+        HUB_METRICS[f'train_{i}'] = HubMetrics(f'train_{i}')
+        HUB_METRICS[f'train_{i}'].notification_to_command.record(0.002)
+        for role in ('run', 'sensor'):
+            monitor.run_times[(f'train_{i}', role)] = TaskTimes()
+    start = time.perf_counter()
+    text = monitor.prometheus()
+    print(f'scrape with {args.hubs} hubs: {(time.perf_counter() - start) * 1000:.2f}ms, {len(text) / 1024:.0f}KB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+''' Benchmark - timing drift and cost of running lesson 1's motion program on many trains at once.
+
+Two ways of running the program are compared:
+    * sleep chains: each train sends a speed step and then sleeps for the step time (as bricknil's ramp_speed does),
+      so every step starts only after the previous command has been sent
+    * shared timer: every train's program is run by the MotionScheduler in lego_trains/motion_profiles.py
+
+Each motor command takes --write-ms milliseconds to send (like a command waiting on the Bluetooth queue).
+For each way the lateness of the last step of each train (compared to when the program says it is due) and the
+CPU time used are printed.
+
+Usage:
+    python3 benchmarks/bench_motion_profiles.py --trains 100 --write-ms 5
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import curio
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lego_trains.motion_profiles import MotionProfile, MotionScheduler, Segment, RAMP_STEP, run_profile
+
+''' This is the motion program from lesson 1 '''
+PROFILE = MotionProfile([Segment(40, ramp=2), Segment(0, ramp=0.5), Segment(-40, ramp=2), Segment(0, ramp=0.5)])
+
+
+''' This stands in for a TrainMotor, it records the time of each command and takes write_seconds to send it '''
+class FakeMotor:
+    def __init__(self, write_seconds):
+        self.write_seconds = write_seconds
+        self.sent = []
+
+    async def set_speed(self, speed):
+        self.sent.append((time.monotonic(), speed))
+        await curio.sleep(self.write_seconds)
+
+''' This runs the program the old way: sleep for the step time, then send the step '''
+async def sleep_chain(motor):
+    for _, speed in PROFILE.timeline:
+        await curio.sleep(RAMP_STEP)
+        await motor.set_speed(speed)
+
+''' This runs every train with one of the two ways, and returns the lateness of each train's last step '''
+async def run_all(trains, write_seconds, shared_timer):
+    motors = [FakeMotor(write_seconds) for _ in range(trains)]
+    motion_scheduler = MotionScheduler()
+    start = time.monotonic()
+    async with curio.TaskGroup() as group:
+        for motor in motors:
+            if shared_timer:
+                await group.spawn(run_profile, motor, PROFILE, motion_scheduler)
+            else:
+                await group.spawn(sleep_chain, motor)
+
+    ''' The last step is due at the time in the timeline (measured from the start of the program) '''
+    last_due = start + PROFILE.timeline[-1][0]
+    return sorted(motor.sent[-1][0] - last_due for motor in motors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trains', type=int, default=100)
+    parser.add_argument('--write-ms', type=float, default=5, help='time each motor command takes to send, in milliseconds')
+    args = parser.parse_args()
+
+    for label, shared_timer in (('sleep chains', False), ('shared timer', True)):
+        cpu_start = time.process_time()
+        lateness = curio.run(run_all, args.trains, args.write_ms / 1000, shared_timer)
+        cpu = time.process_time() - cpu_start
+        print(f'{label}: {args.trains} trains, last step late by p50 {lateness[len(lateness) // 2] * 1000:.1f}ms, '
+              f'max {lateness[-1] * 1000:.1f}ms, CPU {cpu * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+''' Benchmark - how consistently lesson 3's train stops in front of an object, with and without predictive braking (lego_trains/braking.py).
+
+Lesson 3's Train (with its real run function, rules and braking controller) is run on a simulated hub (see lego_trains/sim_hub.py)
+approaching an object on a simulated track:
+    * the motor follows its speed with a lag (time constant --tau seconds), and speed units become track units with --scale.
+      At speed 0 the motor runs freely, and the train only slows down through friction (--friction units a second, each second)
+    * the sensor reports the distance rounded down to whole units (0 to 10), only when it changes, and each reading
+      arrives after a random delay of up to --jitter seconds (Bluetooth)
+    * each run the train is sent a random speed between --min-speed and --max-speed after it starts (like trains carrying
+      different loads), and is already moving at that speed when it is --start units from the object (within the sensor's
+      range, as lesson 3 stops the train once the distance reads 10)
+
+Each run stops once the train is standing still (or moving backwards). It reports the gap left to the object at that point
+(a gap below 0 means the train hit the object), and the time from the first reading of the object to standing still. The mean and spread (standard deviation) of both are printed for --runs runs, with braking off and on.
+The controller aims to stop the train in the middle of its target distance (a gap of 1.5).
+
+Most of the time to standing still is the approach at full speed, and it differs between runs with the speed of each run,
+so for braking on, the change in time compared with the same run (same speed and seed) with braking off is also printed,
+along with the number of runs that were quicker. The time is only cut a little (the train keeps its speed until it brakes hard,
+and stops short of where it would have stopped), the main difference is the smaller spread of the gap and no hits.
+
+Usage:
+    python3 benchmarks/bench_predictive_braking.py --runs 30
+'''
+
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+import curio
+
+''' This lets the benchmark import the lessons and modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lesson3
+from lego_trains.sim_hub import SimHub
+
+''' How often the simulated track is moved on, in seconds '''
+TICK = 0.005
+
+
+''' This runs the train once, and returns the gap it stopped at and the time from first seeing the object to standing still '''
+async def run_once(args, speed, braking, seed):
+    rng = random.Random(seed)
+    sim = SimHub(lesson3.Train(f'sim_train_{seed}', ble_id='00:00:00:00:00:00'))
+    sim.hub.braking.enabled = braking
+    motor = sim.hub.peripherals['motor']
+    await sim.connect()
+    run_task = await curio.spawn(sim.hub.run)
+    while motor.speed == 0:
+        await curio.sleep(TICK)
+    await sim.hub.motor.set_speed(speed)
+
+    gap = args.start
+    velocity = speed * args.scale
+    reading = None
+    seen_at = None
+    deliveries = []
+
+    ''' Each reading is passed to the train after its own delay, in the order they were taken '''
+    async def deliver(value, delay):
+        await curio.sleep(delay)
+        await sim.feed('sense_distance', value)
+
+    last = time.monotonic()
+    while True:
+        await curio.sleep(TICK)
+        now = time.monotonic()
+        dt = now - last
+        last = now
+
+        if motor.speed == 0:
+            velocity = max(0.0, velocity - args.friction * dt)
+        else:
+            velocity += (motor.speed * args.scale - velocity) * min(1.0, dt / args.tau)
+        gap -= velocity * dt
+
+        new_reading = max(0, min(10, int(gap)))
+        if new_reading != reading:
+            reading = new_reading
+            if seen_at is None:
+                seen_at = now
+            deliveries.append(await curio.spawn(deliver, reading, rng.uniform(0, args.jitter), daemon=True))
+        if seen_at is not None and velocity <= 0:
+            break
+
+    for task in deliveries:
+        await task.cancel()
+    await run_task.cancel()
+    return gap, now - seen_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--min-speed', type=int, default=15)
+    parser.add_argument('--max-speed', type=int, default=35)
+    parser.add_argument('--start', type=float, default=9.5, help='starting distance from the object, in sensor units')
+    parser.add_argument('--scale', type=float, default=0.5, help='sensor units a second for each unit of motor speed')
+    parser.add_argument('--tau', type=float, default=0.15, help='time constant of the motor, in seconds')
+    parser.add_argument('--friction', type=float, default=10, help='slowing down while the motor runs freely, in units a second each second')
+    parser.add_argument('--jitter', type=float, default=0.03, help='largest delay of a sensor reading, in seconds')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    speeds = [random.Random(run).randint(args.min_speed, args.max_speed) for run in range(args.runs)]
+    print(f'{"braking":8} {"gap mean":>9} {"gap spread":>11} {"hits":>5} {"seen to still ms":>17} {"spread ms":>10} {"vs off ms":>10} {"quicker":>8}')
+    times_off = None
+    for braking in (False, True):
+        results = [curio.run(run_once, args, speed, braking, run) for run, speed in enumerate(speeds)]
+        gaps = [gap for gap, _ in results]
+        times = [seconds * 1000 for _, seconds in results]
+        line = (f'{"on" if braking else "off":8} {statistics.mean(gaps):>9.2f} {statistics.stdev(gaps):>11.2f} '
+                f'{sum(gap < 0 for gap in gaps):>5} {statistics.mean(times):>17.0f} {statistics.stdev(times):>10.0f}')
+        if times_off is None:
+            times_off = times
+        else:
+            ''' The change in time of each run compared with the same run with braking off '''
+            changes = [on - off for on, off in zip(times, times_off)]
+            line += f' {statistics.mean(changes):>+10.0f} {sum(change < 0 for change in changes):>4}/{len(changes):<3}'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
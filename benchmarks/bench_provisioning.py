@@ -0,0 +1,71 @@
+''' Benchmark - the time from starting up to having the list of hubs to connect to, when new hubs are set up headless (lego_trains/provisioning.py).
+
+For each number of hubs in --hubs, a mapping file is made in a temporary folder where every hub has just been found by the scan
+(so they are all new). Half of them are also in a CSV manifest with their names and settings, the other half are not.
+get_hubs (lego_trains/hubs.py) is then timed in headless mode: the manifest is read, the hubs in it are named, and the rest
+keep their automatic names and are queued for naming later.
+
+Naming the same hubs at the prompt instead would hold up the start up for as long as it takes someone to type each name,
+this is shown for --seconds-per-name seconds a hub (and is forever if no one is there).
+
+Usage:
+    python3 benchmarks/bench_provisioning.py --hubs 10,100,1000 --repeats 20
+'''
+
+import argparse
+import csv
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lego_trains.hub_registry import HubRegistry
+from lego_trains.hubs import get_hubs
+from lego_trains.provisioning import pending_hubs
+
+
+''' This makes the mapping file (every hub new) and the manifest (every other hub) for the given number of hubs '''
+def make_files(folder, hubs):
+    ble_ids = [f'90:84:2B:00:{i // 256:02X}:{i % 256:02X}' for i in range(hubs)]
+    mapping_file = os.path.join(folder, 'hub_mapping.json')
+    registry = HubRegistry(mapping_file)
+    registry.add_new(ble_ids)
+    registry.save()
+
+    manifest_file = os.path.join(folder, 'manifest.csv')
+    with open(manifest_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ble_id', 'hub_name', 'speed', 'distance_thresholds'])
+        for i, ble_id in enumerate(ble_ids[::2]):
+            writer.writerow([ble_id, f'loco_{i}', 20 + i % 10, '[2, 9.5]'])
+    return mapping_file, manifest_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hubs', default='10,100,1000', help='numbers of hubs, separated by commas')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--seconds-per-name', type=float, default=5, help='time taken to type a name at the prompt')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f'{"hubs":>6} {"headless ms":>12} {"spread ms":>10} {"queued":>7} {"at the prompt s":>16}')
+    for hubs in [int(n) for n in args.hubs.split(',')]:
+        times = []
+        for _ in range(args.repeats):
+            with tempfile.TemporaryDirectory() as folder:
+                mapping_file, manifest_file = make_files(folder, hubs)
+                start = time.perf_counter()
+                get_hubs(mapping_file, manifest_file, interactive=False)
+                times.append((time.perf_counter() - start) * 1000)
+                queued = len(pending_hubs(HubRegistry(mapping_file)))
+        print(f'{hubs:>6} {statistics.mean(times):>12.2f} {statistics.stdev(times):>10.2f} {queued:>7} {queued * args.seconds_per_name:>16.0f}')
+
+
+if __name__ == '__main__':
+    main()
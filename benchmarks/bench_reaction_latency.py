@@ -0,0 +1,77 @@
+''' Benchmark - sensor-to-motor reaction latency (p50/p99) of each lesson's run() logic, using the simulated hub backend in lego_trains/sim_hub.py.
+
+Each lesson's Train is run against a sensor trace (either a recorded trace file passed with --trace-lesson2/--trace-lesson3,
+or the built-in traces below) and the time from each sensor notification to the motor/LED command it caused is measured.
+Lesson 1 has no sensor, so only its commands are reported.
+
+Usage:
+    python3 benchmarks/bench_reaction_latency.py --repeats 20 --speed 10
+'''
+
+import argparse
+import importlib
+import logging
+import os
+import sys
+
+import curio
+
+''' This lets the benchmark import the lessons and modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lego_trains.sim_hub import simulate, load_trace, percentile
+
+''' Lesson 2 trace: the train moves along black track (with a wrong yellow reading at 0.5 seconds that only lasts 0.01 seconds,
+which the sensor filter ignores), reaches the yellow marker (reverse), then the blue marker (stop).
+Like a real hub, a reading is only sent when the colour changes '''
+LESSON2_TRACE = {'capability': 'sense_color',
+                 'samples': [[0.1, 0], [0.5, 7], [0.51, 0], [1.0, 7], [1.3, 0], [2.0, 3]]}
+
+''' Lesson 3 trace: the train approaches an object (with a wrong reading of 1 at 0.3 seconds that only lasts 0.01 seconds),
+reverses once the distance drops to 1, and stops once the distance reaches 10 '''
+LESSON3_TRACE = {'capability': 'sense_distance',
+                 'samples': [[0.1, 6], [0.2, 5], [0.3, 1], [0.31, 5], [0.4, 4], [0.5, 3], [0.6, 2], [0.7, 1],
+                             [1.0, 2], [1.1, 3], [1.2, 7], [1.5, 10]]}
+
+
+''' This runs one lesson a number of times and returns all of the reaction latencies and the number of commands sent '''
+def bench_lesson(module_name, trace, repeats, speed):
+    lesson = importlib.import_module(module_name)
+    latencies = []
+    commands = 0
+    for _ in range(repeats):
+        sim = curio.run(simulate, lesson.Train, trace, module_name, '00:00:00:00:00:00', speed, 1.0)
+        latencies.extend(sim.reaction_latencies())
+        commands += len(sim.commands)
+    return latencies, commands
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--speed', type=float, default=1.0, help='replay the traces this many times faster than recorded')
+    parser.add_argument('--trace-lesson2', help='recorded sense_color trace to use for lesson 2')
+    parser.add_argument('--trace-lesson3', help='recorded sense_distance trace to use for lesson 3')
+    parser.add_argument('--skip-lesson1', action='store_true', help='lesson 1 always takes 5 seconds, as it only uses sleeps')
+    args = parser.parse_args()
+
+    lessons = [('lesson2', load_trace(args.trace_lesson2) if args.trace_lesson2 else LESSON2_TRACE, args.repeats),
+               ('lesson3', load_trace(args.trace_lesson3) if args.trace_lesson3 else LESSON3_TRACE, args.repeats)]
+    if not args.skip_lesson1:
+        lessons.insert(0, ('lesson1', None, 1))
+
+    for module_name, trace, repeats in lessons:
+        latencies, commands = bench_lesson(module_name, trace, repeats, args.speed)
+
+        ''' The lessons set the logging level to INFO when imported, this turns it back down so the results are readable '''
+        logging.getLogger().setLevel(logging.WARNING)
+
+        if latencies:
+            print(f'{module_name}: {len(latencies)} reactions, {commands} commands, '
+                  f'p50 {percentile(latencies, 50) * 1000:.3f}ms, p99 {percentile(latencies, 99) * 1000:.3f}ms')
+        else:
+            print(f'{module_name}: no sensor reactions (no sensor attached), {commands} commands')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+''' Benchmark - the time taken to find what to do with a new sensor value, with an if/elif ladder and with the reaction rules
+(lego_trains/reaction_rules.py), as the number of markers on the layout grows.
+
+For each number of markers in --markers, --lookups random values are looked up:
+    * ladder: the markers are checked one after the other (like an if/elif ladder in Train.run), exact values and then ranges
+    * rules: the markers are made into a RuleTable (exact values in a dict, ranges found with bisect)
+Half the markers are exact values (like colours) and half are ranges (like distances). The time per lookup is printed for both,
+along with the memory used by each train's RuleRunner (the table itself is shared by every train).
+
+Usage:
+    python3 benchmarks/bench_reaction_rules.py --markers 4,16,64,256 --lookups 200000
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lego_trains.reaction_rules import RuleTable, RuleRunner, Rule, Range
+
+
+''' This makes the rules for the given number of markers: exact values 0, 1, 2... and ranges of width 10 after them '''
+def make_rules(markers):
+    exact = markers // 2
+    rules = [Rule(value, speed=value) for value in range(exact)]
+    rules += [Rule(Range(exact + i * 10, exact + i * 10 + 9), speed=i) for i in range(markers - exact)]
+    return rules
+
+''' This finds the rule for a value by checking each marker in turn, the same as an if/elif ladder '''
+def ladder_lookup(rules, value):
+    for rule in rules:
+        if isinstance(rule.match, Range):
+            if rule.match.low <= value <= rule.match.high:
+                return rule
+        elif value == rule.match:
+            return rule
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--markers', default='4,16,64,256', help='numbers of markers, separated by commas')
+    parser.add_argument('--lookups', type=int, default=200_000)
+    args = parser.parse_args()
+
+    print(f'{"markers":>8} {"ladder ns":>10} {"rules ns":>9}')
+    for markers in [int(n) for n in args.markers.split(',')]:
+        rules = make_rules(markers)
+        table = RuleTable('distance', start='running', states={'running': rules})
+        dispatch = table.states['running']
+        highest = rules[-1].match.high
+        values = [random.randint(0, int(highest)) for _ in range(args.lookups)]
+
+        start = time.perf_counter()
+        for value in values:
+            ladder_lookup(rules, value)
+        ladder = (time.perf_counter() - start) / args.lookups
+
+        start = time.perf_counter()
+        for value in values:
+            dispatch.lookup(value)
+        table_time = (time.perf_counter() - start) / args.lookups
+        print(f'{markers:>8} {ladder * 1e9:>10.0f} {table_time * 1e9:>9.0f}')
+
+    ''' The memory of 1000 RuleRunners (one for each train), without the hubs themselves '''
+    tracemalloc.start()
+    runners = [RuleRunner(None, table) for _ in range(1000)]
+    print(f'RuleRunner: {tracemalloc.get_traced_memory()[0] / len(runners):.0f} bytes per train')
+    tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+''' Benchmark - reconnecting dropped hubs with lego_trains/reconnect.py, while the other trains keep running.
+
+--trains trains from lesson 3 are run on simulated hubs (see lego_trains/sim_hub.py). Every --interval seconds one of them
+drops its connection: its motor stops (as a real hub's motor does) and its ble_id is put on the disconnects queue, as the
+Bluetooth bridge does (see lego_trains/fleet_bleak.py), where the ReconnectManager's watch picks it up and reconnects it.
+The connection is simulated, it takes --connect-ms milliseconds. Meanwhile the other trains are sent distance readings and keep reacting: each one runs up to the reverse distance, reverses
+back to the stop distance and stops, and is then started again.
+
+The reconnect time of each drop (p50/max), whether each dropped train got its speed back (the last speed its command layer
+sent, which may have changed while it was away if the train was still being sent readings), and the number of commands the
+other trains sent while a hub was reconnecting are printed.
+
+Usage:
+    python3 benchmarks/bench_reconnect.py --trains 10 --drops 5 --connect-ms 200
+'''
+
+import argparse
+import logging
+import os
+import sys
+
+import curio
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lesson3
+from lego_trains.reaction_rules import RuleRunner
+from lego_trains.reconnect import ReconnectManager
+from lego_trains.sim_hub import SimHub
+
+
+''' This stands in for the FleetConnector in lego_trains/fleet.py, connecting takes connect_seconds '''
+class SimConnector:
+    def __init__(self, connect_seconds):
+        self.connect_seconds = connect_seconds
+        self.attempts = {}
+
+    async def connect(self, hub, seen=False):
+        self.attempts[hub.hub_name] = 1
+        await curio.sleep(self.connect_seconds)
+
+
+''' This runs a train's run function, and starts it again (from the running state) each time it stops '''
+async def keep_running(sim):
+    while True:
+        sim.hub.rules = RuleRunner(sim.hub, sim.hub.reaction_rules)
+        await sim.hub.run()
+
+''' This sends a train distance readings that take it back and forth between the objects (1 reverses it, 10 stops it) '''
+async def keep_moving(sim):
+    distances = [5, 1, 5, 10]
+    i = 0
+    while True:
+        await sim.feed('sense_distance', distances[i % len(distances)])
+        i += 1
+        await curio.sleep(0.05)
+
+''' This returns True if the motor is back at the last speed sent to it (a ramp counts once it has been sent again, as it takes a while to reach its speed) '''
+def speed_restored(hub, motor):
+    last_sent = hub.commands.last_sent.get((motor.name, 'speed'))
+    return last_sent is not None and (last_sent[0] == 'ramp_speed' or motor.speed == last_sent[1])
+
+async def run(trains, drops, interval, connect_seconds):
+    sims = [SimHub(lesson3.Train(f'train_{i}', ble_id=f'00:00:00:00:00:{i:02x}')) for i in range(trains)]
+    tasks = []
+    for sim in sims:
+        await sim.connect()
+        tasks.append(await curio.spawn(keep_running, sim))
+    for sim in sims[1:]:
+        tasks.append(await curio.spawn(keep_moving, sim))
+    await curio.sleep(0.5)
+
+    manager = ReconnectManager(SimConnector(connect_seconds))
+    disconnects = curio.UniversalQueue()
+    tasks.append(await curio.spawn(manager.watch, disconnects, [sim.hub for sim in sims]))
+    restored = 0
+    others_during = 0
+    for drop in range(drops):
+        sim = sims[drop % len(sims)]
+        motor = sim.hub.peripherals['motor']
+
+        ''' The hub drops out, its motor stops '''
+        motor.speed = 0
+        others_before = sum(len(other.commands) for other in sims if other is not sim)
+        reconnects_before = len(manager.events)
+        await disconnects.put(sim.hub.ble_id)
+        while len(manager.events) == reconnects_before:
+            await curio.sleep(0.001)
+        others_during += sum(len(other.commands) for other in sims if other is not sim) - others_before
+        restored += speed_restored(sim.hub, motor)
+        await curio.sleep(interval)
+
+    for task in tasks:
+        await task.cancel()
+    return manager.events, restored, others_during
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trains', type=int, default=10)
+    parser.add_argument('--drops', type=int, default=5)
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between the drops')
+    parser.add_argument('--connect-ms', type=float, default=200, help='time a simulated connection takes, in milliseconds')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    events, restored, others_during = curio.run(run, args.trains, args.drops, args.interval, args.connect_ms / 1000)
+    if args.trains > 1:
+        assert others_during > 0, 'the other trains sent no commands while a hub was reconnecting'
+    seconds = sorted(event['seconds'] for event in events)
+    print(f'{len(events)} reconnects: p50 {seconds[len(seconds) // 2] * 1000:.1f}ms, max {seconds[-1] * 1000:.1f}ms, '
+          f'speed restored {restored}/{len(events)}, {others_during} commands from the other trains while reconnecting')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+''' Benchmark - sensor notifications with fixed capabilities and with the sensor modes switched by state (lego_trains/sensor_modes.py).
+
+Each simulated train runs along a track with coloured markers, then slows down for a buffer stop once it sees the red
+marker and stops when the distance sensor says the buffer is close. While it is moving, the colour changes at each
+marker and the distance wobbles between 9 and 10 (nothing in range), then falls as the train reaches the buffer.
+
+    * fixed: the sensor reports colour and distance for the whole run (combined mode), every change of either is a notification
+    * switched: the Train only switches on the capability its current state needs (colour between markers, distance
+      approaching the buffer, nothing once stopped), run on a SimHub (lego_trains/sim_hub.py) which drops the readings
+      the hub would not send
+
+For --hubs trains the notifications (train_sensor_change calls) and the messages sent to the hubs are printed.
+
+Usage:
+    python3 benchmarks/bench_sensor_modes.py --hubs 10
+'''
+
+import argparse
+import logging
+import os
+import random
+import sys
+
+import curio
+from bricknil import attach
+from bricknil.sensor import TrainMotor, VisionSensor
+from bricknil.const import Color
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lego_trains.train import TrainHub
+from lego_trains.sim_hub import SimHub
+
+
+''' This is the train, it watches for the red marker and then for the buffer stop '''
+@attach(TrainMotor, name='motor')
+@attach(VisionSensor, name='train_sensor', capabilities=['sense_color'])
+class ShuttleTrain(TrainHub):
+    sensor_states = {
+        'between_markers': {'train_sensor': ['sense_color']},
+        'approaching_buffer': {'train_sensor': ['sense_distance']},
+        'stopped': {'train_sensor': []},
+    }
+
+    def __init__(self, name, ble_id):
+        super().__init__(name, ble_id)
+        self.colour = None
+        self.distance = None
+
+    async def run(self):
+        await self.sensor_modes.enter('between_markers')
+        await self.motor.set_speed(20)
+        await self.wait_for_colour(Color.red)
+        await self.sensor_modes.enter('approaching_buffer')
+        await self.motor.set_speed(10)
+        await self.wait_for_distance(lambda distance: distance <= 2)
+        await self.motor.set_speed(0)
+        await self.sensor_modes.enter('stopped')
+
+    async def train_sensor_change(self):
+        ''' Only the capability switched on in the current state is read '''
+        value = self.train_sensor.value
+        if VisionSensor.capability.sense_color in value:
+            self.colour = Color(value[VisionSensor.capability.sense_color])
+        if VisionSensor.capability.sense_distance in value:
+            self.distance = value[VisionSensor.capability.sense_distance]
+        await self.notify_sensor_change()
+
+
+''' This makes the readings for one run: (seconds from the start, capability, value), for both capabilities '''
+def make_readings(seed, markers=20, marker_gap=0.05, wobble=0.01):
+    rng = random.Random(seed)
+    colours = [Color.blue, Color.green, Color.yellow, Color.white]
+    readings = []
+    t = 0
+    for marker in range(markers):
+        readings.append((t, 'sense_color', colours[marker % len(colours)].value))
+        readings.append((t + marker_gap / 2, 'sense_color', Color.black.value))
+        t += marker_gap
+    readings.append((t, 'sense_color', Color.red.value))
+    buffer_time = t + marker_gap
+
+    ''' The distance wobbles while nothing is in range, then falls as the buffer gets close '''
+    wobble_time = 0
+    while wobble_time < buffer_time:
+        readings.append((wobble_time, 'sense_distance', rng.choice((9, 10))))
+        wobble_time += wobble
+    for step, distance in enumerate(range(8, -1, -1)):
+        readings.append((buffer_time + step * marker_gap, 'sense_distance', distance))
+    return sorted(readings)
+
+''' This counts the notifications with both capabilities reported for the whole run (a notification for every change of either) '''
+def fixed_notifications(readings):
+    last = {}
+    notifications = 0
+    for _, capability, value in readings:
+        if last.get(capability) != value:
+            notifications += 1
+        last[capability] = value
+    return notifications
+
+''' This runs one train on a SimHub, feeding it the readings on their timing '''
+async def run_switched(i, readings):
+    sim = SimHub(ShuttleTrain(f'train_{i}', ble_id=f'00:00:00:00:00:{i:02x}'))
+    await sim.connect()
+    run_task = await curio.spawn(sim.hub.run)
+    start = await curio.clock()
+    for t, capability, value in readings:
+        delay = start + t - await curio.clock()
+        if delay > 0:
+            await curio.sleep(delay)
+        await sim.feed(capability, value)
+    await curio.ignore_after(1, run_task.wait)
+    await run_task.cancel()
+    return sim
+
+async def run_all(hubs):
+    async with curio.TaskGroup() as group:
+        for i in range(hubs):
+            await group.spawn(run_switched, i, make_readings(i))
+    return [task.result for task in group.tasks]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hubs', type=int, default=10)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    fixed = sum(fixed_notifications(make_readings(i)) for i in range(args.hubs))
+    print(f'fixed: {args.hubs} hubs, {fixed} notifications')
+
+    sims = curio.run(run_all, args.hubs)
+    notifications = sum(len(sim.notifications) for sim in sims)
+    writes = sum(sim.ble_writes for sim in sims)
+    switches = sum(sim.hub.sensor_modes.switches for sim in sims)
+    print(f'switched: {args.hubs} hubs, {notifications} notifications, {writes} messages sent to the hubs ({switches} mode switches)')
+
+
+if __name__ == '__main__':
+    main()
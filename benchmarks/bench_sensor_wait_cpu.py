@@ -0,0 +1,103 @@
+''' Benchmark - measures how much processor time each train uses while it waits for a sensor value.
+
+It compares the old busy-poll loop (While loop with curio.sleep(0) and logging.info on every pass) with the
+event-driven wait_for_colour from lego_trains/sensor_waits.py. No hubs are needed, the sensor readings are faked.
+
+Usage:
+    python3 benchmarks/bench_sensor_wait_cpu.py --trains 4 --seconds 5 --rate 10
+'''
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import curio
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lego_trains.sensor_waits import SensorWaitMixin
+
+''' These are the colour values used by the fake sensor (the same numbers as bricknil's Color enum) '''
+BLACK = 0
+BLUE = 3
+
+
+''' This is a copy of the old Train.run loop from lesson2, which checks the colour over and over '''
+class PollingTrain:
+    def __init__(self):
+        self.colour = None
+        self.keep_running = True
+
+    async def run(self):
+        while self.keep_running:
+            logging.info(self.colour)
+            if self.colour == BLUE:
+                self.keep_running = False
+            else:
+                await curio.sleep(0)
+
+    async def train_sensor_change(self, colour):
+        self.colour = colour
+
+
+''' This is the same train using the event-driven wait_for_colour '''
+class WaitingTrain(SensorWaitMixin):
+    def __init__(self):
+        super().__init__()
+        self.colour = None
+        self.keep_running = True
+
+    async def run(self):
+        while self.keep_running:
+            colour = await self.wait_for_colour(BLUE)
+            logging.info(colour)
+            self.keep_running = False
+
+    async def train_sensor_change(self, colour):
+        self.colour = colour
+        await self.notify_sensor_change()
+
+
+''' This fakes the sensor, sending a reading at the given rate and then the stop colour at the end '''
+async def feed_sensor(train, seconds, rate):
+    interval = 1 / rate
+    readings = int(seconds * rate)
+    for _ in range(readings):
+        await curio.sleep(interval)
+        await train.train_sensor_change(BLACK)
+    await train.train_sensor_change(BLUE)
+
+
+''' This runs all the trains until they have stopped and returns the processor time used '''
+async def run_trains(train_class, trains, seconds, rate):
+    fleet = [train_class() for _ in range(trains)]
+    start_cpu = time.process_time()
+    async with curio.TaskGroup() as group:
+        for train in fleet:
+            await group.spawn(train.run)
+            await group.spawn(feed_sensor, train, seconds, rate)
+    return time.process_time() - start_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trains', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rate', type=float, default=10, help='sensor readings per second for each train')
+    args = parser.parse_args()
+
+    ''' Sends the INFO logs to nowhere, so we measure the cost of logging without filling the screen '''
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, 'w'))
+
+    for label, train_class in (('busy-poll', PollingTrain), ('wait_for_colour', WaitingTrain)):
+        cpu_seconds = curio.run(run_trains, train_class, args.trains, args.seconds, args.rate)
+        per_train = cpu_seconds / args.trains / args.seconds
+        print(f'{label:16} {args.trains} trains: {cpu_seconds:.3f}s CPU in {args.seconds}s, '
+              f'{per_train * 100:.2f}% of a core per train')
+
+
+if __name__ == '__main__':
+    main()
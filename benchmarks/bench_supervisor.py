@@ -0,0 +1,81 @@
+''' Benchmark - supervisor mode (lego_trains/supervisor.py) with simulated hubs: command round trip and recovery from a crashed worker.
+
+The lesson is run with --hubs simulated hubs shared between --workers worker processes. Once every worker has sent its
+status, the benchmark:
+    * sends a fleet-wide set_speed command --commands times, and prints the time until every worker has acknowledged it (p50/max)
+    * kills one worker, and prints the time until it has been restarted and sent its status again,
+      and checks the other workers were left running (same process id)
+
+Usage:
+    python3 benchmarks/bench_supervisor.py --hubs 40 --workers 4
+'''
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+
+import curio
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lego_trains.supervisor import Supervisor
+
+
+''' This waits until every worker has sent a status that includes its trains '''
+async def wait_for_status(supervisor):
+    while not all(worker.status.get('trains') for worker in supervisor.workers):
+        await curio.sleep(0.01)
+
+async def run(lesson, hubs, workers, commands):
+    hubs_data = [{'hub_name': f'sim_train_{i}', 'ble_id': f'00:00:00:00:{i // 256:02x}:{i % 256:02x}'} for i in range(hubs)]
+    supervisor = Supervisor(lesson, hubs_data, workers, sim=True)
+    await supervisor.start()
+    try:
+        start = time.monotonic()
+        await wait_for_status(supervisor)
+        print(f'{hubs} hubs on {len(supervisor.workers)} workers running after {time.monotonic() - start:.2f}s')
+
+        round_trips = []
+        for i in range(commands):
+            start = time.monotonic()
+            acks = await supervisor.broadcast('set_speed', speed=10 + i % 10)
+            round_trips.append(time.monotonic() - start)
+            assert all(acks), 'a worker did not acknowledge the command'
+        round_trips.sort()
+        print(f'fleet-wide command: p50 {round_trips[len(round_trips) // 2] * 1000:.2f}ms, max {round_trips[-1] * 1000:.2f}ms')
+
+        ''' One worker is killed, the others should keep running '''
+        crashed = supervisor.workers[0]
+        others = {worker.index: worker.process.pid for worker in supervisor.workers[1:]}
+        start = time.monotonic()
+        os.kill(crashed.process.pid, signal.SIGKILL)
+        while crashed.restarts == 0:
+            await curio.sleep(0.01)
+        await wait_for_status(supervisor)
+        untouched = all(supervisor.workers[index].process.pid == pid for index, pid in others.items())
+        print(f'crashed worker running again after {time.monotonic() - start:.2f}s, other workers untouched: {untouched}')
+    finally:
+        await supervisor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lesson', default='lesson2')
+    parser.add_argument('--hubs', type=int, default=40)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--commands', type=int, default=50)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    ''' The workers run the lesson from the top level folder, the same as python3 -m lego_trains '''
+    os.chdir(ROOT)
+    curio.run(run, args.lesson, args.hubs, args.workers, args.commands)
+
+
+if __name__ == '__main__':
+    main()
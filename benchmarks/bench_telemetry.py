@@ -0,0 +1,63 @@
+''' Benchmark - cost and memory of recording telemetry with lego_trains/telemetry.py, compared to keeping every record in a list.
+
+--records values are recorded for one hub both ways:
+    * list: each record is a (time, hub, kind, value) tuple appended to a list (the memory grows with every record)
+    * telemetry: each record is packed into the hub's buffer, which is copied to a memory-mapped file of --file-records records
+
+For each way the time per record and the memory still allocated at the end (measured with tracemalloc) are printed.
+
+Usage:
+    python3 benchmarks/bench_telemetry.py --records 1000000 --file-records 100000
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+''' This lets the benchmark import modules from the top level folder of the repository '''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lego_trains.telemetry import TelemetryFile, HubTelemetry
+
+
+''' This records the values by appending a tuple to a list '''
+def record_list(records):
+    telemetry = []
+    for i in range(records):
+        telemetry.append((time.monotonic(), 0, 1, i % 11))
+    return telemetry
+
+''' This records the values into a telemetry file '''
+def record_telemetry(records, recorder):
+    for i in range(records):
+        recorder.record('train_sensor.sense_color', i % 11)
+    recorder.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=1_000_000)
+    parser.add_argument('--file-records', type=int, default=100_000, help='number of records the telemetry file holds')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        session = TelemetryFile(os.path.join(folder, 'session.tel'), capacity=args.file_records)
+        recorder = HubTelemetry(session, 'train_1')
+
+        for label, record in (('list', lambda: record_list(args.records)), ('telemetry', lambda: record_telemetry(args.records, recorder))):
+            tracemalloc.start()
+            start = time.perf_counter()
+            kept = record()
+            elapsed = time.perf_counter() - start
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del kept
+            print(f'{label}: {elapsed / args.records * 1e6:.2f}us per record, {memory / 1024:.0f}KB allocated after {args.records} records')
+        session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+''' This script is a long running discovery service, which keeps scanning for Smart Hubs in the background.
+
+Rather than every lesson starting scan_hubs.py (which has to start Python, import bleak and then scan for a full second),
+the daemon keeps a table of the Smart Hubs it has seen recently and answers the lessons over a local Unix socket,
+so a lesson can read a fresh list of hubs in a few milliseconds.
+
+Start it once (in its own terminal, or as a service) before running the lessons:
+
+    python3 discovery_daemon.py --ttl 30
+
+The daemon is the only process that imports bleak, the lessons talk to it with lego_trains/discovery_client.py (which does not),
+as bleak conflicts with bricknil when they are both used in the same script. '''
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from lego_trains.discovery_client import SOCKET_PATH
+from scan_hubs import is_smart_hub
+
+''' This sets the logging level (can be changed from INFO to DEBUG or CRITICAL etc. if preferred) '''
+logging.basicConfig(level=logging.INFO)
+
+
+''' This is the table of Smart Hubs that have been seen, each entry is dropped once it has not been seen for ttl seconds '''
+class DiscoveryCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hubs = {}
+
+    ''' This is called every time a Smart Hub advertisement is received '''
+    def seen(self, ble_id, name, rssi):
+        if ble_id not in self.hubs:
+            logging.info(f'Found {name} ({ble_id})')
+        self.hubs[ble_id] = {'ble_id': ble_id, 'name': name, 'rssi': rssi, 'last_seen': time.time()}
+
+    ''' This returns the hubs seen within the last ttl seconds, strongest signal (RSSI) first '''
+    def fresh(self):
+        now = time.time()
+        for ble_id in [ble_id for ble_id, hub in self.hubs.items() if now - hub['last_seen'] > self.ttl]:
+            logging.info(f'{self.hubs[ble_id]["name"]} ({ble_id}) has not been seen for {self.ttl} seconds')
+            del self.hubs[ble_id]
+        return sorted(self.hubs.values(), key=lambda hub: hub['rssi'] if hub['rssi'] is not None else -999, reverse=True)
+
+
+''' This keeps scanning until the daemon is stopped '''
+async def scan_forever(cache, scan_window):
+    from bleak import BleakScanner
+
+    ''' This is called by bleak for every advertisement it receives '''
+    def on_detect(device, advertisement_data):
+        if is_smart_hub(device.name):
+            cache.seen(device.address, device.name, advertisement_data.rssi)
+
+    ''' The scan is restarted every scan_window seconds, as some Bluetooth adapters stop reporting devices they have already seen '''
+    while True:
+        scanner = BleakScanner(detection_callback=on_detect)
+        await scanner.start()
+        try:
+            await asyncio.sleep(scan_window)
+        finally:
+            await scanner.stop()
+
+''' This answers a request from a lesson (sent by lego_trains/discovery_client.py) '''
+async def handle_client(cache, reader, writer):
+    try:
+        request = (await reader.readline()).decode().strip()
+        if request == 'hubs':
+            response = {'ttl': cache.ttl, 'hubs': cache.fresh()}
+        else:
+            response = {'error': f'unknown request {request!r}'}
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+    finally:
+        writer.close()
+
+''' This starts the socket server and the background scan '''
+async def run_daemon(socket_path, ttl, scan_window):
+    cache = DiscoveryCache(ttl)
+
+    ''' Removes the socket file left behind if the daemon was stopped before, then creates the hubs folder if needed '''
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+    server = await asyncio.start_unix_server(lambda reader, writer: handle_client(cache, reader, writer), path=socket_path)
+    logging.info(f'Discovery daemon listening on {socket_path}')
+    try:
+        async with server:
+            await scan_forever(cache, scan_window)
+    finally:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keeps scanning for Smart Hubs and answers the lessons over a Unix socket')
+    parser.add_argument('--socket', default=SOCKET_PATH, help='path of the Unix socket')
+    parser.add_argument('--ttl', type=float, default=30, help='seconds a hub stays in the table after it was last seen')
+    parser.add_argument('--scan-window', type=float, default=5, help='seconds between scan restarts')
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_daemon(args.socket, args.ttl, args.scan_window))
+    except KeyboardInterrupt:
+        pass
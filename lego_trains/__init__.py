@@ -0,0 +1,66 @@
+''' This package holds the code shared by the lessons (lesson1.py, lesson2.py ...) and the command line tool (python3 -m lego_trains).
+
+Importing bricknil, curio and pydantic takes a noticeable part of a second on a Raspberry Pi, so nothing is imported
+when the package itself is imported. Each name below is only imported from its module the first time it is used
+(e.g. lego_trains.HubRegistry only imports hub_registry.py, which uses the standard library alone), so tools that
+only read the mapping file start straight away. '''
+
+import importlib
+
+''' This maps each name the package provides to the module it comes from '''
+_EXPORTS = {
+    'HubRegistry': 'hub_registry',
+    'MAPPING_FILE': 'hub_registry',
+    'fetch_cached_hubs': 'discovery_client',
+    'update_mapping_from_daemon': 'discovery_client',
+    'get_hubs': 'hubs',
+    'update_mapping_file': 'hubs',
+    'run_ble_scan': 'hubs',
+    'load_manifest': 'provisioning',
+    'apply_manifest': 'provisioning',
+    'headless': 'provisioning',
+    'SensorWaitMixin': 'sensor_waits',
+    'SensorFilter': 'sensor_filter',
+    'SensorModes': 'sensor_modes',
+    'RuleTable': 'reaction_rules',
+    'Rule': 'reaction_rules',
+    'Range': 'reaction_rules',
+    'HubCommands': 'motor_commands',
+    'FleetBus': 'command_bus',
+    'fleet_bus': 'command_bus',
+    'setup_logging': 'train_logging',
+    'HubLog': 'train_logging',
+    'MotionProfile': 'motion_profiles',
+    'Segment': 'motion_profiles',
+    'run_profile': 'motion_profiles',
+    'metrics_enabled': 'hub_metrics',
+    'instrument_hub': 'hub_metrics',
+    'LoopMonitor': 'loop_monitor',
+    'telemetry_enabled': 'telemetry',
+    'record_hub': 'telemetry',
+    'load_session': 'telemetry',
+    'start_fleet': 'fleet',
+    'Supervisor': 'supervisor',
+    'ReconnectManager': 'reconnect',
+    'BlockSignals': 'block_signals',
+    'simulate_layout': 'layout_sim',
+    'TrainHub': 'train',
+    'create_train': 'train',
+    'run_lesson': 'train',
+}
+
+__all__ = list(_EXPORTS)
+
+
+''' This is called by Python when a name is not found in the package, it imports the module the name comes from '''
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+
+    ''' Stores the value in the package, so the module is only looked up the first time '''
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
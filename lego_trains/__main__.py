@@ -0,0 +1,123 @@
+''' This is the command line tool for the hubs and lessons, run from the top level folder of the repository:
+
+    python3 -m lego_trains hubs              lists the hubs in the mapping file
+    python3 -m lego_trains scan              finds active hubs (using the discovery daemon if it is running) and adds new ones to the mapping file
+    python3 -m lego_trains name              prompts for a name for each new hub in the mapping file
+    python3 -m lego_trains provision hubs.csv
+                                             adds the names and settings of the hubs in a manifest to the mapping file (see provisioning.py)
+    python3 -m lego_trains run lesson2       runs a lesson (add --stream to connect each hub as soon as it is seen,
+                                             or --manifest hubs.csv to set the hubs up headless from a manifest)
+    python3 -m lego_trains supervise lesson2 --workers 2
+                                             runs a lesson across several worker processes (see supervisor.py)
+
+Only the run and supervise commands import bricknil or curio (through the lesson), the other commands start in a few milliseconds. '''
+
+import argparse
+import logging
+import runpy
+import sys
+
+
+''' This lists the hubs in the mapping file '''
+def list_hubs(args):
+    from .hub_registry import HubRegistry
+
+    registry = HubRegistry(args.mapping_file)
+    if not registry.exists:
+        print(f'{args.mapping_file} not found, run python3 -m lego_trains scan first.')
+        return 1
+    for hub_info in registry:
+        new = ' (new)' if hub_info.get('new') else ''
+        settings = ''.join(f', {key} {value}' for key, value in hub_info.get('settings', {}).items())
+        print(f"{hub_info['hub_name']}{new}: {hub_info['ble_id']}, last initiated {registry.last_initiated_at(hub_info['ble_id']) or 'never'}{settings}")
+    return 0
+
+''' This finds any active hubs and adds the new ones to the mapping file '''
+def scan(args):
+    from .hubs import run_ble_scan
+
+    return 0 if run_ble_scan() else 1
+
+''' This prompts for a name for each new hub in the mapping file (including those queued in headless mode) '''
+def name_hubs(args):
+    from .hubs import get_hubs
+
+    get_hubs(args.mapping_file, interactive=True)
+    return 0
+
+''' This adds the names and settings of the hubs in a manifest to the mapping file, without connecting to them '''
+def provision(args):
+    from .hub_registry import HubRegistry
+    from .provisioning import load_manifest, apply_manifest, pending_hubs
+
+    registry = HubRegistry(args.mapping_file)
+    try:
+        manifest = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f'Could not read the manifest: {e}')
+        return 1
+    changed = apply_manifest(registry, manifest)
+    registry.save()
+    print(f'{len(manifest)} hubs in {args.manifest}, {changed} added or changed, {len(pending_hubs(registry))} hubs waiting to be named.')
+    return 0
+
+''' This runs a lesson script as if it had been started with python3 lessonN.py '''
+def run(args):
+    lesson_path = args.lesson if args.lesson.endswith('.py') else f'{args.lesson}.py'
+    sys.argv = [lesson_path] + (['--stream'] if args.stream else []) + (['--manifest', args.manifest] if args.manifest else [])
+    runpy.run_path(lesson_path, run_name='__main__')
+    return 0
+
+''' This runs a lesson across several worker processes, restarting any that crash '''
+def supervise(args):
+    import curio
+    from .supervisor import supervise as run_supervisor
+
+    if args.sim_hubs:
+        ''' Simulated hubs are made up, so supervisor mode can be tried without a mapping file '''
+        hubs_data = [{'hub_name': f'sim_train_{i}', 'ble_id': f'00:00:00:00:{i // 256:02x}:{i % 256:02x}'} for i in range(args.sim_hubs)]
+    else:
+        from .hubs import get_hubs
+        hubs_data = get_hubs(args.mapping_file, args.manifest)
+    adapters = args.adapters.split(',') if args.adapters else None
+    curio.run(run_supervisor, args.lesson, hubs_data, args.workers, adapters, args.sim or bool(args.sim_hubs))
+    return 0
+
+
+def main(argv=None):
+    from .hub_registry import MAPPING_FILE
+
+    parser = argparse.ArgumentParser(prog='python3 -m lego_trains', description='Tools for the Lego trains hubs and lessons')
+    parser.add_argument('--mapping-file', default=MAPPING_FILE, help='path of the mapping file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('hubs', help='list the hubs in the mapping file').set_defaults(function=list_hubs)
+    commands.add_parser('scan', help='find active hubs and add new ones to the mapping file').set_defaults(function=scan)
+    commands.add_parser('name', help='name any new hubs in the mapping file').set_defaults(function=name_hubs)
+
+    provision_parser = commands.add_parser('provision', help='add the hubs in a CSV or JSON manifest to the mapping file')
+    provision_parser.add_argument('manifest')
+    provision_parser.set_defaults(function=provision)
+
+    run_parser = commands.add_parser('run', help='run a lesson, e.g. lesson2')
+    run_parser.add_argument('lesson')
+    run_parser.add_argument('--stream', action='store_true', help='connect each hub as soon as it is seen')
+    run_parser.add_argument('--manifest', help='CSV or JSON manifest of the hubs to set up headless (see provisioning.py)')
+    run_parser.set_defaults(function=run)
+
+    supervise_parser = commands.add_parser('supervise', help='run a lesson across several worker processes')
+    supervise_parser.add_argument('lesson')
+    supervise_parser.add_argument('--workers', type=int, default=2, help='number of worker processes')
+    supervise_parser.add_argument('--adapters', help='Bluetooth adapters to share between the workers, e.g. hci0,hci1')
+    supervise_parser.add_argument('--sim', action='store_true', help='run the trains on simulated hubs')
+    supervise_parser.add_argument('--manifest', help='CSV or JSON manifest of the hubs to set up headless (see provisioning.py)')
+    supervise_parser.add_argument('--sim-hubs', type=int, default=0, help='run this many simulated hubs (instead of the hubs in the mapping file)')
+    supervise_parser.set_defaults(function=supervise)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
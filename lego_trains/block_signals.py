@@ -0,0 +1,133 @@
+''' This module keeps several trains apart on one layout, using block signalling (like a real railway).
+
+The track is split into blocks, each one starting at a coloured marker, and only one train is allowed in a block at a time:
+    * when a train's colour sensor sees a marker, it has reached the start of that block. If the block is free (or the
+      train has already been given it) the train goes in, and the block it has just left is released
+    * as it goes in, the train asks for the next block as well. If it gets it, it carries on at full speed, if not it
+      slows down to a caution speed, and stops at the next marker if the block still is not free by then
+    * when a block is released it is given straight to the first train waiting for it, which speeds up again
+
+The table of which train is in (or has been given) each block is a list indexed by block number, and the markers
+are looked up in a dict, so every check is a single lookup however many trains and blocks there are.
+
+    SIGNALS = BlockSignals([Color.red, Color.yellow, Color.green, Color.blue])
+    next_clear = await SIGNALS.enter(self, block)
+
+With n blocks at most n - 1 trains can run (each moving train holds its own block and often the next one as well),
+and the layout runs fastest with about half as many trains as blocks, see benchmarks/bench_block_throughput.py. '''
+
+from collections import deque
+
+import curio
+
+
+''' This stores what the signals know about one train '''
+class TrainState:
+    __slots__ = ('train', 'block', 'granted', 'entries')
+
+    def __init__(self, train):
+        self.train = train
+        self.block = None
+        self.granted = curio.Event()
+        self.entries = 0
+
+
+''' This is the signalling for one layout, shared by all the trains on it '''
+class BlockSignals:
+    def __init__(self, marker_colours):
+        ''' marker_colours is the colour of the marker at the start of each block, in the order the trains pass them '''
+        self.marker_colours = list(marker_colours)
+        self.marker_blocks = {colour: block for block, colour in enumerate(self.marker_colours)}
+        if len(self.marker_blocks) != len(self.marker_colours):
+            raise ValueError('Each block needs a marker of a different colour')
+        self.block_count = len(self.marker_colours)
+
+        ''' The train holding each block (or None if it is free), and the trains waiting for each block in the order they asked '''
+        self.holder = [None] * self.block_count
+        self.waiting = [deque() for _ in range(self.block_count)]
+        self.trains = {}
+
+        ''' The number of times a train has gone into a block (by any of the trains) '''
+        self.entries = 0
+
+    ''' This returns what the signals know about a train (the first time a train is seen it is added) '''
+    def train_state(self, train):
+        state = self.trains.get(train.hub_name)
+        if state is None:
+            state = self.trains[train.hub_name] = TrainState(train)
+        return state
+
+    ''' This tells the signals which block a train starts in (e.g. for the simulated layout, where the start positions are known),
+    otherwise a train only holds a block once it has reached that block's marker '''
+    def place(self, train, block):
+        state = self.train_state(train)
+        self.holder[block] = train.hub_name
+        state.block = block
+
+    ''' The number of laps completed by all the trains together (going into every block once is one lap) '''
+    @property
+    def laps(self):
+        return self.entries / self.block_count
+
+    ''' This returns the block after the given one (the track is a loop, so the last block is followed by the first) '''
+    def next_block(self, block):
+        return (block + 1) % self.block_count
+
+    ''' This returns True if the train is holding the block, or the block is free '''
+    def is_clear_for(self, train, block):
+        return self.holder[block] in (None, train.hub_name)
+
+    ''' This gives the block to the train if it is free, otherwise puts the train in the queue for it (returns True if it got the block) '''
+    def reserve(self, train, block):
+        if self.is_clear_for(train, block):
+            self.holder[block] = train.hub_name
+            return True
+        if train.hub_name not in self.waiting[block]:
+            self.waiting[block].append(train.hub_name)
+        return False
+
+    ''' This frees a block and gives it to the first train waiting for it '''
+    async def release(self, block):
+        self.holder[block] = None
+        if self.waiting[block]:
+            state = self.trains[self.waiting[block].popleft()]
+            self.holder[block] = state.train.hub_name
+            await state.granted.set()
+
+            ''' The train is told, so it can speed up again (if it has a signal_clear function) '''
+            signal_clear = getattr(state.train, 'signal_clear', None)
+            if signal_clear is not None:
+                await signal_clear(block)
+
+    ''' This is called when a train reaches the marker at the start of a block. It waits until the train is allowed in
+    (if the block is held by another train), then returns True if the next block is clear as well, or False if the
+    train should go on at the caution speed '''
+    async def enter(self, train, block):
+        state = self.train_state(train)
+
+        ''' Waits at the marker until the block is given to this train '''
+        state.granted.clear()
+        while not self.reserve(train, block):
+            await state.granted.wait()
+            state.granted.clear()
+
+        ''' The train is now in the block, so the block it was in before is released '''
+        previous = state.block
+        state.block = block
+        state.entries += 1
+        self.entries += 1
+        if previous is not None and previous != block:
+            await self.release(previous)
+
+        return self.reserve(train, self.next_block(block))
+
+    ''' This is called if a train leaves the layout (e.g. it is stopped or disconnects), so the blocks it holds are released '''
+    async def remove(self, train):
+        state = self.trains.pop(train.hub_name, None)
+        for waiting in self.waiting:
+            if train.hub_name in waiting:
+                waiting.remove(train.hub_name)
+        for block, holder in enumerate(self.holder):
+            if holder == train.hub_name:
+                await self.release(block)
+        return state
@@ -0,0 +1,158 @@
+''' This module slows a train down before it reaches an object, using the trend of the distance readings, instead of stopping it
+with set_speed(0) once the distance sensor reports the stop distance.
+
+set_speed(0) lets the motor run freely (0 is neutral, not a brake), so the train rolls on for a distance that depends on how
+fast it was going, and the reading that triggers the stop can arrive anywhere within one step of the sensor. Here:
+    * the speed the train is closing on the object is worked out from the last few distance readings (the slope of a straight
+      line fitted through them), or from the motor speed and the closing speed seen before at that speed (learned as it runs)
+    * with each reading, the controller works out how far the train would travel while ramping down to 0, at the deceleration
+      it is allowed. If waiting for the next reading (one sensor step closer) would be too late, it starts a ramp_speed now,
+      with the ramp time worked out so the train stops in the middle of target_distance (e.g. between 1 and 2 for a target of 1)
+    * the sensor rounds the distance down, so a new reading of 4 means the train has only just crossed from 5 to 4 and is
+      at 5 (crossing_offset is the difference, set it to half the resolution for a sensor that rounds to the nearest)
+    * if there is not enough room left for even the shortest ramp, it ramps down as quickly as it can
+    * readings at the sensor's maximum (nothing in range) are not used, and nor is a reading that jumps by more than
+      two sensor steps (a wrong reading, the train is not braked for it. An object that really does appear suddenly is
+      still stopped for by the lesson, once the filtered distance reaches the stop distance)
+    * once the ramp has finished, stopped is called (if given). The train can stop a little before target_distance, in which
+      case the sensor never reports it, and the train would otherwise wait there
+
+    self.braking = BrakingController(target_distance=1, stopped=self.stopped_at_object)
+
+    async def train_sensor_change(self):
+        distance = self.train_sensor.value[VisionSensor.capability.sense_distance]
+        await self.braking.update(self.motor, distance)
+
+The distances are in the sensor's units (0 to 10) and times in seconds, so the closing speed is in sensor units a second. '''
+
+import logging
+import time
+from collections import deque
+
+import curio
+
+''' bricknil's ramp_speed changes the speed every 0.1 seconds, and only accepts ramps longer than this (see motion_profiles.py) '''
+RAMP_STEP = 0.1
+MIN_RAMP = 0.2
+
+
+''' This is the braking controller for one train '''
+class BrakingController:
+    def __init__(self, target_distance=1, deceleration=120, response_time=0.1, resolution=1, crossing_offset=1, max_distance=10,
+                 window=4, stopped=None, enabled=True, clock=time.monotonic):
+        ''' deceleration is the fastest the motor speed may come down, in speed units a second (at 120 a train at speed 30 stops over 0.25 seconds,
+        so the train keeps its speed for as long as it can and then brakes hard), response_time is the time between a reading and the train
+        starting to slow down (Bluetooth, and the lag of the motor itself, which is most of it),
+        resolution is the smallest change in distance the sensor reports, and max_distance is the reading when nothing is in range. With enabled=False the controller does nothing
+        (the train stops the old way), so the two can be compared '''
+        self.target_distance = target_distance
+        self.deceleration = deceleration
+        self.response_time = response_time
+        self.resolution = resolution
+        self.crossing_offset = crossing_offset
+        self.max_distance = max_distance
+        self.stopped = stopped
+        self.enabled = enabled
+        self.clock = clock
+
+        ''' The last few (time, distance) readings since the motor speed last changed, and the speed they were taken at '''
+        self.samples = deque(maxlen=window)
+        self.sample_speed = None
+
+        ''' True while the first of the readings is still in samples '''
+        self.first_sample = False
+
+        ''' The closing speed for each unit of motor speed, learned from the readings (None until it has been seen) '''
+        self.rate_per_speed = None
+
+        ''' True once a braking ramp has been started (until the train has stopped or is going backwards) '''
+        self.braking = False
+
+        ''' The number of braking ramps started, and the last one (the time it started, the distance and the ramp time) '''
+        self.ramps = 0
+        self.last_ramp = None
+
+    ''' This returns the closing speed (in sensor units a second, more than 0 while the train is getting closer), or None if it is not known yet '''
+    def closing_speed(self, speed):
+        ''' The sensor only sends a reading when the distance changes, so each reading is the moment the train crossed from one
+        unit to the next, except the first one (the train could have been anywhere in that unit), which is left out '''
+        crossings = list(self.samples)[1:] if self.first_sample else list(self.samples)
+        if len(crossings) >= 2:
+            ''' The slope of the straight line that fits the readings best (least squares) '''
+            mean_t = sum(t for t, _ in crossings) / len(crossings)
+            mean_d = sum(d for _, d in crossings) / len(crossings)
+            spread = sum((t - mean_t) ** 2 for t, _ in crossings)
+            if spread > 0:
+                closing = -sum((t - mean_t) * (d - mean_d) for t, d in crossings) / spread
+                if speed:
+                    ''' The closing speed for each unit of motor speed is remembered, for the next time the speed changes '''
+                    self.rate_per_speed = closing / speed if self.rate_per_speed is None else (self.rate_per_speed + closing / speed) / 2
+                return closing
+        if self.rate_per_speed is not None:
+            return self.rate_per_speed * speed
+        return None
+
+    ''' This returns the distance travelled while ramping down to 0 over ramp_time seconds, at the given closing speed
+    (bricknil's ramp keeps the first speed for one step, and then comes down in equal steps) '''
+    def stopping_distance(self, closing, ramp_time):
+        return closing * ((ramp_time + RAMP_STEP) / 2 + self.response_time)
+
+    ''' This returns the ramp time (in seconds) to start now to stop at target_distance, or None if braking can wait for the next reading '''
+    def plan(self, distance, speed, now):
+        if self.braking or speed <= 0:
+            return None
+        if speed != self.sample_speed or distance >= self.max_distance:
+            ''' The readings taken at another speed (or with nothing in range) say nothing about the closing speed now '''
+            self.samples.clear()
+            self.sample_speed = speed
+            if distance >= self.max_distance:
+                return None
+        elif self.samples and abs(distance - self.samples[-1][1]) > 2 * self.resolution:
+            return None
+        if len(self.samples) == self.samples.maxlen:
+            self.first_sample = False
+        elif not self.samples:
+            self.first_sample = True
+        self.samples.append((now, distance))
+
+        closing = self.closing_speed(speed)
+        if closing is None or closing <= 0:
+            return None
+        remaining = distance + self.crossing_offset - (self.target_distance + self.resolution / 2)
+        quickest = max(MIN_RAMP, speed / self.deceleration)
+
+        ''' If the train could still stop in time after one more sensor step, braking waits for the next reading '''
+        if remaining - self.resolution > self.stopping_distance(closing, quickest):
+            return None
+
+        ''' The ramp time that stops the train in the middle of target_distance (it can not be quicker than the deceleration allows) '''
+        ramp_time = 2 * (remaining / closing - self.response_time) - RAMP_STEP
+        return max(quickest, ramp_time)
+
+    ''' This is called with each distance reading, and starts the braking ramp on the motor once it is time to '''
+    async def update(self, motor, distance):
+        if not self.enabled:
+            return False
+        speed = motor.speed
+        if self.braking and speed <= 0:
+            ''' The train has stopped (or reversed) since it braked, so the next time it moves forwards it may need to brake again '''
+            self.braking = False
+        now = self.clock()
+        ramp_time = self.plan(distance, speed, now)
+        if ramp_time is None:
+            return False
+
+        self.braking = True
+        self.ramps += 1
+        self.last_ramp = (now, distance, ramp_time)
+        logging.info(f'Braking from speed {speed} at distance {distance} over {ramp_time:.2f} seconds')
+        await motor.ramp_speed(0, int(ramp_time * 1000))
+        if self.stopped is not None:
+            await curio.spawn(self.wait_stopped, motor, ramp_time, daemon=True)
+        return True
+
+    ''' This waits for the ramp to finish, and then calls stopped (unless the train has been sent another speed in the meantime) '''
+    async def wait_stopped(self, motor, ramp_time):
+        await curio.sleep(ramp_time + RAMP_STEP)
+        if motor.speed == 0:
+            await self.stopped()
@@ -0,0 +1,214 @@
+''' This module sends a command to every train in the fleet at once (e.g. an emergency stop), rather than to one hub at a time.
+
+Without it, each train is only ever commanded by its own run function, so stopping them all means waiting for each
+run function in turn. The FleetBus takes the list of trains the fleet is running (see run_fleet in fleet.py) and:
+    * fans each command out to every hub at the same time (one task per hub), so the time for the whole fleet is the time
+      for the slowest hub, rather than the sum of every hub's time
+    * sends it with priority through each hub's command layer (see motor_commands.py): straight away, without waiting for the
+      write budget, and replacing any command the lesson has waiting for the same motor or LED
+    * collects a receipt from every hub: whether the command was queued for the hub, and how long after the command was issued.
+      Queued means the hub's command layer has taken it and passed it on to the Bluetooth bridge, it is not a reply from the
+      hub (bricknil does not get one for a motor or LED command), so it does not show the hub has carried it out.
+      A hub whose command layer has not taken the command within the timeout (e.g. it is reconnecting) is marked as not queued,
+      and does not hold up the rest
+    * records the fan-out latency (the time from issuing the command until it has been queued for the last hub)
+
+The commands are:
+    * stop: stops every motor (brake=True for a hard brake) and holds the hubs, so the lessons can not start the trains
+      again (their speed commands are dropped) until resume is sent
+    * resume: releases the hold, the trains stay stopped until their run functions (or set_speed) send a new speed
+    * set_speed: sets every motor to the same speed
+    * scale_speed: multiplies the speed of every motor by a factor (e.g. 0.5 to halve the speed of every train)
+    * set_led: sets every LED to a colour (a Color or its name, e.g. 'red')
+
+Fleet-wide commands are sent one at a time, in the order they were issued, so a stop issued straight after a set_speed is always the one left in place.
+In a lesson the bus for the process is fleet_bus(), e.g. await fleet_bus().stop(). In supervisor mode (see supervisor.py) the supervisor
+sends the command to each worker, which fans it out with its own bus and sends back every hub's receipt.
+The commands can also be typed into the lesson's terminal if the TRAIN_FLEET_CONSOLE environment variable is set
+(stop, brake, resume, speed N, scale F, led COLOUR). The time each hub has to take a command is set with TRAIN_BUS_TIMEOUT (default 2 seconds). '''
+
+import logging
+import os
+import sys
+import threading
+import time
+
+import curio
+
+from .hub_metrics import LatencyHistogram
+
+''' This is the clock used for all timings (the same one as hub_metrics.py) '''
+clock = time.perf_counter
+
+''' How long each hub's command layer has to take a command, in seconds '''
+QUEUE_TIMEOUT = float(os.environ.get('TRAIN_BUS_TIMEOUT', 2))
+
+''' The hard brake speed (see STOP_SPEEDS in motor_commands.py) '''
+BRAKE_SPEED = 255
+
+
+''' This is the command bus for the trains of one process '''
+class FleetBus:
+    def __init__(self, trains, timeout=QUEUE_TIMEOUT):
+        ''' trains is the list of trains the fleet is running, it is read each time a command is sent, so trains added later are included '''
+        self.trains = trains
+        self.timeout = timeout
+        self.lock = curio.Lock()
+
+        ''' The number of commands sent, the fan-out latency of each one, and the receipts of the last one '''
+        self.commands = 0
+        self.fan_out = LatencyHistogram()
+        self.last_fan_out = None
+        self.last_receipts = []
+
+    ''' These send each of the commands to every train, and return the list of receipts '''
+    async def stop(self, brake=False):
+        return await self.broadcast('stop', brake=brake)
+
+    async def resume(self):
+        return await self.broadcast('resume')
+
+    async def set_speed(self, speed):
+        return await self.broadcast('set_speed', speed=speed)
+
+    async def scale_speed(self, factor):
+        return await self.broadcast('scale_speed', factor=factor)
+
+    async def set_led(self, color):
+        return await self.broadcast('set_led', color=color)
+
+    ''' This sends a command to every train at the same time, and returns a receipt for each one, e.g.
+    {'hub': 'train_1', 'queued': True, 'seconds': 0.002} or {'hub': 'train_2', 'queued': False, 'seconds': 2.0, 'error': 'timeout'} '''
+    async def broadcast(self, command, **args):
+        if command not in BUS_COMMANDS:
+            raise ValueError(f'{command} is not a fleet command, the commands are: {", ".join(BUS_COMMANDS)}')
+        async with self.lock:
+            start = clock()
+            async with curio.TaskGroup() as group:
+                tasks = [await group.spawn(self.send_to, train, command, args, start) for train in list(self.trains)]
+            receipts = [task.result for task in tasks]
+            elapsed = clock() - start
+
+        self.commands += 1
+        self.fan_out.record(elapsed)
+        self.last_fan_out = elapsed
+        self.last_receipts = receipts
+        failed = [receipt['hub'] for receipt in receipts if not receipt['queued']]
+        logging.info(f'Fleet {command} queued for {len(receipts) - len(failed)} of {len(receipts)} hubs in {elapsed * 1000:.1f}ms'
+                     + (f', not queued for {", ".join(failed)}' if failed else ''))
+        return receipts
+
+    ''' This sends the command to one train and returns its receipt '''
+    async def send_to(self, hub, command, args, start):
+        receipt = {'hub': hub.hub_name, 'queued': True}
+        try:
+            await curio.timeout_after(self.timeout, BUS_COMMANDS[command](hub, **args))
+        except curio.TaskTimeout:
+            receipt.update(queued=False, error='timeout')
+        except Exception as e:
+            ''' One hub failing (e.g. it has just disconnected) does not stop the command reaching the others '''
+            receipt.update(queued=False, error=str(e))
+        receipt['seconds'] = clock() - start
+        return receipt
+
+
+''' This returns the motors or LEDs attached to a hub (the attached peripherals that have the given command) '''
+def attached(hub, method_name):
+    return [peripheral for peripheral in hub.peripherals.values() if hasattr(peripheral, method_name)]
+
+''' These carry out each command on one hub, through its command layer with priority '''
+async def stop_hub(hub, brake=False):
+    hub.commands.held = True
+    for motor in attached(hub, 'set_speed'):
+        await hub.commands.submit(motor, 'set_speed', BRAKE_SPEED if brake else 0, priority=True)
+
+async def resume_hub(hub):
+    hub.commands.held = False
+
+async def set_hub_speed(hub, speed):
+    for motor in attached(hub, 'set_speed'):
+        await hub.commands.submit(motor, 'set_speed', speed, priority=True)
+
+async def scale_hub_speed(hub, factor):
+    for motor in attached(hub, 'set_speed'):
+        ''' The speed the motor was last sent (the end speed of a ramp that is still going), or its current speed if nothing has been sent '''
+        last_sent = hub.commands.last_sent.get((motor.name, 'speed'))
+        speed = last_sent[1] if last_sent is not None else motor.speed
+        if speed not in (0, BRAKE_SPEED):
+            await hub.commands.submit(motor, 'set_speed', int(round(speed * factor)), priority=True)
+
+async def set_hub_led(hub, color):
+    if isinstance(color, str):
+        from bricknil.const import Color
+        color = Color[color]
+    for led in attached(hub, 'set_color'):
+        await hub.commands.submit(led, 'set_color', color, priority=True)
+
+''' This maps the name of each command to the function that carries it out on one hub '''
+BUS_COMMANDS = {
+    'stop': stop_hub,
+    'resume': resume_hub,
+    'set_speed': set_hub_speed,
+    'scale_speed': scale_hub_speed,
+    'set_led': set_hub_led,
+}
+
+
+''' This turns a line typed into a console (e.g. "speed 20") into a command and its arguments, or returns None if it is not a fleet command '''
+def parse_command(words):
+    try:
+        if words == ['stop']:
+            return 'stop', {}
+        if words == ['brake']:
+            return 'stop', {'brake': True}
+        if words == ['resume']:
+            return 'resume', {}
+        if len(words) == 2 and words[0] == 'speed':
+            return 'set_speed', {'speed': int(words[1])}
+        if len(words) == 2 and words[0] == 'scale':
+            return 'scale_speed', {'factor': float(words[1])}
+        if len(words) == 2 and words[0] == 'led':
+            return 'set_led', {'color': words[1]}
+    except ValueError:
+        pass
+    return None
+
+''' The help for the fleet commands that can be typed into a console '''
+CONSOLE_HELP = 'stop, brake, resume, speed N, scale F, led COLOUR'
+
+
+''' The bus of this process, once the fleet has started (see run_fleet in fleet.py) '''
+_bus = None
+
+''' This creates the bus for the trains of this process (called from run_fleet), and starts the console if TRAIN_FLEET_CONSOLE is set '''
+async def start_fleet_bus(trains):
+    global _bus
+    _bus = FleetBus(trains)
+    if os.environ.get('TRAIN_FLEET_CONSOLE'):
+        await curio.spawn(console, _bus, daemon=True)
+    return _bus
+
+''' This returns the bus of this process (None if the fleet has not been started) '''
+def fleet_bus():
+    return _bus
+
+''' This reads the fleet commands typed into the lesson's terminal and sends them to every train '''
+async def console(bus):
+    lines = curio.UniversalQueue()
+
+    ''' The terminal is read in a thread (reading it would block the curio loop) '''
+    def read_terminal():
+        for line in sys.stdin:
+            lines.put(line)
+
+    threading.Thread(target=read_terminal, daemon=True).start()
+    while True:
+        words = (await lines.get()).split()
+        parsed = parse_command(words)
+        if parsed is None:
+            if words:
+                print(f'Commands: {CONSOLE_HELP}')
+            continue
+        command, args = parsed
+        receipts = await bus.broadcast(command, **args)
+        print(f'{command}: queued for {sum(receipt["queued"] for receipt in receipts)} of {len(receipts)} hubs in {bus.last_fan_out * 1000:.1f}ms')
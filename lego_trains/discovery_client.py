@@ -0,0 +1,51 @@
+''' This module asks the discovery daemon (discovery_daemon.py) for the Smart Hubs it has seen and adds any new ones to the mapping file.
+
+It only uses the standard socket library (not bleak), so it is safe to use from the lessons alongside bricknil. '''
+
+import json
+import logging
+import os
+import socket
+
+from .hub_registry import ROOT, MAPPING_FILE, HubRegistry
+
+''' This sets the path of the Unix socket the daemon listens on (can be changed with the TRAIN_DISCOVERY_SOCKET environment variable) '''
+SOCKET_PATH = os.environ.get('TRAIN_DISCOVERY_SOCKET', f'{ROOT}/hubs/discovery.sock')
+
+
+''' This returns the list of hubs the daemon has seen recently, or None if the daemon is not running '''
+def fetch_cached_hubs(socket_path=SOCKET_PATH, timeout=0.5):
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_path)
+            client.sendall(b'hubs\n')
+
+            ''' Reads the reply until the daemon closes the connection '''
+            chunks = []
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return json.loads(b''.join(chunks))['hubs']
+    except (OSError, ValueError, KeyError) as e:
+        ''' If the daemon is not answering (or has stopped and left the socket file behind), the lesson falls back to a normal scan '''
+        logging.info(f'Discovery daemon did not answer ({e}), falling back to a BLE scan.')
+        return None
+
+''' This adds any new hubs seen by the daemon to the mapping file, and returns False if the daemon is not running '''
+def update_mapping_from_daemon(socket_path=SOCKET_PATH, file_path=MAPPING_FILE):
+    cached_hubs = fetch_cached_hubs(socket_path)
+    if cached_hubs is None:
+        return False
+
+    registry = HubRegistry(file_path)
+    added = registry.add_new(hub['ble_id'] for hub in cached_hubs)
+    logging.info(f'Discovery daemon has seen {len(cached_hubs)} hubs, {added} new.')
+
+    ''' The mapping file is only saved if a new hub has been added '''
+    registry.save()
+    return True
@@ -0,0 +1,275 @@
+''' This module connects the whole fleet of trains, replacing bricknil's start function.
+
+bricknil's start function connects the hubs one by one, in the order of the mapping file, and every connection
+starts with a Bluetooth scan of its own (for up to 60 seconds). One slow or switched off hub holds up all the others.
+Here:
+    * each hub is connected in its own task, with at most max_parallel hubs connecting at the same time
+    * each connection attempt has a timeout, and failed attempts are retried with exponential backoff (1, 2, 4, 8... seconds)
+    * hubs that are not advertising (e.g. switched off) are skipped and retried in the background, while the others run
+    * a train's run function starts as soon as its own hub is connected, without waiting for the other hubs
+    * the time each hub took to connect is logged, along with a summary once the whole fleet is up
+    * a hub that disconnects while the trains are running is reconnected on its own (see reconnect.py)
+    * if TRAIN_METRICS_PORT is set, the curio loop is watched and its metrics are served on that port (see loop_monitor.py)
+    * every train can be sent a command at once (e.g. an emergency stop) through the fleet command bus (see command_bus.py)
+
+In streaming mode (python3 lessonN.py --stream), scan_hubs.py --stream reports each Smart Hub as soon as it is
+advertised (strongest signal first) and each one is connected straight away.
+
+The number of hubs connecting at once and the timeout can be changed with the TRAIN_MAX_PARALLEL (default 4)
+and TRAIN_CONNECT_TIMEOUT (default 10 seconds) environment variables. '''
+
+import json
+import logging
+import os
+import threading
+from functools import partial
+
+import curio
+from curio import subprocess
+from bricknil.ble_queue import BLEventQ
+from bricknil.const import USE_BLEAK
+
+from .hub_metrics import metrics_enabled, dump_metrics_periodically
+from .telemetry import telemetry_enabled, flush_telemetry_periodically
+from .reconnect import ReconnectManager
+from .loop_monitor import loop_activations, start_loop_monitor, track_task
+from .command_bus import start_fleet_bus
+
+''' These are the default connection settings '''
+MAX_PARALLEL = int(os.environ.get('TRAIN_MAX_PARALLEL', 4))
+CONNECT_TIMEOUT = float(os.environ.get('TRAIN_CONNECT_TIMEOUT', 10))
+FIRST_RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+''' How long (in seconds) the result of a scan is reused by other hubs that are checking if they are advertising '''
+PRESENCE_CACHE_SECONDS = 2
+
+
+''' This is bricknil's Bluetooth queue, with extra functions for connecting hubs with a known ble_id '''
+class DirectConnectQ(BLEventQ):
+    def __init__(self, ble):
+        super().__init__(ble)
+
+        ''' bricknil's own connect gets its scan results back on a shared queue, so only one of them can run at a time '''
+        self.scan_lock = curio.Lock()
+
+    ''' This runs a single one second scan and returns the set of addresses seen (or None if this is not supported or the scan failed).
+    The bridge (see fleet_bleak.py) runs the scan in the background and puts the result on this scan's own reply queue,
+    so the trains that are already running keep being sent their commands while it scans '''
+    async def find_present(self):
+        if not USE_BLEAK:
+            return None
+        reply = curio.UniversalQueue()
+        await self.ble.in_queue.put(('discover_to', reply))
+        devices = await reply.get()
+        if isinstance(devices, Exception):
+            logging.warning(f'Scan for advertising hubs failed: {devices}')
+            return None
+        return {device.address for device in devices}
+
+    ''' This connects straight to a hub using its ble_id (no scan), raising ConnectionError if it can not connect '''
+    async def connect_known(self, hub, timeout):
+        if not USE_BLEAK:
+            ''' The Adafruit library (used on a Mac) has no direct connect, so bricknil's own connect is used, one hub at a time '''
+            async with self.scan_lock:
+                await self.connect(hub)
+            return
+
+        hub.message_queue = self.q
+
+        ''' The bridge (see fleet_bleak.py) connects in the background and puts the result on this hub's own reply queue '''
+        reply = curio.UniversalQueue()
+        await self.ble.in_queue.put(('connect_to', (hub.ble_id, timeout, reply)))
+        device = await reply.get()
+        if isinstance(device, Exception):
+            raise ConnectionError(f'{hub.name} ({hub.ble_id}) failed to connect: {device}')
+
+        hub.tx = (device, hub.char_uuid)
+        self.hubs[hub.ble_id] = hub
+        self.message_info(f'Connected to device {hub.name}:{hub.ble_id}')
+
+        ''' Starts passing messages from the hub to bricknil's message parser '''
+        await self.get_messages(hub)
+
+
+''' This is the connection stage for the whole fleet '''
+class FleetConnector:
+    def __init__(self, ble_q, max_parallel=MAX_PARALLEL, timeout=CONNECT_TIMEOUT):
+        self.ble_q = ble_q
+        self.timeout = timeout
+        self.limiter = curio.Semaphore(max_parallel)
+
+        ''' The result of the last scan, and when it was run '''
+        self.present = None
+        self.present_at = None
+        self.presence_lock = curio.Lock()
+
+        ''' These store the time each hub took to connect (from its first attempt) and how many attempts it took '''
+        self.connect_times = {}
+        self.attempts = {}
+
+    ''' This checks if the hub is currently advertising, sharing one scan between all the hubs checking at around the same time '''
+    async def is_present(self, hub):
+        async with self.presence_lock:
+            ''' Hubs that were waiting for the lock use the result of the scan that has just finished '''
+            now = await curio.clock()
+            if self.present_at is None or now - self.present_at > PRESENCE_CACHE_SECONDS:
+                self.present = await self.ble_q.find_present()
+                self.present_at = await curio.clock()
+        return self.present is None or hub.ble_id in self.present
+
+    ''' This keeps trying until the hub is connected, waiting longer between each attempt '''
+    async def connect(self, hub, seen=False):
+        ''' seen is True if there is no need to check the hub is advertising before the first attempt: it has just been reported
+        by the streaming scan, or it is being reconnected (see reconnect.py) '''
+        start_time = await curio.clock()
+        retry_delay = FIRST_RETRY_DELAY
+        attempt = 0
+        while True:
+            attempt += 1
+            self.attempts[hub.hub_name] = attempt
+            if seen or await self.is_present(hub):
+                try:
+                    await self.connect_once(hub)
+                    elapsed = await curio.clock() - start_time
+                    self.connect_times[hub.hub_name] = elapsed
+                    logging.info(f'{hub.hub_name} connected in {elapsed:.2f} seconds ({attempt} attempts)')
+                    return elapsed
+                except (ConnectionError, curio.TaskTimeout) as e:
+                    logging.warning(f'{hub.hub_name} attempt {attempt} failed: {e}, retrying in {retry_delay} seconds')
+            else:
+                logging.info(f'{hub.hub_name} is not advertising, retrying in {retry_delay} seconds')
+            seen = False
+
+            ''' Waits before the next attempt, doubling the wait each time (up to MAX_RETRY_DELAY) '''
+            await curio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+
+    ''' This makes one attempt to connect the hub and wait for its peripherals to attach '''
+    async def connect_once(self, hub):
+        async with self.limiter:
+            await self.ble_q.connect_known(hub, self.timeout)
+
+            ''' Starts the loop that passes sensor messages on to the hub (e.g. to train_sensor_change) '''
+            hub.listen_task = await curio.spawn(hub.peripheral_message_loop, daemon=True)
+            track_task(hub.listen_task, hub, 'sensor')
+            try:
+                await curio.timeout_after(self.timeout, wait_for_peripherals, hub)
+            except curio.TaskTimeout:
+                await hub.listen_task.cancel()
+                raise
+
+    ''' This logs the connect time of every hub, along with how long the whole fleet took '''
+    def report(self):
+        for hub_name, elapsed in sorted(self.connect_times.items(), key=lambda item: item[1]):
+            logging.info(f'{hub_name}: {elapsed:.2f} seconds, {self.attempts[hub_name]} attempts')
+        if self.connect_times:
+            logging.info(f'{len(self.connect_times)} hubs connected, slowest {max(self.connect_times.values()):.2f} seconds, '
+                         f'sum of all hubs {sum(self.connect_times.values()):.2f} seconds')
+
+
+''' This waits until all the attached peripherals have been given a port by the hub (the same as bricknil's start function) '''
+async def wait_for_peripherals(hub):
+    for name, peripheral in hub.peripherals.items():
+        while peripheral.port is None:
+            hub.message_debug(f"Waiting for peripheral {name} to attach to a port")
+            await curio.sleep(0.1)
+
+
+''' This runs scan_hubs.py --stream and returns each hub it reports, as soon as the line is printed '''
+async def scan_stream():
+    process = subprocess.Popen(['python3', 'scan_hubs.py', '--stream'], stdout=subprocess.PIPE)
+    try:
+        async for line in process.stdout:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        await process.wait()
+
+
+''' This is the replacement for bricknil's run loop '''
+async def run_fleet(ble, create_train, hubs_data, stream=False, max_parallel=MAX_PARALLEL, timeout=CONNECT_TIMEOUT, link=None):
+    ble_q = DirectConnectQ(ble)
+    ble_task = await curio.spawn(ble_q.run)
+    connector = FleetConnector(ble_q, max_parallel, timeout)
+    start_time = await curio.clock()
+
+    if metrics_enabled():
+        await curio.spawn(dump_metrics_periodically, daemon=True)
+    if telemetry_enabled():
+        await curio.spawn(flush_telemetry_periodically, daemon=True)
+    await start_loop_monitor()
+
+    trains = []
+    all_created = False
+
+    ''' The command bus sends fleet-wide commands to every train in the list, including those created later '''
+    await start_fleet_bus(trains)
+
+    ''' Any hub that disconnects is reconnected on its own while the other trains keep running (see reconnect.py) '''
+    reconnects = ReconnectManager(connector)
+    disconnects = getattr(ble, 'disconnects', None)
+    if disconnects is not None:
+        await curio.spawn(reconnects.watch, disconnects, trains, daemon=True)
+
+    ''' In a worker process (see supervisor.py) the link to the supervisor runs alongside the trains, and is given each train as it is created '''
+    link_task = await curio.spawn(link.run, trains) if link is not None else None
+
+    ''' This connects one hub and then runs its run function '''
+    async def bring_up(hub, seen):
+        await connector.connect(hub, seen)
+
+        ''' Once every train has connected (and no more are expected) the connect times are logged '''
+        if all_created and len(connector.connect_times) == len(trains):
+            connector.report()
+        track_task(await curio.current_task(), hub, 'run')
+        try:
+            await hub.run()
+        finally:
+            await hub.listen_task.cancel()
+
+    hub_tasks = []
+    if stream:
+        ''' Each hub is created and connected as soon as the streaming scan reports it '''
+        hubs_by_id = {hub_info['ble_id']: hub_info for hub_info in hubs_data}
+        async for found in scan_stream():
+            ''' A hub that is not in the mapping file is given the automatic name it was just added to the mapping file with (see scan_hubs.py),
+            so every hub has a name of its own (the name it advertises is the same for every hub) '''
+            hub_info = hubs_by_id.get(found['ble_id'], {'hub_name': found['hub_name'], 'ble_id': found['ble_id']})
+            trains.append(create_train(hub_info))
+            hub_tasks.append(await curio.spawn(bring_up, trains[-1], True))
+            logging.info(f"{hub_info['hub_name']} seen after {await curio.clock() - start_time:.2f} seconds (RSSI {found['rssi']})")
+    else:
+        for hub_info in hubs_data:
+            trains.append(create_train(hub_info))
+            hub_tasks.append(await curio.spawn(bring_up, trains[-1], False))
+    all_created = True
+    if len(connector.connect_times) == len(trains):
+        connector.report()
+
+    if link_task is None:
+        for task in hub_tasks:
+            await task.join()
+    else:
+        ''' A worker keeps its hubs connected until the supervisor tells it to quit (or the supervisor exits) '''
+        await link_task.join()
+        for task in hub_tasks:
+            await task.cancel()
+    await ble_task.cancel()
+
+''' This is the replacement for bricknil's start function '''
+def start_fleet(create_train, hubs_data, stream=False, max_parallel=MAX_PARALLEL, timeout=CONNECT_TIMEOUT, link=None):
+    ''' create_train is the lesson's function that creates a Train from an entry in the mapping file, and hubs_data is the list of entries
+    (link is the link to the supervisor, only used when the lesson is run as a worker, see supervisor.py) '''
+    system = partial(run_fleet, create_train=create_train, hubs_data=hubs_data, stream=stream, max_parallel=max_parallel, timeout=timeout, link=link)
+    if USE_BLEAK:
+        ''' bleak has to run in the main thread, so the curio loop runs in a second thread (the same as bricknil's start) '''
+        from .fleet_bleak import FleetBleak
+        ble = FleetBleak()
+        threading.Thread(target=curio.run, args=(partial(system, ble),), kwargs={'activations': loop_activations()}).start()
+        ble.run()
+    else:
+        import Adafruit_BluefruitLE
+        ble = Adafruit_BluefruitLE.get_provider()
+        ble.initialize()
+        ble.run_mainloop_with(lambda: curio.run(partial(system, ble), activations=loop_activations()))
@@ -0,0 +1,162 @@
+''' This module is bricknil's bridge to bleak (the Bluetooth library it uses on Linux and Windows), changed for connecting a whole fleet.
+
+bricknil's bridge (bricknil.bleak_interface.Bleak) runs in asyncio and handles one message at a time, so each hub
+has to wait for the previous hub to finish connecting, and if a hub fails to connect the bridge stops altogether.
+This version:
+    * runs each 'connect_to' request in its own asyncio task, so several hubs can connect at the same time,
+      and sends the result back on a reply queue that belongs to that request (rather than the shared out_queue)
+    * runs each 'discover_to' scan (used to check which hubs are advertising, see fleet.py) in its own asyncio task in the
+      same way, so the messages to the hubs that are already running are not held up for the second the scan takes
+    * gives each connection a timeout, and sends any error back to the hub that asked, rather than stopping the bridge
+    * logs (rather than stops on) an error writing to a hub, e.g. if the hub has been switched off
+    * puts the ble_id of any hub that disconnects on the disconnects queue, so it can be reconnected (see reconnect.py).
+      The bleak bricknil uses can not report a disconnect itself, so a hub counts as disconnected when a message to it
+      (or switching on its notifications) fails and bleak says it is no longer connected, or when the check of every
+      hub's link (every TRAIN_LINK_CHECK seconds, default 2) finds it is no longer connected
+
+It imports bleak, so it is only imported by fleet.start_fleet when bricknil is using bleak.
+If the TRAIN_BLE_ADAPTER environment variable is set (e.g. to hci1), the hubs are connected through that Bluetooth adapter
+(the supervisor gives each worker its own adapter, see supervisor.py). '''
+
+import asyncio
+import logging
+import os
+
+import bleak
+import curio
+from bricknil.bleak_interface import Bleak
+
+''' This is the Bluetooth adapter to connect through (None uses the default adapter) '''
+BLE_ADAPTER = os.environ.get('TRAIN_BLE_ADAPTER')
+
+''' How often the link to every connected hub is checked, in seconds (0 switches the check off) '''
+LINK_CHECK = float(os.environ.get('TRAIN_LINK_CHECK', 2))
+
+
+class FleetBleak(Bleak):
+    def __init__(self):
+        super().__init__()
+
+        ''' The ble_id of each hub that disconnects is put on this queue (it can be read from curio, see run_fleet in fleet.py) '''
+        self.disconnects = curio.UniversalQueue()
+
+        ''' The hubs that are connected at the moment, by ble_id (a hub is taken out when it disconnects, and put back when it reconnects) '''
+        self.connected = {}
+
+    ''' This replaces bricknil's message loop, it handles the same messages as bricknil plus 'connect_to' and 'discover_to' '''
+    async def asyncio_loop(self):
+        link_check = asyncio.ensure_future(self.check_links()) if LINK_CHECK > 0 else None
+        done = False
+        while not done:
+            msg = await self.in_queue.get()
+            if isinstance(msg, tuple):
+                msg, val = msg
+            await self.in_queue.task_done()
+            if msg == 'discover':
+                ''' The original discover message is still supported (used by bricknil's own connect function) '''
+                await self.out_queue.put(await self.scan())
+            elif msg == 'discover_to':
+                asyncio.ensure_future(self.discover_to(val))
+            elif msg == 'connect':
+                ''' The original connect message is still supported (used by bricknil's own connect function) '''
+                device = self.client(val)
+                self.devices.append(device)
+                await device.connect()
+                self.connected[val] = device
+                await self.out_queue.put(device)
+            elif msg == 'connect_to':
+                address, timeout, reply = val
+                asyncio.ensure_future(self.connect_to(address, timeout, reply))
+            elif msg == 'tx':
+                device, char_uuid, msg_bytes = val
+                try:
+                    await device.write_gatt_char(char_uuid, msg_bytes)
+                except Exception as e:
+                    logging.error(f'Failed to send message to {device.address}: {e}')
+                    ''' The write can also fail for a moment on a hub that is still connected, so the link is checked before reporting it '''
+                    if not await self.is_connected(device):
+                        await self.report_disconnect(device)
+            elif msg == 'notify':
+                device, char_uuid, msg_handler = val
+                try:
+                    await device.start_notify(char_uuid, msg_handler)
+                except Exception as e:
+                    logging.error(f'Failed to switch on notifications from {device.address}: {e}')
+                    await self.report_disconnect(device)
+            elif msg == 'quit':
+                logging.info('quitting')
+                if link_check is not None:
+                    link_check.cancel()
+                ''' The hubs are disconnected on purpose, so they are not reported '''
+                self.connected.clear()
+                for device in self.devices:
+                    try:
+                        await device.disconnect()
+                    except Exception as e:
+                        logging.error(f'Failed to disconnect from {device.address}: {e}')
+                done = True
+            else:
+                logging.error(f'Unknown message to Bleak: {msg}')
+
+    ''' This creates the bleak client for a hub, on the chosen adapter if there is one '''
+    def client(self, address):
+        if BLE_ADAPTER:
+            ''' bleak's BlueZ client picks the adapter with its device argument (it uses hci0 if it is not given) '''
+            device = bleak.BleakClient(address=address, loop=self.loop, device=BLE_ADAPTER)
+        else:
+            device = bleak.BleakClient(address=address, loop=self.loop)
+
+        ''' Newer versions of bleak call this if the hub disconnects (the one bricknil uses can not, see check_links) '''
+        if hasattr(device, 'set_disconnected_callback'):
+            device.set_disconnected_callback(lambda client, *args: asyncio.ensure_future(self.report_disconnect(device)))
+        return device
+
+    ''' This runs a one second scan, on the same adapter as the connections (bleak's BlueZ scan also uses hci0 unless device is given) '''
+    async def scan(self):
+        if BLE_ADAPTER:
+            return await bleak.discover(timeout=1, loop=self.loop, device=BLE_ADAPTER)
+        return await bleak.discover(timeout=1, loop=self.loop)
+
+    ''' This runs a scan and puts either the devices seen or the error on the reply queue '''
+    async def discover_to(self, reply):
+        try:
+            devices = await self.scan()
+        except Exception as e:
+            await reply.put(e)
+            return
+        await reply.put(devices)
+
+    ''' This connects to a single hub and puts either the connected device or the error on the reply queue '''
+    async def connect_to(self, address, timeout, reply):
+        device = self.client(address)
+        try:
+            await asyncio.wait_for(device.connect(), timeout)
+        except Exception as e:
+            await reply.put(e)
+            return
+        self.devices.append(device)
+        self.connected[address] = device
+        await reply.put(device)
+
+    ''' This returns False if bleak says the hub is no longer connected (or can not say, e.g. the hub has gone from BlueZ) '''
+    async def is_connected(self, device):
+        try:
+            return await device.is_connected()
+        except Exception:
+            return False
+
+    ''' This puts the ble_id of a hub that has disconnected on the disconnects queue (once, until the hub is connected again) '''
+    async def report_disconnect(self, device):
+        if self.connected.get(device.address) is not device:
+            return
+        del self.connected[device.address]
+        logging.warning(f'{device.address} has disconnected')
+        await self.disconnects.put(device.address)
+
+    ''' This checks the link to every connected hub every LINK_CHECK seconds, so a hub that is not being sent anything is also found when it drops '''
+    async def check_links(self):
+        while True:
+            await asyncio.sleep(LINK_CHECK)
+            for device in list(self.connected.values()):
+                if not await self.is_connected(device):
+                    await self.report_disconnect(device)
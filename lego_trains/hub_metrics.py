@@ -0,0 +1,202 @@
+''' This module measures how long it takes a Train to react to its sensor, and how long each motor/LED command takes.
+
+It is switched off by default. Set the TRAIN_METRICS environment variable to turn it on, e.g.
+
+    TRAIN_METRICS=1 python3 lesson3.py
+
+Each hub gets three latency histograms:
+    * notification_interval - time between two sensor notifications (train_sensor_change calls)
+    * notification_to_command - time from a sensor notification to the first motor/LED command sent after it
+    * command_round_trip - time taken for set_speed, ramp_speed or set_color to return
+      (bricknil returns once the message is on the Bluetooth queue, it does not wait for the hub to reply)
+
+A summary of every histogram is logged every TRAIN_METRICS_INTERVAL seconds (default 60), and if TRAIN_METRICS_FILE
+is set the raw histograms are also written to that file as JSON, so they can be analysed later.
+
+The histograms use a fixed set of buckets (one per power of two microseconds), so recording a value is just a
+couple of additions and no memory is allocated, which means this can be left switched on while the trains are running. '''
+
+import json
+import logging
+import os
+import time
+
+import curio
+
+
+''' This is the clock used for all timestamps (monotonic, so it can never jump backwards) '''
+clock = time.perf_counter
+
+''' Bucket n holds latencies from 2^(n-1) up to 2^n microseconds, 40 buckets go up to around 6 days '''
+BUCKET_COUNT = 40
+
+''' This stores the metrics for each hub, using the hub name as the key '''
+HUB_METRICS = {}
+
+
+''' This returns True if the TRAIN_METRICS environment variable has been set
+(or TRAIN_METRICS_PORT, as the metrics served by loop_monitor.py include these) '''
+def metrics_enabled():
+    return any(os.environ.get(variable, '') not in ('', '0') for variable in ('TRAIN_METRICS', 'TRAIN_METRICS_PORT'))
+
+
+''' This is a latency histogram with a fixed number of buckets '''
+class LatencyHistogram:
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    ''' This adds a latency (in seconds) to the histogram '''
+    def record(self, seconds):
+        ''' The bucket is worked out from the number of bits needed to store the latency in microseconds '''
+        bucket = int(seconds * 1_000_000).bit_length()
+        self.counts[bucket if bucket < BUCKET_COUNT else BUCKET_COUNT - 1] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    ''' This returns an estimate of the given percentile in seconds (the upper edge of the bucket it falls in) '''
+    def percentile(self, pct):
+        if self.count == 0:
+            return None
+        target = pct / 100 * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min((1 << bucket) / 1_000_000, self.max)
+        return self.max
+
+    ''' This returns a one line summary, e.g. "n=120 mean=0.210ms p50=0.256ms p99=1.024ms max=1.870ms" '''
+    def summary(self):
+        if self.count == 0:
+            return 'n=0'
+        return (f'n={self.count} mean={self.total / self.count * 1000:.3f}ms '
+                f'p50={self.percentile(50) * 1000:.3f}ms p99={self.percentile(99) * 1000:.3f}ms max={self.max * 1000:.3f}ms')
+
+    ''' This returns the raw histogram as a dict, so it can be saved as JSON '''
+    def to_dict(self):
+        return {'bucket_upper_bounds_us': [1 << bucket for bucket in range(BUCKET_COUNT)], 'counts': self.counts,
+                'count': self.count, 'total_s': self.total, 'min_s': self.min, 'max_s': self.max}
+
+
+''' This stores the histograms for a single hub '''
+class HubMetrics:
+    def __init__(self, hub_name, commands=None):
+        self.hub_name = hub_name
+
+        ''' The hub's command layer (see motor_commands.py), if it has one, so its counters are included in the summary '''
+        self.hub_commands = commands
+        self.notification_interval = LatencyHistogram()
+        self.notification_to_command = LatencyHistogram()
+        self.command_round_trip = LatencyHistogram()
+        self.notifications = 0
+        self.commands = 0
+
+        ''' The time of the last sensor notification, and whether a command has been sent since it arrived '''
+        self.last_notification = None
+        self.awaiting_reaction = False
+
+    ''' This is called at the start of every train_sensor_change '''
+    def notification(self, now):
+        self.notifications += 1
+        if self.last_notification is not None:
+            self.notification_interval.record(now - self.last_notification)
+        self.last_notification = now
+        self.awaiting_reaction = True
+
+    ''' This is called when a motor or LED command is sent, and again once it has returned '''
+    def command(self, sent, returned):
+        self.commands += 1
+        if self.awaiting_reaction:
+            self.notification_to_command.record(sent - self.last_notification)
+            self.awaiting_reaction = False
+        self.command_round_trip.record(returned - sent)
+
+    ''' This returns the summary of all three histograms as a list of strings '''
+    def summary(self):
+        lines = [f'{self.hub_name} {name}: {getattr(self, name).summary()}'
+                 for name in ('notification_interval', 'notification_to_command', 'command_round_trip')]
+        if self.hub_commands is not None:
+            lines.append(f'{self.hub_name} commands: ' + ', '.join(f'{name} {count}' for name, count in self.hub_commands.counters().items()))
+        return lines
+
+    def to_dict(self):
+        data = {'notifications': self.notifications, 'commands': self.commands,
+                'notification_interval': self.notification_interval.to_dict(),
+                'notification_to_command': self.notification_to_command.to_dict(),
+                'command_round_trip': self.command_round_trip.to_dict()}
+        if self.hub_commands is not None:
+            data['command_counters'] = self.hub_commands.counters()
+        return data
+
+
+''' This adds the timing wrappers to a Train (the train's own functions and the attached motor/LED are left unchanged) '''
+def instrument_hub(hub):
+    metrics = HubMetrics(hub.hub_name, getattr(hub, 'commands', None))
+    HUB_METRICS[hub.hub_name] = metrics
+    hub.metrics = metrics
+
+    ''' bricknil looks up train_sensor_change on the hub every time, so setting it on the instance wraps it '''
+    if hasattr(hub, 'train_sensor_change'):
+        sensor_change = hub.train_sensor_change
+
+        async def timed_sensor_change():
+            metrics.notification(clock())
+            return await sensor_change()
+
+        hub.train_sensor_change = timed_sensor_change
+
+    ''' Wraps every motor and LED command function that is attached to the hub '''
+    for peripheral in hub.peripherals.values():
+        for method_name in ('set_speed', 'ramp_speed', 'set_color'):
+            if hasattr(peripheral, method_name):
+                _time_command(peripheral, method_name, metrics)
+    return metrics
+
+''' This replaces a command function with one that records when it was sent and when it returned '''
+def _time_command(peripheral, method_name, metrics):
+    method = getattr(peripheral, method_name)
+
+    async def timed_command(*args, **kwargs):
+        sent = clock()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            metrics.command(sent, clock())
+
+    setattr(peripheral, method_name, timed_command)
+
+
+''' This saves the raw histograms for every hub to a JSON file '''
+def export_histograms(file_path):
+    with open(file_path, 'w') as f:
+        json.dump({hub_name: metrics.to_dict() for hub_name, metrics in HUB_METRICS.items()}, f, indent=4)
+
+''' This logs a summary of every hub's histograms (and saves them to a file if one is given) '''
+def dump_metrics(file_path=None):
+    for metrics in HUB_METRICS.values():
+        for line in metrics.summary():
+            logging.info(line)
+    if file_path:
+        export_histograms(file_path)
+
+''' This runs in the background (spawned from run_fleet in fleet.py when the metrics are switched on) and dumps the metrics at a regular interval '''
+async def dump_metrics_periodically(interval=None, file_path=None):
+    interval = interval or float(os.environ.get('TRAIN_METRICS_INTERVAL', 60))
+    file_path = file_path or os.environ.get('TRAIN_METRICS_FILE')
+    try:
+        while True:
+            await curio.sleep(interval)
+            dump_metrics(file_path)
+    finally:
+        ''' Dumps one final time when the task is cancelled, so the end of the run is not lost '''
+        dump_metrics(file_path)
@@ -0,0 +1,188 @@
+''' This module looks after the mapping file (hubs/hub_mapping.json), which stores the name and details of every hub.
+
+The hubs are kept in memory in a dict with the ble_id as the key, so checking if a hub is already known is a single lookup
+(rather than searching through the whole list), and the file never needs to be read back after it has been saved.
+
+The file is only written when something has actually changed, and it is always written to a temporary file first
+which then replaces the mapping file in one step. This means the mapping file can never be left half written
+(e.g. if the script crashes or the power is lost while saving). If the mapping file does contain invalid JSON
+(e.g. after editing it by hand), it is kept as hub_mapping.json.corrupt-<date and time> rather than being silently replaced.
+
+The time each hub was last initiated changes on every start, so it is kept in a small file of its own
+(hub_mapping_last_initiated.json), and the mapping file is left alone unless a hub's details have changed. '''
+
+import datetime
+import json
+import logging
+import os
+import tempfile
+
+''' This gets the root (top level) folder path and then assigns a path for a sub folder where the hub info will be saved as a JSON file '''
+ROOT = os.getcwd()
+HUB_PATH = f'{ROOT}/hubs'
+MAPPING_FILE = f'{HUB_PATH}/hub_mapping.json'
+
+
+''' This is the hub registry, which is loaded from the mapping file when it is created '''
+class HubRegistry:
+    def __init__(self, file_path=MAPPING_FILE):
+        self.file_path = file_path
+        self.hubs = {}
+        self.dirty = False
+        self.exists = False
+
+        ''' The time each hub was last initiated (by ble_id), and the file they are saved in '''
+        self.last_initiated = {}
+        self.last_initiated_path = f'{os.path.splitext(file_path)[0]}_last_initiated.json'
+        self.last_initiated_dirty = False
+        self.load()
+
+    ''' These let the registry be used like a list of hubs (e.g. len(registry), for hub_info in registry, ble_id in registry) '''
+    def __len__(self):
+        return len(self.hubs)
+
+    def __iter__(self):
+        return iter(self.hubs.values())
+
+    def __contains__(self, ble_id):
+        return ble_id in self.hubs
+
+    ''' This returns the details of a hub (or None if the hub is not in the registry) '''
+    def get(self, ble_id):
+        return self.hubs.get(ble_id)
+
+    ''' This returns the hubs as a list of dicts, in the same format as the mapping file '''
+    def as_list(self):
+        return list(self.hubs.values())
+
+    ''' This loads the hubs from the mapping file '''
+    def load(self):
+        self.hubs = {}
+        self.dirty = False
+        self.load_last_initiated()
+        self.exists = os.path.exists(self.file_path)
+        if not self.exists:
+            return
+
+        with open(self.file_path, 'r') as f:
+            text = f.read()
+
+        ''' An empty file is treated as an empty list of hubs '''
+        if not text.strip():
+            return
+
+        try:
+            hubs = json.loads(text)
+        except json.JSONDecodeError:
+            ''' The file is moved out of the way (rather than overwritten) so no hub details are lost, and a new mapping file will be created.
+            The copy is named with the date and time, so it never replaces a copy kept from an earlier time '''
+            stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+            corrupt_path = f'{self.file_path}.corrupt-{stamp}'
+            copy = 1
+            while os.path.exists(corrupt_path):
+                copy += 1
+                corrupt_path = f'{self.file_path}.corrupt-{stamp}-{copy}'
+            os.rename(self.file_path, corrupt_path)
+            logging.error(f"{self.file_path} contains invalid JSON, it has been moved to {corrupt_path} and a new mapping file will be created.")
+            self.exists = False
+            return
+
+        for hub_info in hubs:
+            self.hubs[hub_info['ble_id']] = hub_info
+
+    ''' This loads the last initiated times, a missing or unreadable file just means the times are not known '''
+    def load_last_initiated(self):
+        self.last_initiated = {}
+        self.last_initiated_dirty = False
+        try:
+            with open(self.last_initiated_path, 'r') as f:
+                self.last_initiated = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    ''' This adds a hub to the registry (if it is not already in it) and returns its details '''
+    def add(self, ble_id, hub_name=None, **fields):
+        if ble_id in self.hubs:
+            return self.hubs[ble_id]
+
+        ''' If no name is given, assigns a default name of train_n (where n is the hub count + 1, or the next number not already
+        used, as a manifest can give hubs any name, see provisioning.py) and sets the new flag to True, so the user will get prompted to name the hub later '''
+        if hub_name is None:
+            number = len(self.hubs) + 1
+            names = {hub_info['hub_name'] for hub_info in self.hubs.values()}
+            while f'train_{number}' in names:
+                number += 1
+            hub_name = f'train_{number}'
+            fields.setdefault('new', True)
+
+        hub_info = {'hub_name': hub_name, 'ble_id': ble_id, **fields}
+        self.hubs[ble_id] = hub_info
+        self.dirty = True
+        return hub_info
+
+    ''' This adds any device ids that are not already in the registry, and returns the number of hubs added '''
+    def add_new(self, ble_ids):
+        added = 0
+        for ble_id in ble_ids:
+            if ble_id not in self.hubs:
+                self.add(ble_id)
+                added += 1
+        return added
+
+    ''' This changes the details of a hub, the registry is only marked as changed if a value is different '''
+    def update(self, ble_id, **fields):
+        hub_info = self.hubs[ble_id]
+        for key, value in fields.items():
+            if hub_info.get(key) != value:
+                hub_info[key] = value
+                self.dirty = True
+        return hub_info
+
+    ''' This returns the time a hub was last initiated (older mapping files kept it with the hub's details), or None if it never has been '''
+    def last_initiated_at(self, ble_id):
+        return self.last_initiated.get(ble_id) or (self.hubs.get(ble_id) or {}).get('last_initiated')
+
+    ''' This sets the last_initiated time of a group of hubs (all of them if no ble_ids are given) to the same time in one go,
+    the mapping file itself is not marked as changed (the times are saved to their own file) '''
+    def touch(self, ble_ids=None, when=None):
+        timestamp = (when or datetime.datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+        for ble_id in (self.hubs if ble_ids is None else ble_ids):
+            if self.last_initiated.get(ble_id) != timestamp:
+                self.last_initiated[ble_id] = timestamp
+                self.last_initiated_dirty = True
+
+    ''' This saves the registry to the mapping file, but only if something has changed (or force is True),
+    and the last initiated times to their own file if they have changed. It returns True if the mapping file was written '''
+    def save(self, force=False):
+        if self.last_initiated_dirty:
+            write_atomic(self.last_initiated_path, self.last_initiated)
+            self.last_initiated_dirty = False
+
+        if not self.dirty and not force:
+            return False
+
+        write_atomic(self.file_path, self.as_list())
+        self.dirty = False
+        self.exists = True
+        return True
+
+
+''' This writes data as JSON to a temporary file in the same folder, makes sure it is on the disk, and then replaces the file with it '''
+def write_atomic(file_path, data):
+    ''' Creates the hubs folder if it does not exist yet '''
+    folder = os.path.dirname(file_path) or '.'
+    os.makedirs(folder, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.hub_mapping.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+
+        ''' mkstemp makes the file readable by this user only, this gives it the normal permissions of the mapping file '''
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
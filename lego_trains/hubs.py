@@ -0,0 +1,94 @@
+''' This module holds the steps every lesson runs before the trains are connected: finding the active hubs,
+naming any new ones and loading the list of hubs from the mapping file. In headless mode the new hubs are not
+named here, so the start up never waits for someone to type a name (see provisioning.py).
+
+It only uses the standard library (plus hub_registry.py and discovery_client.py, which do too), so the command line
+tool (python3 -m lego_trains) can list, scan and name hubs without importing bricknil, curio or bleak. '''
+
+import logging
+import subprocess
+
+from .hub_registry import HubRegistry, MAPPING_FILE
+from .discovery_client import update_mapping_from_daemon
+from .provisioning import start_manifest, headless_reason, load_manifest, apply_manifest, pending_hubs
+
+
+''' This function prompts the user to name the hub '''
+def prompt_for_hub_name(default_name):
+    ''' This prompts the user to name the hub if it is a new entry, the user can just press enter to use the existing name '''
+    hub_name = input(f"Enter a name for the new hub (default: {default_name}): ")
+    return hub_name if hub_name.strip() else default_name
+
+''' This updates the mapping file '''
+def update_mapping_file(registry, interactive=None, manifest_file=None):
+    ''' This updates the mapping file based on the new name of the hub (can be unchanged) and the current time to show when it was last initiated '''
+    if interactive is None:
+        ''' Headless mode is on if TRAIN_HEADLESS is set or the hubs were set up from a manifest (see provisioning.py) '''
+        reason = headless_reason(manifest_file)
+        interactive = reason is None
+        if reason is not None:
+            logging.warning(f'Headless mode is on ({reason}), new hubs will not be asked for a name')
+
+    ''' Loops through all the hubs in the hub registry (which was loaded from the mapping file, see hub_registry.py) that are waiting to be named '''
+    for hub_info in pending_hubs(registry):
+        if not interactive:
+            ''' In headless mode the new hubs keep their automatic names and stay marked as new, so they are named later instead '''
+            logging.warning(f"{hub_info['hub_name']} ({hub_info['ble_id']}) is new and is running with its automatic name, name it with python3 -m lego_trains name")
+            continue
+
+        ''' This will update the hub information (in memory) with the new name and also sets the new key to False,
+        so on the next initiation the user is not prompted to change the name again'''
+        registry.update(hub_info['ble_id'], hub_name=prompt_for_hub_name(hub_info['hub_name']), new=False)
+
+    ''' This updates every hub (in memory) with the current date and time in one go, to show when the last initiation took place '''
+    registry.touch()
+
+    ''' This saves the times, and the hub data to the mapping file if any hub has changed (there is no need to read it back as the registry already holds the updated hubs) '''
+    registry.save()
+    return registry.as_list()
+
+''' This returns the list of hubs to connect to '''
+def get_hubs(file_path=MAPPING_FILE, manifest_file=None, interactive=None):
+    ''' Loads hubs from the mapping file (the discover_hubs function in scan_hubs.py should add any new hubs to the file) '''
+    registry = HubRegistry(file_path)
+
+    ''' If there is a manifest (given with --manifest or the TRAIN_MANIFEST environment variable), the names and settings of the hubs in it are added first '''
+    if manifest_file is None:
+        manifest_file = start_manifest()
+    if manifest_file:
+        changed = apply_manifest(registry, load_manifest(manifest_file))
+        logging.info(f'{changed} hubs added or changed from the manifest {manifest_file}.')
+
+    if not registry.exists and not len(registry):
+        ''' If the mapping file does not exist (and there was no manifest) there are no hubs to connect to '''
+        logging.error('Mapping file not found. Please run discover_hubs function first.')
+    elif not len(registry):
+        ''' If the mapping file exists, but is empty then there are no hubs to connect to either '''
+        logging.error('No hubs found in the mapping file.')
+
+    ''' Checks to see if there are any new entries to the mapping list and prompts the user to re-name them (unless in headless mode) '''
+    return update_mapping_file(registry, interactive, manifest_file)
+
+''' This function runs our scan_hubs script as a sub process to detect any active hubs.
+We have to run it from a different script as a sub process as it uses a different library to bricknil
+and this causes conflicts when run in the main script. '''
+def run_ble_scan():
+    ''' If the discovery daemon is running (see discovery_daemon.py) it already knows which hubs are active, so there is no need to scan '''
+    if update_mapping_from_daemon():
+        logging.info("Hubs loaded from the discovery daemon.")
+        return True
+
+    logging.info("Running BLE scan subprocess...")
+
+    ''' Run the external script using subprocess '''
+    process = subprocess.Popen(['python3', 'scan_hubs.py'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    ''' Once the scan has completed, displays the output to the user '''
+    stdout, stderr = process.communicate()
+
+    ''' Check if the subprocess completed successfully '''
+    if process.returncode != 0:
+        logging.info(f"Error in Hub detection subprocess: {stderr.decode()}, exiting script.")
+        return False
+    logging.info(f"Subprocess completed successfully: {stdout.decode()}")
+    return True
@@ -0,0 +1,108 @@
+''' This module is a simulated (pretend) layout, so several trains sharing one track with block signals (see block_signals.py)
+can be run and measured without a track or any Bluetooth hubs.
+
+Each train is run on a SimHub (see sim_hub.py), and one task moves every train along the track:
+    * the track is a loop of blocks, each one block long, and a train's position is measured in blocks from the first marker
+    * each tick, every train moves forward by its motor speed multiplied by speed_scale (blocks per second for each unit of speed)
+    * the last marker_length of each block is the coloured marker for the next block, anywhere else the sensor sees black.
+      Like a real VisionSensor, a reading is only sent to the train when the colour changes
+
+Trains are points on the track, a conflict is counted each tick two trains are in the same block at the same time.
+
+    result = curio.run(simulate_layout, lesson4.Train, BlockSignals(lesson4.MARKER_COLOURS), 3, 60)
+    print(result.laps_per_minute, result.conflicts) '''
+
+import time
+
+import curio
+from bricknil.const import Color
+
+from .sim_hub import SimHub
+
+
+''' This is what was measured during a run of the simulated layout '''
+class LayoutResult:
+    def __init__(self, trains, laps, seconds, conflicts, held_seconds):
+        self.trains = trains
+        self.laps = laps
+        self.seconds = seconds
+        self.conflicts = conflicts
+        self.held_seconds = held_seconds
+
+    ''' The number of laps completed by all the trains together, per minute '''
+    @property
+    def laps_per_minute(self):
+        return self.laps / self.seconds * 60
+
+
+''' This is the pretend layout, it moves the trains and sends each one the colour under its sensor '''
+class Layout:
+    def __init__(self, signals, sims, marker_length=0.1, speed_scale=0.05):
+        self.signals = signals
+        self.sims = sims
+        self.marker_length = marker_length
+        self.speed_scale = speed_scale
+        self.block_count = signals.block_count
+
+        ''' The trains start spread out evenly, each one in its own block '''
+        self.positions = [i * self.block_count // len(sims) for i in range(len(sims))]
+        self.readings = [None] * len(sims)
+        self.conflicts = 0
+
+        ''' The total time the trains have spent stopped at a marker, waiting for the block to be released '''
+        self.held_seconds = 0
+
+    ''' This returns the colour under a sensor at the given position on the track '''
+    def colour_at(self, position):
+        if position % 1 >= 1 - self.marker_length:
+            return self.signals.marker_colours[int(position + 1) % self.block_count]
+        return Color.black
+
+    ''' This moves every train by its speed for the time since the last tick, and sends each train its new reading if it has changed '''
+    async def tick(self, seconds):
+        for i, sim in enumerate(self.sims):
+            speed = sim.hub.peripherals['motor'].speed
+            if speed <= 0 and self.readings[i] is not None:
+                self.held_seconds += seconds
+            self.positions[i] = (self.positions[i] + max(0, speed) * self.speed_scale * seconds) % self.block_count
+            colour = self.colour_at(self.positions[i])
+            if colour != self.readings[i]:
+                self.readings[i] = colour
+                await sim.feed('sense_color', colour.value)
+
+        ''' Checks no two trains are in the same block '''
+        blocks = [int(position) for position in self.positions]
+        self.conflicts += len(blocks) - len(set(blocks))
+
+    ''' This runs the layout for the given number of seconds, ticking every tick seconds '''
+    async def run(self, seconds, tick=0.01):
+        start = last = time.monotonic()
+        while last - start < seconds:
+            await curio.sleep(tick)
+            now = time.monotonic()
+            await self.tick(now - last)
+            last = now
+        return last - start
+
+
+''' This runs the given number of trains (of the given Train class, e.g. lesson4.Train) on the simulated layout for the given
+number of seconds, and returns a LayoutResult '''
+async def simulate_layout(train_class, signals, trains, seconds, marker_length=0.1, speed_scale=0.05):
+    if trains >= signals.block_count:
+        raise ValueError(f'At most {signals.block_count - 1} trains can run on a layout with {signals.block_count} blocks')
+
+    sims = [SimHub(train_class(f'sim_train_{i}', ble_id=f'00:00:00:00:00:{i:02x}')) for i in range(trains)]
+    layout = Layout(signals, sims, marker_length, speed_scale)
+    run_tasks = []
+    for sim, position in zip(sims, layout.positions):
+        ''' Every train uses the layout's signals, which are told the block each train starts in (as the trains have not passed a marker yet) '''
+        sim.hub.signals = signals
+        signals.place(sim.hub, int(position))
+        await sim.connect()
+        run_tasks.append(await curio.spawn(sim.hub.run))
+
+    laps_before = signals.laps
+    elapsed = await layout.run(seconds)
+    for run_task in run_tasks:
+        await run_task.cancel()
+    return LayoutResult(trains, signals.laps - laps_before, elapsed, layout.conflicts, layout.held_seconds)
@@ -0,0 +1,218 @@
+''' This module watches the curio loop itself, to show why a train reacted late: a slow Bluetooth link, a loop that was kept busy,
+or a run function (or train_sensor_change) that ran for too long without giving the other trains a turn.
+
+It is switched off by default. Set the TRAIN_METRICS_PORT environment variable to the port to serve the metrics on, e.g.
+
+    TRAIN_METRICS_PORT=9108 python3 lesson3.py
+    curl http://127.0.0.1:9108/metrics
+
+It measures:
+    * loop lag: a watchdog task sleeps for TRAIN_WATCHDOG_INTERVAL seconds (default 0.1) over and over, and records how late it
+      wakes up. If the loop is kept busy, every task (including the ones passing on sensor readings) is late by this much
+    * run time: how long each train's run function and its sensor task (the one that calls train_sensor_change) run for, and the
+      longest single step (the time between two awaits). A step longer than TRAIN_WATCHDOG_STALL seconds (default 0.05)
+      is logged as a warning with the name of the task, whichever task it is
+    * the number of sensor notifications and motor/LED commands of each hub, and the time from a notification to the command
+      it caused (these come from hub_metrics.py, which is switched on along with this)
+
+The run times are measured with a curio Activation (curio calls it each time a task starts and stops running), which only
+reads the clock and adds to a few counters, so it can be left switched on while the trains are running.
+The metrics are served in the Prometheus text format, on 127.0.0.1 only. Each worker of the supervisor (see supervisor.py)
+serves its own metrics, on the port plus the worker's number. '''
+
+import logging
+import os
+import time
+
+import curio
+from curio.kernel import Activation
+from curio.network import tcp_server
+
+from .hub_metrics import LatencyHistogram, BUCKET_COUNT, HUB_METRICS
+
+
+''' This is the clock used for all timings (the same one as hub_metrics.py) '''
+clock = time.perf_counter
+
+''' These are the default settings, how often the watchdog wakes up and how long a step has to be to be logged '''
+WATCHDOG_INTERVAL = float(os.environ.get('TRAIN_WATCHDOG_INTERVAL', 0.1))
+STALL_SECONDS = float(os.environ.get('TRAIN_WATCHDOG_STALL', 0.05))
+
+''' The loop monitor for this process (only one is created, see loop_activations) '''
+_monitor = None
+
+
+''' This returns the port the metrics are served on, or None if the TRAIN_METRICS_PORT environment variable has not been set '''
+def metrics_port():
+    port = os.environ.get('TRAIN_METRICS_PORT', '')
+    if port in ('', '0'):
+        return None
+    ''' A worker started by the supervisor uses the next port along for each worker '''
+    return int(port) + int(os.environ.get('TRAIN_WORKER', 0))
+
+
+''' This is the run time of one train task: the total time it has run for, the number of steps and the longest step '''
+class TaskTimes:
+    __slots__ = ('total', 'steps', 'longest')
+
+    def __init__(self):
+        self.total = 0.0
+        self.steps = 0
+        self.longest = 0.0
+
+
+''' This watches every task in the curio loop, and measures the run time of the tasks it has been told about (see track) '''
+class LoopMonitor(Activation):
+    def __init__(self, interval=WATCHDOG_INTERVAL, stall_seconds=STALL_SECONDS):
+        self.interval = interval
+        self.stall_seconds = stall_seconds
+
+        ''' How late the watchdog woke up each time, and the number of steps (of any task) longer than stall_seconds '''
+        self.lag = LatencyHistogram()
+        self.stalls = 0
+
+        ''' The run time of each train's tasks, using (hub name, task) as the key, e.g. ('train1', 'run'),
+        and the key of each task being tracked, using the curio task id as the key '''
+        self.run_times = {}
+        self.tracked = {}
+
+        ''' The time the task that is running now was started '''
+        self.started = 0.0
+
+    ''' This tells the monitor which train a task belongs to, role is what the task does (run or sensor) '''
+    def track(self, task, hub_name, role):
+        key = (hub_name, role)
+        if key not in self.run_times:
+            self.run_times[key] = TaskTimes()
+        self.tracked[task.id] = key
+
+    ''' curio calls this just before a task runs '''
+    def running(self, task):
+        self.started = clock()
+
+    ''' curio calls this once the task has stopped running (it has reached an await that has to wait) '''
+    def suspended(self, task, trap):
+        elapsed = clock() - self.started
+        key = self.tracked.get(task.id)
+        if key is not None:
+            times = self.run_times[key]
+            times.total += elapsed
+            times.steps += 1
+            if elapsed > times.longest:
+                times.longest = elapsed
+        if elapsed > self.stall_seconds:
+            self.stalls += 1
+            name = f'{key[0]} {key[1]}' if key is not None else task.name
+            logging.warning(f'{name} ran for {elapsed * 1000:.1f}ms without giving the other tasks a turn')
+
+    ''' curio calls this once a task has finished '''
+    def terminated(self, task):
+        self.tracked.pop(task.id, None)
+
+    ''' This is the watchdog, it sleeps for interval seconds over and over and records how late it wakes up '''
+    async def watchdog(self):
+        while True:
+            start = clock()
+            await curio.sleep(self.interval)
+            self.lag.record(max(0.0, clock() - start - self.interval))
+
+    ''' This returns every metric in the Prometheus text format '''
+    def prometheus(self):
+        lines = ['# HELP train_loop_lag_seconds How late the watchdog woke up (the time the curio loop was busy with other tasks)',
+                 '# TYPE train_loop_lag_seconds histogram']
+        lines += _histogram_lines('train_loop_lag_seconds', self.lag)
+        lines += ['# HELP train_loop_stalls_total Task steps that ran for longer than the stall time without an await',
+                  '# TYPE train_loop_stalls_total counter',
+                  f'train_loop_stalls_total {self.stalls}']
+
+        lines += ['# HELP train_task_seconds_total Time each train task has spent running',
+                  '# TYPE train_task_seconds_total counter']
+        lines += [f'train_task_seconds_total{{hub="{hub_name}",task="{role}"}} {times.total}'
+                  for (hub_name, role), times in self.run_times.items()]
+        lines += ['# HELP train_task_steps_total Number of times each train task has run',
+                  '# TYPE train_task_steps_total counter']
+        lines += [f'train_task_steps_total{{hub="{hub_name}",task="{role}"}} {times.steps}'
+                  for (hub_name, role), times in self.run_times.items()]
+        lines += ['# HELP train_task_step_max_seconds The longest each train task has run without an await',
+                  '# TYPE train_task_step_max_seconds gauge']
+        lines += [f'train_task_step_max_seconds{{hub="{hub_name}",task="{role}"}} {times.longest}'
+                  for (hub_name, role), times in self.run_times.items()]
+
+        lines += ['# HELP train_notifications_total Sensor notifications passed to train_sensor_change',
+                  '# TYPE train_notifications_total counter']
+        lines += [f'train_notifications_total{{hub="{hub_name}"}} {metrics.notifications}' for hub_name, metrics in HUB_METRICS.items()]
+        lines += ['# HELP train_commands_total Motor and LED commands sent',
+                  '# TYPE train_commands_total counter']
+        lines += [f'train_commands_total{{hub="{hub_name}"}} {metrics.commands}' for hub_name, metrics in HUB_METRICS.items()]
+
+        ''' The reaction time of each hub is a summary (two percentiles), a full histogram for every hub would make each scrape very long '''
+        lines += ['# HELP train_notification_to_command_seconds Time from a sensor notification to the first command sent after it',
+                  '# TYPE train_notification_to_command_seconds summary']
+        for hub_name, metrics in HUB_METRICS.items():
+            histogram = metrics.notification_to_command
+            for pct in (50, 99):
+                if histogram.count:
+                    lines.append(f'train_notification_to_command_seconds{{hub="{hub_name}",quantile="{pct / 100}"}} {histogram.percentile(pct)}')
+            lines.append(f'train_notification_to_command_seconds_sum{{hub="{hub_name}"}} {histogram.total}')
+            lines.append(f'train_notification_to_command_seconds_count{{hub="{hub_name}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    ''' This answers one HTTP request, /metrics returns the metrics and anything else is not found '''
+    async def handle_request(self, client, address):
+        stream = client.as_stream()
+        request = (await stream.readline()).decode(errors='replace').split()
+
+        ''' The rest of the request (the headers) is read and ignored '''
+        async for line in stream:
+            if not line.strip():
+                break
+
+        if len(request) >= 2 and request[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', self.prometheus().encode()
+        else:
+            status, body = '404 Not Found', b'Not found, the metrics are at /metrics\n'
+        await stream.write(f'HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                           f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+
+    ''' This serves the metrics on 127.0.0.1 (so they can only be read from the same computer) '''
+    async def serve(self, port):
+        logging.info(f'Serving metrics on http://127.0.0.1:{port}/metrics')
+        await tcp_server('127.0.0.1', port, self.handle_request)
+
+
+''' This returns the monitor for this process (creating it the first time), or None if TRAIN_METRICS_PORT has not been set '''
+def loop_monitor():
+    global _monitor
+    if _monitor is None and metrics_port() is not None:
+        _monitor = LoopMonitor()
+    return _monitor
+
+''' This returns the list of activations to pass to curio.run, so the monitor sees every task (an empty list if it is switched off) '''
+def loop_activations():
+    monitor = loop_monitor()
+    return [monitor] if monitor is not None else []
+
+''' This tells the monitor (if it is switched on) which train a task belongs to '''
+def track_task(task, hub, role):
+    if _monitor is not None:
+        _monitor.track(task, hub.hub_name, role)
+
+''' This starts the watchdog and the metrics server in the background (called from run_fleet, does nothing if the monitor is switched off) '''
+async def start_loop_monitor():
+    if _monitor is None:
+        return
+    await curio.spawn(_monitor.watchdog, daemon=True)
+    await curio.spawn(_monitor.serve, metrics_port(), daemon=True)
+
+
+''' This returns the lines of a Prometheus histogram (the buckets are the ones used by LatencyHistogram, counted up to each bucket's upper edge) '''
+def _histogram_lines(name, histogram):
+    lines = []
+    seen = 0
+    for bucket in range(BUCKET_COUNT - 1):
+        seen += histogram.counts[bucket]
+        lines.append(f'{name}_bucket{{le="{(1 << bucket) / 1_000_000}"}} {seen}')
+    lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum {histogram.total}')
+    lines.append(f'{name}_count {histogram.count}')
+    return lines
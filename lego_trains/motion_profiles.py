@@ -0,0 +1,154 @@
+''' This module runs motion programs (accelerate, hold, slow down, reverse...) for all the trains from one shared timer.
+
+Lesson 1 used to move the train with a chain of ramp_speed and curio.sleep calls. Each sleep only starts once the
+previous command has been sent, so every command that is slow to send pushes the rest of the program later (drift),
+and every train has its own sleeping tasks (plus one more for each ramp_speed). Here:
+    * a motion program is written as data, a list of segments: the target speed, the seconds to ramp to it and the seconds to hold it
+    * a MotionProfile works out (once, when it is created) the time of every speed step from the start of the program
+    * one MotionScheduler keeps the time for every train's program, it keeps the next step of each train in a heap (sorted by time)
+      and sleeps until the earliest one is due, then tells that train to send it. Each step is due at a fixed time from
+      the start, so a slow command does not make the rest of the program late
+
+    LESSON1_PROFILE = MotionProfile([Segment(40, ramp=2), Segment(0, ramp=0.5), Segment(-40, ramp=2), Segment(0, ramp=0.5)])
+    await run_profile(self.motor, LESSON1_PROFILE) '''
+
+import heapq
+import itertools
+import time
+from collections import namedtuple
+
+import curio
+
+''' This is one segment of a motion program: ramp to speed over ramp seconds, then hold it for hold seconds '''
+Segment = namedtuple('Segment', ['speed', 'ramp', 'hold'], defaults=[0, 0])
+
+''' This is how often (in seconds) the speed is changed during a ramp, the same as bricknil's ramp_speed '''
+RAMP_STEP = 0.1
+
+
+''' This is a motion program, worked out into a timeline of (seconds from the start, speed) steps '''
+class MotionProfile:
+    def __init__(self, segments, start_speed=0, step=RAMP_STEP):
+        self.segments = [Segment(*segment) for segment in segments]
+        self.timeline = []
+        t = 0
+        speed = start_speed
+        for segment in self.segments:
+            if segment.ramp > 0:
+                ''' The ramp is split into equal steps, the last one reaching the target speed at the end of the ramp '''
+                steps = max(1, round(segment.ramp / step))
+                for i in range(1, steps + 1):
+                    self.add_step(t + segment.ramp * i / steps, round(speed + (segment.speed - speed) * i / steps))
+            else:
+                self.add_step(t, segment.speed)
+            speed = segment.speed
+            t += segment.ramp + segment.hold
+
+        ''' The total length of the program in seconds (including the hold at the end) '''
+        self.duration = t
+
+    ''' This adds a step to the timeline, unless the speed is the same as the step before '''
+    def add_step(self, t, speed):
+        if self.timeline and self.timeline[-1][1] == speed:
+            return
+        self.timeline.append((t, speed))
+
+
+''' This is one train running a motion program '''
+class RunningProfile:
+    def __init__(self, profile, start_time):
+        self.profile = profile
+        self.start_time = start_time
+
+        ''' index is the next step for the timer to wait for, due_index is the latest step that is due to be sent '''
+        self.index = 0
+        self.due_index = None
+        self.step_due = curio.Event()
+        self.cancelled = False
+
+    ''' This returns the time the next step is due (on the time.monotonic clock) '''
+    def next_due(self):
+        return self.start_time + self.profile.timeline[self.index][0]
+
+
+''' This is the shared timer, one task keeps the time for the programs of every train '''
+class MotionScheduler:
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.task = None
+        self.wakeup = None
+
+    ''' This starts timing a program, and returns the RunningProfile (its step_due event is set each time a step is due) '''
+    async def start(self, profile, start_time=None):
+        ''' The timer task is started the first time it is needed (and again if curio has been restarted since) '''
+        if self.task is None or self.task.terminated:
+            self.heap = []
+            self.wakeup = curio.Event()
+            self.task = await curio.spawn(self.run, daemon=True)
+
+        running = RunningProfile(profile, time.monotonic() if start_time is None else start_time)
+        if profile.timeline:
+            self.push(running)
+
+            ''' Wakes the timer up, in case this step is due before the one it is sleeping until '''
+            await self.wakeup.set()
+        return running
+
+    ''' This adds the next step of a program to the heap (the counter keeps programs due at the same time in the order they were added) '''
+    def push(self, running):
+        heapq.heappush(self.heap, (running.next_due(), next(self.counter), running))
+
+    ''' This is the timer task, it sleeps until the earliest step is due, tells that train and then adds the train's next step '''
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+
+            due, _, running = self.heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                await curio.ignore_after(delay, self.wakeup.wait)
+                continue
+
+            heapq.heappop(self.heap)
+            if running.cancelled:
+                continue
+
+            ''' The timer does not send the command itself (so a slow command for one train does not hold up the others),
+            and the next step is due at its own time from the start of the program (not from now) '''
+            running.due_index = running.index
+            running.index += 1
+            if running.index < len(running.profile.timeline):
+                self.push(running)
+            await running.step_due.set()
+
+
+''' This is the scheduler shared by all the trains '''
+scheduler = MotionScheduler()
+
+
+''' This runs a motion program on a motor and waits until it has finished (including the hold at the end) '''
+async def run_profile(motor, profile, motion_scheduler=None):
+    running = await (motion_scheduler or scheduler).start(profile)
+    last_index = len(profile.timeline) - 1
+    try:
+        ''' The train waits (without a timer of its own) until the shared timer says a step is due, and then sends it.
+        If sending took so long that more than one step has become due, only the latest one is sent '''
+        while last_index >= 0:
+            await running.step_due.wait()
+            running.step_due.clear()
+            index = running.due_index
+            await motor.set_speed(profile.timeline[index][1])
+            if index == last_index:
+                break
+
+        ''' The last step may be followed by a hold, the train waits for that as well '''
+        remaining = running.start_time + profile.duration - time.monotonic()
+        if remaining > 0:
+            await curio.sleep(remaining)
+    finally:
+        ''' If the train is cancelled part way through, the timer drops its program '''
+        running.cancelled = True
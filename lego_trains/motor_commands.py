@@ -0,0 +1,179 @@
+''' This module sits between the lessons and the attached motors and LEDs, and decides which commands are actually sent to the hub.
+
+Every command is a message sent over Bluetooth, and a hub can only take so many messages a second. When a sensor is
+chattering, the run function may send the same speed again and again, or several different speeds in quick succession,
+and the command that matters (e.g. stop) ends up waiting behind the others. Here:
+    * a command that would not change anything (e.g. the motor is already at that speed) is dropped (suppressed)
+    * if a command is still waiting to be sent when a newer one for the same motor or LED arrives, only the newest
+      one is sent (coalesced)
+    * each hub can only send rate commands a second (with a burst of up to burst commands at once), any others wait their turn
+    * stop commands (a speed of 0, or 255 for a hard brake, or a ramp down to 0 such as a braking ramp) are never held back,
+      they are sent straight away
+    * fleet-wide commands (see command_bus.py) are sent with priority: straight away, replacing any command still waiting
+      for the same motor or LED. An emergency stop also holds the hub, so the lesson's own speed commands are dropped until it is released
+
+Nothing needs to change in the lessons, the TrainHub class (see train.py) puts a CommandedPeripheral in front of
+each motor and LED, so self.motor.set_speed(20) goes through here. The number of commands issued, suppressed and
+coalesced are kept on hub.commands (and logged with the metrics, see hub_metrics.py).
+
+The rate and burst can be changed with the TRAIN_COMMAND_RATE (default 20 a second) and TRAIN_COMMAND_BURST (default 5)
+environment variables. '''
+
+import os
+import time
+
+import curio
+
+''' These are the default write limits for each hub '''
+COMMAND_RATE = float(os.environ.get('TRAIN_COMMAND_RATE', 20))
+COMMAND_BURST = float(os.environ.get('TRAIN_COMMAND_BURST', 5))
+
+''' These are the functions that send a command, and the setting each one changes (ramp_speed and set_speed both change the speed) '''
+COMMAND_METHODS = {'set_speed': 'speed', 'ramp_speed': 'speed', 'set_color': 'color'}
+
+''' These speeds stop the motor (0 is neutral and 255 is a hard brake) '''
+STOP_SPEEDS = (0, 255)
+
+
+''' This stores one command that has not been sent yet '''
+class Command:
+    __slots__ = ('peripheral', 'method_name', 'args', 'key', 'value')
+
+    def __init__(self, peripheral, method_name, args):
+        self.peripheral = peripheral
+        self.method_name = method_name
+        self.args = args
+
+        ''' The key is the setting this command changes (e.g. the motor's speed), and the value is what it changes it to '''
+        self.key = (peripheral.name, COMMAND_METHODS[method_name])
+        self.value = (method_name, *args)
+
+    ''' This is True for a set_speed that stops the motor, or a ramp_speed that slows it down to 0 (e.g. braking before an object, see braking.py) '''
+    @property
+    def is_stop(self):
+        if self.method_name == 'ramp_speed':
+            return self.args[0] == 0
+        return self.method_name == 'set_speed' and self.args[0] in STOP_SPEEDS
+
+
+''' This is the command layer for one hub '''
+class HubCommands:
+    def __init__(self, hub, rate=COMMAND_RATE, burst=COMMAND_BURST, clock=time.monotonic):
+        self.hub = hub
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+
+        ''' The write budget, one token is used for each command sent and they are topped up at rate tokens a second '''
+        self.tokens = burst
+        self.tokens_at = None
+
+        ''' The last value sent for each setting, and the commands waiting to be sent (oldest first) '''
+        self.last_sent = {}
+        self.pending = {}
+        self.writer_task = None
+
+        ''' True while the hub is held by an emergency stop (see command_bus.py), the lesson's speed commands are dropped until it is released '''
+        self.held = False
+
+        ''' These are the counters for the commands that were sent, dropped, replaced by a newer command and dropped while held '''
+        self.issued = 0
+        self.suppressed = 0
+        self.coalesced = 0
+        self.blocked = 0
+
+    ''' This returns the counters as a dict (e.g. for logging) '''
+    def counters(self):
+        return {'issued': self.issued, 'suppressed': self.suppressed, 'coalesced': self.coalesced, 'blocked': self.blocked, 'pending': len(self.pending)}
+
+    ''' This tops up the write budget and takes a token if there is one '''
+    def take_token(self):
+        now = self.clock()
+        if self.tokens_at is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.tokens_at) * self.rate)
+        self.tokens_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    ''' This is called by a CommandedPeripheral for every command the lesson sends (and by the fleet command bus, with priority=True) '''
+    async def submit(self, peripheral, method_name, *args, priority=False):
+        command = Command(peripheral, method_name, args)
+
+        if self.held and not priority and command.key[1] == 'speed':
+            ''' The hub has been stopped by an emergency stop, so the train must not move until the stop is released '''
+            self.blocked += 1
+            return
+
+        if command.key in self.pending:
+            ''' A command for the same setting is still waiting, it is replaced by this one '''
+            del self.pending[command.key]
+            self.coalesced += 1
+            if command.value == self.last_sent.get(command.key):
+                ''' This command just puts the setting back to what was last sent, so there is nothing left to send '''
+                return
+        elif command.value == self.last_sent.get(command.key):
+            ''' The setting already has this value, so there is no need to send it again '''
+            self.suppressed += 1
+            return
+
+        if command.is_stop or priority:
+            ''' Stop commands (and fleet-wide commands) are sent straight away, ahead of anything waiting and without waiting for the write budget '''
+            await self.send(command)
+        elif not self.pending and self.take_token():
+            ''' If nothing is waiting and the write budget allows it, the command is sent straight away '''
+            await self.send(command)
+        else:
+            ''' Otherwise it waits its turn (in the order the settings were first changed), the writer task sends it once there is budget '''
+            self.pending[command.key] = command
+            if self.writer_task is None:
+                self.writer_task = await curio.spawn(self.write_pending, daemon=True)
+
+    ''' This sends a command to the motor or LED (which sends it to the hub) '''
+    async def send(self, command):
+        self.issued += 1
+        self.last_sent[command.key] = command.value
+        await getattr(command.peripheral, command.method_name)(*command.args)
+
+    ''' This sends the last value of every setting again (e.g. once a hub has reconnected, as its motor has stopped and its LED has been reset) '''
+    async def resend(self):
+        last_sent = list(self.last_sent.items())
+        self.last_sent.clear()
+        for (peripheral_name, _), (method_name, *args) in last_sent:
+            ''' Any command still waiting for the same setting is newer, so it is sent by the writer task instead '''
+            command = Command(self.hub.peripherals[peripheral_name], method_name, args)
+            if command.key not in self.pending:
+                await self.send(command)
+
+    ''' This runs in the background while there are commands waiting, and sends them as the write budget allows '''
+    async def write_pending(self):
+        try:
+            while self.pending:
+                if not self.take_token():
+                    await curio.sleep((1 - self.tokens) / self.rate)
+                    continue
+                key = next(iter(self.pending))
+                await self.send(self.pending.pop(key))
+        finally:
+            self.writer_task = None
+
+
+''' This stands in front of an attached motor or LED, passing its commands through the hub's command layer '''
+class CommandedPeripheral:
+    def __init__(self, peripheral, commands):
+        self.peripheral = peripheral
+        self.commands = commands
+
+    ''' Anything else (e.g. the port, or the sensor value) comes straight from the motor or LED '''
+    def __getattr__(self, name):
+        return getattr(self.peripheral, name)
+
+    async def set_speed(self, speed):
+        await self.commands.submit(self.peripheral, 'set_speed', speed)
+
+    async def ramp_speed(self, target_speed, ramp_time_ms):
+        await self.commands.submit(self.peripheral, 'ramp_speed', target_speed, ramp_time_ms)
+
+    async def set_color(self, color):
+        await self.commands.submit(self.peripheral, 'set_color', color)
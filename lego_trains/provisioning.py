@@ -0,0 +1,127 @@
+''' This module lets the hubs be set up without anyone at the keyboard (e.g. a layout that starts on its own when it is switched on).
+
+Normally each new hub found by the scan stops the start up with a prompt for its name (see prompt_for_hub_name in hubs.py),
+so no train runs until someone answers it. Here:
+    * the names and settings of the hubs can be listed in a manifest, a CSV or JSON file with a row (or object) for each ble_id,
+      which is read into the mapping file in one go. The other columns are the hub's settings (e.g. its speed), which are
+      stored with the hub and passed to its Train (see TrainHub in train.py)
+    * in headless mode no one is asked for a name. A new hub that is not in the manifest keeps the name it was given
+      automatically (train_1, train_2 ...) and still runs, and it stays marked as new, so it is queued for naming later
+      (python3 -m lego_trains name, or listed with python3 -m lego_trains hubs)
+
+A CSV manifest has a header row, ble_id is the only column that must be filled in:
+
+    ble_id,hub_name,speed,distance_thresholds
+    90:84:2B:00:00:01,express,30,
+    90:84:2B:00:00:02,goods,15,"[1.5, 9.5]"
+
+and a JSON manifest is either a list of objects in the same format, or an object with the ble_ids as its keys:
+
+    {"90:84:2B:00:00:01": {"hub_name": "express", "speed": 30}}
+
+The manifest is read at start up if it is given on the lesson's command line (python3 lesson3.py --manifest manifest.csv)
+or its path is in the TRAIN_MANIFEST environment variable, or it can be read once with python3 -m lego_trains provision manifest.csv
+Headless mode is only switched on when it is asked for: by setting the TRAIN_HEADLESS environment variable (e.g. in the
+systemd unit or cron job that starts the layout), or by giving a manifest at start up. It is logged when it is on.
+
+Like hubs.py, this only uses the standard library. '''
+
+import csv
+import json
+import os
+import sys
+
+''' The manifest set in the environment (if any) '''
+MANIFEST_FILE = os.environ.get('TRAIN_MANIFEST')
+
+''' These columns of a manifest are the hub's details, all the others are its settings '''
+HUB_FIELDS = ('ble_id', 'hub_name')
+
+
+''' This returns the manifest to read at start up, from --manifest on the command line or the TRAIN_MANIFEST environment variable (None if there is none) '''
+def start_manifest(argv=None):
+    argv = sys.argv if argv is None else argv
+    if '--manifest' in argv[:-1]:
+        return argv[argv.index('--manifest') + 1]
+    return MANIFEST_FILE
+
+''' This returns why the hubs are being set up without prompting for names, or None if they are not (i.e. the names are prompted for).
+A terminal that can not be typed into does not switch headless mode on by itself, so it is never switched on by mistake '''
+def headless_reason(manifest_file=None):
+    if os.environ.get('TRAIN_HEADLESS'):
+        return 'TRAIN_HEADLESS is set'
+    if manifest_file:
+        return f'the hubs are set up from the manifest {manifest_file}'
+    return None
+
+''' This returns True if the hubs should be set up without prompting for names '''
+def headless(manifest_file=None):
+    return headless_reason(manifest_file) is not None
+
+''' This turns a value from a CSV cell into a number, list etc. where it can (a cell such as "express" stays as it is) '''
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+''' This splits one row (or object) of a manifest into the hub's name and its settings '''
+def manifest_entry(row, ble_id=None):
+    ble_id = ble_id or row.get('ble_id')
+    if not ble_id:
+        raise ValueError(f'A hub in the manifest has no ble_id: {row}')
+
+    ''' Settings can also be given as a settings object of their own (JSON only), the other fields are added to it '''
+    settings = dict(row.get('settings') or {})
+    settings.update((key, value) for key, value in row.items() if key not in HUB_FIELDS and key != 'settings')
+    return {'ble_id': ble_id, 'hub_name': row.get('hub_name') or None, 'settings': settings}
+
+''' This reads a manifest and returns a dict of the hubs in it, with the ble_id as the key '''
+def load_manifest(file_path):
+    if file_path.lower().endswith('.csv'):
+        with open(file_path, newline='') as f:
+            ''' Empty cells are left out, so the hub keeps its automatic name (or the lesson's own setting) '''
+            rows = [{key: value if key in HUB_FIELDS else parse_value(value) for key, value in row.items() if key and value and value.strip()}
+                    for row in csv.DictReader(f)]
+        entries = [manifest_entry(row) for row in rows]
+    else:
+        with open(file_path) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            entries = [manifest_entry(row, ble_id) for ble_id, row in data.items()]
+        else:
+            entries = [manifest_entry(row) for row in data]
+
+    manifest = {}
+    names = set()
+    for entry in entries:
+        if entry['ble_id'] in manifest:
+            raise ValueError(f"{entry['ble_id']} is in the manifest {file_path} more than once")
+        if entry['hub_name'] is not None:
+            if entry['hub_name'] in names:
+                raise ValueError(f"Two hubs in the manifest {file_path} are called {entry['hub_name']}")
+            names.add(entry['hub_name'])
+        manifest[entry['ble_id']] = entry
+    return manifest
+
+''' This adds the hubs in a manifest to the registry (or updates them if they are already in it), and returns the number of hubs changed.
+The registry is not saved, so the caller can save it once along with any other changes '''
+def apply_manifest(registry, manifest):
+    changed = 0
+    for ble_id, entry in manifest.items():
+        fields = {'settings': entry['settings']} if entry['settings'] else {}
+        if entry['hub_name'] is not None:
+            ''' A hub that is named in the manifest does not need to be named again '''
+            fields.update(hub_name=entry['hub_name'], new=False)
+
+        before = dict(registry.get(ble_id) or {})
+        if ble_id in registry:
+            registry.update(ble_id, **fields)
+        else:
+            registry.add(ble_id, **fields)
+        changed += registry.get(ble_id) != before
+    return changed
+
+''' This returns the hubs that are still waiting to be named '''
+def pending_hubs(registry):
+    return [hub_info for hub_info in registry if hub_info.get('new') is True]
@@ -0,0 +1,183 @@
+''' This module lets a Train list how it reacts to its sensor as a table of rules, instead of an if/elif ladder in its run function.
+
+Each rule maps a sensor value (a colour, or a range of distances) to what the train does: set the LED colour, stop, set a speed
+or ramp to a speed, and optionally move to another state. The rules are listed for each state of the train:
+
+    reaction_rules = RuleTable('colour', start='running', states={
+        'running': [Rule(Color.yellow, stop=True, speed=-10),
+                    Rule(Color.blue, stop=True, state='stopped')],
+        'stopped': [],
+    })
+
+    async def run(self):
+        await self.motor.set_speed(20)
+        await self.rules.run()
+
+    distance rules use a Range instead of a colour, e.g. Rule(Range(high=1), ...) for a distance of 1 or less
+
+The table is worked out once for the Train class (and shared by every train): for each state the colours go in a dict, and the
+ranges in a sorted list that is searched by halving it (bisect), so finding the rule for a new value takes the same time however
+many markers the layout has. The rules are only looked at when the sensor reports a new (filtered) value, see set_sensor_value
+in sensor_waits.py, and nothing runs in between. Each train keeps its own RuleRunner, which holds the state it is in.
+
+A state with no rules is where the train finishes, run() returns once it gets there. If the Train has sensor_states
+(see sensor_modes.py) with the same name as a state, the sensor is switched to that mode when the state is entered.
+If the values go through a SensorFilter with thresholds (see sensor_filter.py), check_zones checks the zones fit the rules. '''
+
+import bisect
+
+import curio
+
+
+''' This is a range of sensor values, from low up to high (including both), leaving out low or high means there is no limit on that side '''
+class Range:
+    __slots__ = ('low', 'high')
+
+    def __init__(self, low=None, high=None):
+        self.low = float('-inf') if low is None else low
+        self.high = float('inf') if high is None else high
+        if self.low > self.high:
+            raise ValueError(f'{self} is empty, low must not be more than high')
+
+    def __repr__(self):
+        return f'Range({self.low}, {self.high})'
+
+
+''' This is one rule: the value (or Range) it matches, and what the train does when the sensor reports it '''
+class Rule:
+    __slots__ = ('match', 'led', 'stop', 'speed', 'ramp_ms', 'state')
+
+    def __init__(self, match, led=None, stop=False, speed=None, ramp_ms=None, state=None):
+        ''' The actions are carried out in this order: the LED colour is set, the train stops (speed 0),
+        and then the speed is set (or ramped to over ramp_ms milliseconds). state is the state to move to afterwards '''
+        self.match = match
+        self.led = led
+        self.stop = stop
+        self.speed = speed
+        self.ramp_ms = ramp_ms
+        self.state = state
+
+
+''' This is the worked out rules for one state, with the exact values in a dict and the ranges sorted by their low value '''
+class RuleDispatch:
+    __slots__ = ('exact', 'lows', 'ranges')
+
+    def __init__(self, rules):
+        self.exact = {}
+        ranges = []
+        for rule in rules:
+            if isinstance(rule.match, Range):
+                ranges.append(rule)
+            elif rule.match in self.exact:
+                raise ValueError(f'There are two rules for {rule.match}')
+            else:
+                self.exact[rule.match] = rule
+
+        ranges.sort(key=lambda rule: rule.match.low)
+        for before, after in zip(ranges, ranges[1:]):
+            if after.match.low <= before.match.high:
+                raise ValueError(f'The rules for {before.match} and {after.match} overlap')
+        self.ranges = ranges
+        self.lows = [rule.match.low for rule in ranges]
+
+    ''' This returns the rule for a value (or None if no rule matches it), an exact value is checked before the ranges '''
+    def lookup(self, value):
+        rule = self.exact.get(value)
+        if rule is None and self.ranges:
+            ''' The range that could hold the value is the last one starting at or below it '''
+            index = bisect.bisect_right(self.lows, value) - 1
+            if index >= 0 and value <= self.ranges[index].match.high:
+                rule = self.ranges[index]
+        return rule
+
+    ''' A state with no rules is a final state '''
+    def __bool__(self):
+        return bool(self.exact or self.ranges)
+
+
+''' This is the table of rules for a Train class, attribute is the sensor value the rules are for (colour or distance) '''
+class RuleTable:
+    def __init__(self, attribute, states, start, motor='motor', led='train_led'):
+        self.attribute = attribute
+        self.start = start
+
+        ''' The names of the attached motor and LED that the actions are sent to '''
+        self.motor = motor
+        self.led = led
+
+        if start not in states:
+            raise ValueError(f'The start state {start} is not in the table')
+        for state, rules in states.items():
+            for rule in rules:
+                if rule.state is not None and rule.state not in states:
+                    raise ValueError(f'A rule in {state} moves to {rule.state}, which is not in the table')
+        self.states = {state: RuleDispatch(rules) for state, rules in states.items()}
+
+    ''' This checks a filter's thresholds against the rules, readings are the values the sensor can report (e.g. range(11) for distances).
+    The filter only passes on the first reading in a new zone, so if two readings in the same zone have different rules the second
+    rule may never run (e.g. with thresholds (3, 9.5) a distance of 2 starts the close zone, and the rule for 1 or less is missed) '''
+    def check_zones(self, thresholds, readings):
+        thresholds = sorted(thresholds)
+        for state, dispatch in self.states.items():
+            zones = {}
+            for reading in readings:
+                rule = dispatch.lookup(reading)
+                first, first_rule = zones.setdefault(bisect.bisect_right(thresholds, reading), (reading, rule))
+                if rule is not first_rule:
+                    raise ValueError(f'The thresholds {thresholds} put {first} and {reading} in the same zone, '
+                                     f'but they have different rules in the {state} state')
+
+
+''' This runs a RuleTable for one train, and keeps the state the train is in '''
+class RuleRunner:
+    __slots__ = ('hub', 'table', 'state', 'dispatch', 'finished', 'reactions')
+
+    def __init__(self, hub, table):
+        self.hub = hub
+        self.table = table
+        self.state = table.start
+        self.dispatch = table.states[table.start]
+        self.finished = curio.Event()
+
+        ''' The number of new values that matched a rule '''
+        self.reactions = 0
+
+    ''' This moves the train to a new state, switching its sensor modes if the Train has some for the state '''
+    async def enter(self, state):
+        self.state = state
+        self.dispatch = self.table.states[state]
+        if state in self.hub.sensor_states:
+            await self.hub.sensor_modes.enter(state)
+        if not self.dispatch:
+            await self.finished.set()
+
+    ''' This is called with each new value of the attribute, and carries out the rule that matches it (if any) '''
+    async def react(self, value):
+        self.hub.log.changed(self.table.attribute, value)
+        rule = self.dispatch.lookup(value)
+        if rule is None:
+            return
+        self.reactions += 1
+
+        if rule.led is not None:
+            await getattr(self.hub, self.table.led).set_color(rule.led)
+        motor = getattr(self.hub, self.table.motor)
+        if rule.stop:
+            await motor.set_speed(0)
+            if rule.speed is not None:
+                ''' A fractional gap between stopping and the new speed, so the motor has time to adjust (as in the lessons) '''
+                await curio.sleep(0)
+        if rule.speed is not None:
+            if rule.ramp_ms:
+                await motor.ramp_speed(rule.speed, rule.ramp_ms)
+            else:
+                await motor.set_speed(rule.speed)
+        if rule.state is not None and rule.state != self.state:
+            await self.enter(rule.state)
+
+    ''' This is called from the run function once the train is moving, it switches to the start state's sensor modes
+    and then waits until a final state (one with no rules) is reached '''
+    async def run(self):
+        if self.state == self.table.start:
+            await self.enter(self.state)
+        await self.finished.wait()
@@ -0,0 +1,67 @@
+''' This module reconnects a hub that has dropped its Bluetooth connection, while the other trains keep running.
+
+Without it, a hub that drops out (e.g. it went out of range, or its batteries were swapped) stays disconnected until the
+lesson is restarted, which scans again, asks for names again and reconnects every hub. Here:
+    * the Bluetooth bridge (see fleet_bleak.py) reports each hub that disconnects, and the ReconnectManager
+      reconnects just that hub, directly by its ble_id (no scan and no prompts), with the same timeout and backoff as the first
+      connection (1, 2, 4... seconds, see fleet.py)
+    * the train's run function is not stopped, any commands it sends while the hub is away are kept by the command layer
+      (see motor_commands.py), and once the hub is back the last speed and LED colour are sent to it again
+    * the time each reconnect took is logged and stored in ReconnectManager.events (and recorded in the telemetry, if it is switched on)
+
+run_fleet starts a ReconnectManager for the fleet, so nothing needs to change in the lessons. '''
+
+import logging
+
+import curio
+
+
+''' This is the reconnect manager for a fleet, the connector is the one used to connect the hubs in the first place (FleetConnector in fleet.py) '''
+class ReconnectManager:
+    def __init__(self, connector):
+        self.connector = connector
+
+        ''' The hubs being reconnected at the moment, and a record of every reconnect (hub name, seconds taken and attempts) '''
+        self.reconnecting = set()
+        self.events = []
+
+    ''' This is called when a hub has disconnected, it starts reconnecting the hub in the background (unless it already is) '''
+    async def dropped(self, hub):
+        if hub.hub_name in self.reconnecting:
+            return
+        self.reconnecting.add(hub.hub_name)
+        await curio.spawn(self.reconnect, hub, daemon=True)
+
+    ''' This reconnects one hub, and then sends it the last speed and LED colour again '''
+    async def reconnect(self, hub):
+        logging.warning(f'{hub.hub_name} has disconnected, reconnecting')
+        start_time = await curio.clock()
+        try:
+            ''' The old message loop is stopped (the connection starts a new one). The ports are kept, when the hub reports its motor
+            and sensors again bricknil checks they are on the same ports and switches the sensor updates back on '''
+            listen_task = getattr(hub, 'listen_task', None)
+            if listen_task is not None:
+                await listen_task.cancel()
+
+            ''' The hub was connected a moment ago, so the first attempt goes straight to connecting it by its ble_id,
+            without the scan that checks it is advertising (the later attempts, if it fails, do check) '''
+            await self.connector.connect(hub, seen=True)
+            attempts = self.connector.attempts[hub.hub_name]
+            await hub.commands.resend()
+            elapsed = await curio.clock() - start_time
+        finally:
+            self.reconnecting.discard(hub.hub_name)
+
+        self.events.append({'hub_name': hub.hub_name, 'seconds': elapsed, 'attempts': attempts})
+        logging.info(f'{hub.hub_name} reconnected in {elapsed:.2f} seconds ({attempts} attempts)')
+        telemetry = getattr(hub, 'telemetry', None)
+        if telemetry is not None:
+            telemetry.record('hub.reconnect_seconds', elapsed)
+
+    ''' This runs in the background (spawned from run_fleet), taking each disconnected ble_id off the queue and reconnecting its train's hub '''
+    async def watch(self, disconnects, trains):
+        while True:
+            ble_id = await disconnects.get()
+            for hub in trains:
+                if hub.ble_id == ble_id:
+                    await self.dropped(hub)
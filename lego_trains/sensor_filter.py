@@ -0,0 +1,116 @@
+''' This module filters the readings from a sensor before the train acts on them.
+
+The colour/distance sensor sometimes reports a wrong value for a single reading (e.g. a flash of yellow while passing
+a yellow brick at the side of the track). Without a filter that one reading is enough to reverse the train.
+A SensorFilter sits between train_sensor_change and the run function and only passes on confirmed changes:
+
+    * window: the last few readings are kept, and the filter uses the value most of them agree on (for colours)
+      or their median (for distances), so a single odd reading is outvoted
+    * thresholds and hysteresis: for distances, the filter works out which zone the reading is in (e.g. close / between / clear),
+      and the reading has to go hysteresis past a threshold to leave the zone it is in, so a reading sitting on
+      a threshold does not flip back and forth between two zones
+    * min_dwell: the new value (or zone) has to stay the same for this many seconds before it is passed on
+
+The hub only sends a new reading when the value changes, so a marker passing under the sensor gives just one reading.
+For the hub's sensors the window is 1 and min_dwell does the filtering: a wrong reading is replaced by the next one
+before min_dwell has passed, so it is never passed on. A larger window is for sensors that send a steady stream of readings.
+
+    self.colour_filter = SensorFilter(min_dwell=0.03)
+    self.distance_filter = SensorFilter(thresholds=(2, 9.5), hysteresis=0.5, min_dwell=0.03)
+
+Only the readings that change the confirmed value are passed on, so the run function wakes up (and sends motor commands) less often. '''
+
+import bisect
+import time
+from collections import Counter, deque
+
+
+''' This is the filter for one sensor value (e.g. the colour) '''
+class SensorFilter:
+    def __init__(self, window=1, thresholds=None, hysteresis=0, min_dwell=0, clock=time.monotonic):
+        ''' thresholds is a list of the values where each zone starts (only used for numbers such as distances),
+        e.g. (2, 9.5) gives three zones: below 2, from 2 up to 9.5, and 9.5 or above.
+        With a hysteresis of 0.5 a distance of 1 or less moves into the first zone, but the distance then has to reach 3 to leave it '''
+        self.window = window
+        self.thresholds = sorted(thresholds) if thresholds is not None else None
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell
+        self.clock = clock
+
+        ''' This is the number of readings that have to agree, more than half of the window '''
+        self.votes_needed = window // 2 + 1
+        self.readings = deque(maxlen=window)
+
+        ''' The confirmed value (and zone), and the new value waiting to be confirmed with the time it was first seen '''
+        self.value = None
+        self.zone = None
+        self.candidate = None
+        self.candidate_value = None
+        self.candidate_since = None
+
+        ''' These count the readings received and the confirmed changes passed on (the rest were filtered out) '''
+        self.samples = 0
+        self.changes = 0
+
+    ''' This works out the zone a distance is in, the reading has to be more than hysteresis past a threshold to change zone '''
+    def zone_of(self, value):
+        zone = bisect.bisect_right(self.thresholds, value)
+        if self.zone is None or zone == self.zone:
+            return zone
+        if zone > self.zone:
+            ''' Moving up, the reading has to be at least hysteresis above the threshold '''
+            zone = bisect.bisect_right(self.thresholds, value - self.hysteresis)
+            return zone if zone > self.zone else self.zone
+        ''' Moving down, the reading has to be more than hysteresis below the threshold '''
+        zone = bisect.bisect_right(self.thresholds, value + self.hysteresis)
+        return zone if zone < self.zone else self.zone
+
+    ''' This returns what the readings in the window agree on (the value and its zone), or None if they do not agree yet '''
+    def agreed(self):
+        if len(self.readings) < self.votes_needed:
+            return None
+        if self.thresholds is None:
+            value, votes = Counter(self.readings).most_common(1)[0]
+            return (value, value) if votes >= self.votes_needed else None
+
+        ''' For numbers the median is used, so a single reading that is too high or too low is ignored '''
+        value = sorted(self.readings)[len(self.readings) // 2]
+        return value, self.zone_of(value)
+
+    ''' This adds a new reading and returns the new confirmed value if it has changed (or None if nothing has changed) '''
+    def update(self, reading, now=None):
+        self.samples += 1
+        self.readings.append(reading)
+        agreed = self.agreed()
+        if agreed is None:
+            return None
+        value, zone = agreed
+
+        if zone == self.zone:
+            ''' Still in the same state, so any change waiting to be confirmed is dropped '''
+            self.candidate = None
+            return None
+
+        ''' A new state has to stay the same for min_dwell seconds before it is confirmed '''
+        now = self.clock() if now is None else now
+        if zone != self.candidate:
+            self.candidate = zone
+            self.candidate_value = value
+            self.candidate_since = now
+        return self.confirm(now)
+
+    ''' This confirms the change waiting to be confirmed, if it has lasted min_dwell seconds (returns None if not).
+    The hub only sends a reading when the value changes, so this is also called once min_dwell has passed without a new reading
+    (see filter_sensor_change in sensor_waits.py) '''
+    def confirm(self, now=None):
+        if self.candidate is None:
+            return None
+        now = self.clock() if now is None else now
+        if now - self.candidate_since < self.min_dwell:
+            return None
+
+        self.value = self.candidate_value
+        self.zone = self.candidate
+        self.candidate = None
+        self.changes += 1
+        return self.value
@@ -0,0 +1,66 @@
+''' This module lets a Train change what its sensors report while it is running, instead of fixing it when the sensor is attached.
+
+With @attach(VisionSensor, capabilities=['sense_color']) the hub sends a notification every time the colour changes,
+for the whole run, even while the run function is not looking at the colour. With several hubs on one Bluetooth adapter
+these notifications (and the train_sensor_change calls they cause) add up. Here a Train lists the sensor modes each
+state of its run function needs:
+
+    sensor_states = {
+        'between_markers': {'train_sensor': ['sense_color']},
+        'approaching_buffer': {'train_sensor': [('sense_distance', 1)]},
+        'stopped': {'train_sensor': []},
+    }
+
+    await self.sensor_modes.enter('approaching_buffer')
+
+Each sensor is given a list of capabilities, each one either a name or a (name, delta threshold) pair (the hub only
+sends a new value once it has changed by at least the threshold). An empty list switches the sensor's notifications off.
+Only the sensors that need to change are sent a message, so entering the state the train is already in costs nothing.
+
+The value of a capability that has been switched off is no longer kept up to date, so train_sensor_change should only
+read the capabilities that are switched on in the current state (e.g. with `if capability in self.train_sensor.value`).
+A reading from the old mode can arrive just after the switch, a SensorFilter with min_dwell (see sensor_filter.py) will
+drop it, as it is replaced by a reading from the new mode straight away. '''
+
+
+''' This is the hub's list of states and the sensor modes each one needs, with the state it is in now '''
+class SensorModes:
+    def __init__(self, hub, states):
+        self.hub = hub
+        self.states = states
+        self.state = None
+
+        ''' The number of times a sensor's mode was changed, and the number of times a state did not need a change '''
+        self.switches = 0
+        self.unchanged = 0
+
+    ''' This changes the sensors' modes to the ones needed by the state '''
+    async def enter(self, state):
+        if state == self.state:
+            return
+        for sensor_name, capabilities in self.states[state].items():
+            if await set_capabilities(self.hub.peripherals[sensor_name], capabilities):
+                self.switches += 1
+            else:
+                self.unchanged += 1
+        self.state = state
+
+
+''' This changes the capabilities a sensor reports (an empty list switches it off), and returns False if they were the same already '''
+async def set_capabilities(sensor, capabilities):
+    new_capabilities, new_thresholds = sensor._get_validated_capabilities(capabilities)
+    if new_capabilities == sensor.capabilities and new_thresholds == sensor.thresholds:
+        return False
+
+    if len(sensor.capabilities) > 1:
+        ''' The sensor is in combined mode (more than one capability), so that is stopped first '''
+        await sensor.send_message(f'Stop multi-update {sensor.port}', [0x00, 0x42, sensor.port, 0x04])
+    elif not new_capabilities and sensor.capabilities:
+        ''' Switching off: the current mode is set up again with notifications disabled (the last byte) '''
+        b = [0x00, 0x41, sensor.port, sensor.capabilities[0].value, sensor.thresholds[0], 0, 0, 0, 0]
+        await sensor.send_message(f'Deactivate SENSOR: port {sensor.port}', b)
+
+    ''' bricknil's activate_updates sends the set up messages for the new capabilities (exactly as it does when the hub first connects) '''
+    sensor.capabilities, sensor.thresholds = new_capabilities, new_thresholds
+    await sensor.activate_updates()
+    return True
@@ -0,0 +1,113 @@
+''' This module lets a Train wait for a sensor value instead of checking it over and over in a loop.
+
+Without it, Train.run has to spin in a While loop (with curio.sleep(0)) until train_sensor_change writes the value it is looking for,
+which keeps the processor busy even when nothing is happening. With it, Train.run can simply do:
+
+    await self.wait_for_colour(Color.yellow)
+    await self.wait_for_distance(lambda distance: distance <= 1)
+
+and the train sleeps until train_sensor_change reports a value that matches. '''
+
+import curio
+
+
+''' This stores the details of one waiting Train.run (which value it is waiting on, what it is waiting for, and the event used to wake it up) '''
+class SensorWaiter:
+    __slots__ = ('attribute', 'predicate', 'event', 'value')
+
+    def __init__(self, attribute, predicate):
+        self.attribute = attribute
+        self.predicate = predicate
+        self.event = curio.Event()
+        self.value = None
+
+
+''' This is added to the Train class (before PoweredUpHub) to give it the wait_for_colour and wait_for_distance functions '''
+class SensorWaitMixin:
+    ''' The sensor wait mixin keeps a list of everything that is currently waiting for a sensor value '''
+    def __init__(self, *args, **kwargs):
+        ''' This passes the parameters on to the next class (the Powered Up Hub class) '''
+        super().__init__(*args, **kwargs)
+
+        ''' This is the list of waiters that will be checked every time the sensor value changes '''
+        self.sensor_waiters = []
+
+        ''' These are the train's reaction rules, if it has any (see reaction_rules.py), they are run with each new value '''
+        self.rules = None
+
+        ''' The task waiting to confirm a filtered change (see filter_sensor_change) for each attribute, there is only ever one '''
+        self.confirm_tasks = {}
+
+    ''' This waits until the value stored in the attribute (e.g. colour or distance) matches '''
+    async def wait_for(self, attribute, match):
+        ''' The match can either be a value (e.g. Color.yellow) or a function that returns True when the value is a match
+        (e.g. lambda distance: distance <= 1). The matching value is returned so the caller knows what was seen '''
+        predicate = match if callable(match) else (lambda value: value == match)
+
+        ''' If the current value already matches there is no need to wait (None means no reading has been received yet) '''
+        value = getattr(self, attribute)
+        if value is not None and predicate(value):
+            return value
+
+        ''' Otherwise adds a waiter to the list and sleeps until notify_sensor_change wakes it up '''
+        waiter = SensorWaiter(attribute, predicate)
+        self.sensor_waiters.append(waiter)
+        try:
+            await waiter.event.wait()
+        finally:
+            ''' Makes sure the waiter is removed from the list even if the train is cancelled while it is waiting '''
+            if waiter in self.sensor_waiters:
+                self.sensor_waiters.remove(waiter)
+        return waiter.value
+
+    ''' This waits until the colour sensor detects a matching colour '''
+    async def wait_for_colour(self, match):
+        return await self.wait_for('colour', match)
+
+    ''' This waits until the distance sensor detects a matching distance '''
+    async def wait_for_distance(self, match):
+        return await self.wait_for('distance', match)
+
+    ''' This is called from train_sensor_change (after the new value has been stored) to wake up any matching waiters '''
+    async def notify_sensor_change(self):
+        ''' Loops through a copy of the waiters list, as matching waiters are removed from the list as we go '''
+        for waiter in list(self.sensor_waiters):
+            value = getattr(self, waiter.attribute)
+            if value is not None and waiter.predicate(value):
+                ''' Stores the value that matched (the sensor may have changed again by the time the waiter wakes up) '''
+                waiter.value = value
+                self.sensor_waiters.remove(waiter)
+                await waiter.event.set()
+
+    ''' This stores a new sensor value in the attribute (e.g. colour), runs the reaction rules for it and wakes up any matching waiters '''
+    async def set_sensor_value(self, attribute, value):
+        setattr(self, attribute, value)
+        if self.rules is not None and attribute == self.rules.table.attribute:
+            await self.rules.react(value)
+        await self.notify_sensor_change()
+
+    ''' This passes a new sensor reading through a filter (see sensor_filter.py), and stores it in the attribute (e.g. colour)
+    and wakes up any matching waiters only once the filter has confirmed the change '''
+    async def filter_sensor_change(self, attribute, sensor_filter, reading):
+        value = sensor_filter.update(reading)
+        if value is not None:
+            await self.set_sensor_value(attribute, value)
+        elif sensor_filter.candidate is not None and sensor_filter.min_dwell and attribute not in self.confirm_tasks:
+            ''' The hub will not send the reading again if it stays the same, so the change is checked again once min_dwell has passed.
+            A task that is already waiting is reused, it picks up a newer change waiting in the filter when it wakes up '''
+            self.confirm_tasks[attribute] = await curio.spawn(self.confirm_sensor_change, attribute, sensor_filter, daemon=True)
+
+    ''' This waits until the change waiting in the filter has lasted min_dwell and then confirms it, for as long as there is a change waiting
+    (a different reading in the meantime replaces the change, and the wait starts again from that reading) '''
+    async def confirm_sensor_change(self, attribute, sensor_filter):
+        try:
+            while sensor_filter.candidate is not None:
+                wait = sensor_filter.min_dwell - (sensor_filter.clock() - sensor_filter.candidate_since)
+                if wait > 0:
+                    await curio.sleep(wait)
+                    continue
+                value = sensor_filter.confirm()
+                if value is not None:
+                    await self.set_sensor_value(attribute, value)
+        finally:
+            del self.confirm_tasks[attribute]
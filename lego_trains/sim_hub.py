@@ -0,0 +1,252 @@
+''' This module is a simulated (pretend) hub backend, so the lessons can be run and benchmarked without a track or any Bluetooth hubs.
+
+A SimHub takes a normal Train (created by a lesson, with its TrainMotor, VisionSensor and LED attached) and:
+    * connects the attached peripherals to fake ports, so the messages they would send over Bluetooth are just counted
+    * replays a recorded VisionSensor trace (colour or distance readings with their original timings) into train_sensor_change
+    * captures every set_speed, ramp_speed and set_color call with a timestamp
+    * optionally (with link_rate) acts like a Bluetooth link that can only deliver link_rate messages a second,
+      so the messages queue up if they are sent faster than that
+    * optionally (with write_delay) makes each message take write_delay seconds to send, like a Bluetooth write that waits
+      for the hub to answer, so the command only returns once the hub has it
+
+A trace is saved as JSON in the following format (t is the number of seconds since the start of the recording):
+
+    {"capability": "sense_color", "samples": [[0.0, 0], [1.25, 7], [2.5, 3]]}
+'''
+
+import bisect
+import json
+import struct
+import time
+
+import curio
+from bricknil.hub import Hub
+
+from .loop_monitor import start_loop_monitor, track_task
+from .command_bus import start_fleet_bus
+
+
+''' This is the clock used for all timestamps (monotonic, so it can never jump backwards) '''
+clock = time.perf_counter
+
+
+''' This loads a recorded trace from a JSON file '''
+def load_trace(file_path):
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+''' This saves a trace to a JSON file '''
+def save_trace(trace, file_path):
+    with open(file_path, 'w') as f:
+        json.dump(trace, f, indent=4)
+
+
+''' This records sensor readings from a real train so they can be replayed later '''
+class TraceRecorder:
+    ''' Call record() from train_sensor_change with the new value, then save() once the run has finished '''
+    def __init__(self, capability):
+        self.capability = capability
+        self.start_time = None
+        self.samples = []
+
+    ''' This stores the value along with the time since the first reading '''
+    def record(self, value):
+        now = clock()
+        if self.start_time is None:
+            self.start_time = now
+        ''' Colours are stored as numbers, so the trace can be saved as JSON '''
+        self.samples.append([round(now - self.start_time, 4), getattr(value, 'value', value)])
+
+    ''' This saves the recorded readings as a trace file '''
+    def save(self, file_path):
+        save_trace({'capability': self.capability, 'samples': self.samples}, file_path)
+
+
+''' This returns the value at the given percentile (e.g. 50 or 99) of a list of numbers '''
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+''' This is the simulated backend for a single Train '''
+class SimHub:
+    ''' Stores the train along with the lists of notifications and commands captured during the run '''
+    def __init__(self, hub, link_rate=None, write_delay=None):
+        self.hub = hub
+        self.notifications = []
+        self.commands = []
+        self.ble_writes = 0
+
+        ''' The number of sensor readings the hub would not have sent (the capability was switched off or had not changed enough) '''
+        self.not_sent = 0
+
+        ''' If a link rate is given, each message is delivered (in order) 1/link_rate seconds after the previous one,
+        and the time it was sent and the time it was delivered are stored in delivered '''
+        self.link_rate = link_rate
+        self.link_queue = None
+        self.delivered = []
+        self.write_delay = write_delay
+
+        ''' The train is removed from bricknil's list of hubs, as bricknil's start function will never connect to it '''
+        if hub in Hub.hubs:
+            Hub.hubs.remove(hub)
+
+    ''' This attaches each peripheral to a fake port, just like bricknil does when the real hub reports its attached devices '''
+    async def connect(self):
+        if self.link_rate:
+            self.link_queue = curio.Queue()
+            await curio.spawn(self.deliver, daemon=True)
+
+        for port, peripheral in enumerate(self.hub.peripherals.values()):
+            peripheral.port = port
+            peripheral.message_handler = self.ble_write
+            self.hub.port_to_peripheral[port] = peripheral
+
+            ''' Wraps the motor and LED functions so each call is captured with a timestamp '''
+            for method_name in ('set_speed', 'ramp_speed', 'set_color'):
+                if hasattr(peripheral, method_name):
+                    self.capture(peripheral, method_name)
+
+            ''' This sets up the sensor value dict in exactly the same way as a real sensor '''
+            await peripheral.activate_updates()
+
+    ''' This stands in for the Bluetooth queue, it just counts the messages that would have been sent to the hub '''
+    async def ble_write(self, msg_name, msg_bytes, peripheral=None):
+        self.ble_writes += 1
+        if self.write_delay:
+            await curio.sleep(self.write_delay)
+        if self.link_queue is not None:
+            await self.link_queue.put((clock(), msg_bytes))
+
+    ''' This is the pretend Bluetooth link, it delivers the queued messages one at a time '''
+    async def deliver(self):
+        while True:
+            sent, msg_bytes = await self.link_queue.get()
+            await curio.sleep(1 / self.link_rate)
+            self.delivered.append((sent, clock(), msg_bytes))
+            await self.link_queue.task_done()
+
+    ''' This waits until every message sent so far has been delivered '''
+    async def wait_delivered(self):
+        if self.link_queue is not None:
+            await self.link_queue.join()
+
+    ''' This replaces a motor or LED function with one that records the call before passing it on '''
+    def capture(self, peripheral, method_name):
+        method = getattr(peripheral, method_name)
+
+        async def captured(value, *args, **kwargs):
+            ''' Steps sent by an in-progress ramp_speed are marked, as they are not a reaction to the sensor '''
+            ramp_task = getattr(peripheral, 'ramp_in_progress_task', None)
+            from_ramp = ramp_task is not None and ramp_task is await curio.current_task()
+            self.commands.append((clock(), peripheral.name, method_name, getattr(value, 'name', value), from_ramp))
+            return await method(value, *args, **kwargs)
+
+        setattr(peripheral, method_name, captured)
+
+    ''' This finds the attached sensor that matches the capability in the trace '''
+    def find_sensor(self, capability):
+        for peripheral in self.hub.peripherals.values():
+            if capability in [cap.name for cap in peripheral.capabilities]:
+                return peripheral
+
+        ''' The capability may be switched off at the moment (see sensor_modes.py), so this looks for a sensor that has it '''
+        for peripheral in self.hub.peripherals.values():
+            if capability in getattr(getattr(peripheral, 'capability', None), '__members__', {}):
+                return peripheral
+        raise ValueError(f'{self.hub.hub_name} has no sensor with the {capability} capability attached')
+
+    ''' This sends one sensor reading to the train, as if the hub had just reported it (returns False if the hub would not have sent it) '''
+    async def feed(self, capability_name, value):
+        sensor = self.find_sensor(capability_name)
+        capability = sensor.capability[capability_name]
+
+        ''' Like a real hub, nothing is sent if the capability is switched off (see sensor_modes.py),
+        or if the value has changed by less than the capability's delta threshold '''
+        if capability not in sensor.capabilities:
+            self.not_sent += 1
+            return False
+        last = sensor.value.get(capability)
+        if isinstance(value, int) and isinstance(last, int) and abs(value - last) < sensor.thresholds[sensor.capabilities.index(capability)]:
+            self.not_sent += 1
+            return False
+
+        n_datasets, byte_count = sensor.datasets[capability][0:2]
+        value_format = {1: 'B', 2: 'H', 4: 'I'}[byte_count] * n_datasets
+
+        ''' The value goes through the sensor's own update_value, exactly like a message from a real hub '''
+        values = value if isinstance(value, list) else [value]
+        await sensor.update_value(struct.pack(f'<{value_format}', *values))
+        self.notifications.append((clock(), value))
+        await getattr(self.hub, f'{sensor.name}_change')()
+        return True
+
+    ''' This replays the trace on its original timing (or faster/slower with the speed parameter) '''
+    async def replay(self, trace, speed=1.0):
+        ''' Each sample is due at an absolute time from the start, so slow handlers do not push the rest of the trace later '''
+        start_time = clock()
+        for t, value in trace['samples']:
+            delay = start_time + t / speed - clock()
+            if delay > 0:
+                await curio.sleep(delay)
+            await self.feed(trace['capability'], value)
+
+    ''' This runs the train's run function while the trace is replayed, and stops once both have finished (or after the timeout) '''
+    async def run(self, trace=None, speed=1.0, timeout=None):
+        await self.connect()
+        run_task = await curio.spawn(self.hub.run)
+        if trace is not None:
+            await self.replay(trace, speed)
+        if timeout is None:
+            await run_task.join()
+        else:
+            ''' The run function may still be waiting for a value that is not in the trace, so it is cancelled after the timeout '''
+            await curio.ignore_after(timeout, run_task.wait)
+            if run_task.terminated:
+                await run_task.join()
+            else:
+                await run_task.cancel()
+
+    ''' This works out the sensor-to-motor reaction latency (in seconds) for each notification that led to a command '''
+    def reaction_latencies(self):
+        command_times = [command[0] for command in self.commands if not command[4]]
+        latencies = []
+        for i, (notified_at, _) in enumerate(self.notifications):
+            ''' Finds the first command sent after this notification, but before the next one arrived '''
+            next_notification = self.notifications[i + 1][0] if i + 1 < len(self.notifications) else float('inf')
+            index = bisect.bisect_left(command_times, notified_at)
+            if index < len(command_times) and command_times[index] < next_notification:
+                latencies.append(command_times[index] - notified_at)
+        return latencies
+
+
+''' This creates a train with the given Train class (e.g. lesson2.Train) and runs it against the trace '''
+async def simulate(train_class, trace=None, name='sim_train', ble_id='00:00:00:00:00:00', speed=1.0, timeout=None, link_rate=None):
+    sim = SimHub(train_class(name, ble_id=ble_id), link_rate)
+    await sim.run(trace, speed=speed, timeout=timeout)
+    return sim
+
+''' This runs a fleet of trains on simulated hubs, in place of fleet.start_fleet (used by the workers of the supervisor, see supervisor.py).
+The trains get no sensor readings, and keep running until the link to the supervisor is closed (or, without a link, until every run function has finished) '''
+async def run_sim_fleet(create_train, hubs_data, link=None):
+    await start_loop_monitor()
+    trains = []
+    run_tasks = []
+    await start_fleet_bus(trains)
+    for hub_info in hubs_data:
+        sim = SimHub(create_train(hub_info))
+        await sim.connect()
+        trains.append(sim.hub)
+        run_tasks.append(await curio.spawn(sim.hub.run))
+        track_task(run_tasks[-1], sim.hub, 'run')
+
+    if link is None:
+        for run_task in run_tasks:
+            await run_task.join()
+    else:
+        await link.run(trains)
+        for run_task in run_tasks:
+            await run_task.cancel()
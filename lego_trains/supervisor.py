@@ -0,0 +1,291 @@
+''' This module runs a lesson across several worker processes, each driving its own share of the hubs, with a supervisor watching over them.
+
+Normally every hub is driven from one curio loop in one process, through one Bluetooth adapter, so the number of hubs
+is limited by that one adapter and one processor core, and one slow coroutine holds up every train. In supervisor mode:
+    * the hubs in the mapping file are shared out between the workers (hub 1 to worker 1, hub 2 to worker 2 and so on)
+    * each worker is a normal lesson process (python3 -m lego_trains run lessonN) with its own curio loop, and can be given
+      its own Bluetooth adapter (e.g. hci0 and hci1), it connects its hubs directly by ble_id without scanning
+    * the supervisor and each worker talk over a Unix socket pair, one JSON message per line: the workers send their
+      status every STATUS_INTERVAL seconds, and the supervisor sends fleet-wide commands (see command_bus.py) that every worker
+      fans out to its own trains, acknowledging it with the receipt of each hub (whether it was queued for the hub, see command_bus.py)
+    * if a worker crashes it is started again on its own (after 1, 2, 4... seconds, up to RESTART_MAX), the other workers keep running
+
+    python3 -m lego_trains supervise lesson2 --workers 2 --adapters hci0,hci1
+
+With --sim the workers run their trains on simulated hubs (see sim_hub.py), so supervisor mode can be tried on one
+machine without any hubs. While it is running the supervisor reads commands typed into its terminal: status, quit,
+and the fleet commands (stop, brake, resume, speed N, scale F and led COLOUR). '''
+
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import curio
+from curio.io import Socket
+
+from .command_bus import FleetBus, BUS_COMMANDS, fleet_bus, parse_command, CONSOLE_HELP
+
+''' These are the default settings, how often the workers send their status and how long a command waits for the acknowledgements '''
+STATUS_INTERVAL = 1
+COMMAND_TIMEOUT = 5
+
+''' A crashed worker is restarted after RESTART_DELAY seconds, doubling each time it crashes again soon after starting (up to RESTART_MAX) '''
+RESTART_DELAY = 1
+RESTART_MAX = 30
+HEALTHY_SECONDS = 60
+
+''' These environment variables are set by the supervisor for each worker '''
+LINK_FD_VARIABLE = 'TRAIN_SUPERVISOR_FD'
+SHARD_VARIABLE = 'TRAIN_SHARD'
+WORKER_VARIABLE = 'TRAIN_WORKER'
+SIM_VARIABLE = 'TRAIN_SIM'
+ADAPTER_VARIABLE = 'TRAIN_BLE_ADAPTER'
+
+
+''' This shares the hubs out between the workers, and returns a list of hubs for each worker (workers with no hubs are left out) '''
+def shard_hubs(hubs_data, workers):
+    return [hubs_data[i::workers] for i in range(workers) if hubs_data[i::workers]]
+
+
+''' This is one worker process as seen by the supervisor '''
+class WorkerProcess:
+    def __init__(self, index, lesson, hubs_data, adapter=None, sim=False):
+        self.index = index
+        self.lesson = lesson
+        self.hubs_data = hubs_data
+        self.adapter = adapter
+        self.sim = sim
+        self.process = None
+        self.stream = None
+        self.started_at = None
+
+        ''' The last status the worker sent, the number of times it has been restarted, and the acknowledgements still expected '''
+        self.status = {}
+        self.restarts = 0
+        self.acks = {}
+
+    ''' This starts the worker process, with its end of the socket pair and its hubs passed in environment variables '''
+    async def start(self):
+        supervisor_end, worker_end = socket.socketpair()
+        environment = dict(os.environ)
+        environment[LINK_FD_VARIABLE] = str(worker_end.fileno())
+        environment[SHARD_VARIABLE] = json.dumps(self.hubs_data)
+        environment[WORKER_VARIABLE] = str(self.index)
+        if self.sim:
+            environment[SIM_VARIABLE] = '1'
+        if self.adapter:
+            environment[ADAPTER_VARIABLE] = self.adapter
+
+        self.process = subprocess.Popen([sys.executable, '-m', 'lego_trains', 'run', self.lesson],
+                                        env=environment, pass_fds=[worker_end.fileno()])
+        worker_end.close()
+        self.stream = Socket(supervisor_end).as_stream()
+        self.started_at = time.monotonic()
+        self.status = {}
+        logging.info(f'Worker {self.index} started (pid {self.process.pid}) with {len(self.hubs_data)} hubs')
+
+    ''' This sends a message to the worker (nothing is sent if it is not running) '''
+    async def send(self, message):
+        if self.stream is None:
+            return False
+        try:
+            await self.stream.write((json.dumps(message) + '\n').encode())
+        except OSError:
+            return False
+        return True
+
+    ''' This reads the worker's messages until it closes its end of the socket (when it exits) '''
+    async def read_messages(self):
+        try:
+            async for line in self.stream:
+                message = json.loads(line)
+                if 'ack' in message:
+                    ack = self.acks.pop(message['ack'], None)
+                    if ack is not None:
+                        await ack.set_value(message)
+                else:
+                    self.status = message
+        finally:
+            await self.stream.close()
+            self.stream = None
+
+    ''' This waits for the process to exit and returns its exit code '''
+    async def wait(self):
+        return await curio.run_in_thread(self.process.wait)
+
+
+''' This is the supervisor, it starts the workers, restarts any that crash, and sends them the fleet-wide commands '''
+class Supervisor:
+    def __init__(self, lesson, hubs_data, workers=2, adapters=None, sim=False):
+        adapters = adapters or [None]
+        self.workers = [WorkerProcess(index, lesson, shard, adapters[index % len(adapters)], sim)
+                        for index, shard in enumerate(shard_hubs(hubs_data, workers))]
+        self.stopping = False
+        self.command_ids = 0
+        self.tasks = []
+
+    ''' This starts every worker, and keeps it running until stop is called '''
+    async def start(self):
+        for worker in self.workers:
+            self.tasks.append(await curio.spawn(self.keep_running, worker))
+
+    ''' This runs one worker, starting it again if it exits before the supervisor is stopped '''
+    async def keep_running(self, worker):
+        delay = RESTART_DELAY
+        while not self.stopping:
+            await worker.start()
+            reader = await curio.spawn(worker.read_messages)
+            exit_code = await worker.wait()
+            await reader.cancel()
+            if self.stopping:
+                break
+
+            ''' The delay is reset if the worker had been running for a while, so only a worker that keeps crashing waits longer '''
+            if time.monotonic() - worker.started_at > HEALTHY_SECONDS:
+                delay = RESTART_DELAY
+            logging.warning(f'Worker {worker.index} exited with code {exit_code}, restarting in {delay} seconds')
+            await curio.sleep(delay)
+            delay = min(delay * 2, RESTART_MAX)
+            worker.restarts += 1
+
+    ''' This sends a command to every worker at the same time, and returns the acknowledgements (None for a worker that did not answer in time) '''
+    async def broadcast(self, command, timeout=COMMAND_TIMEOUT, **args):
+        self.command_ids += 1
+        message = dict(args, command=command, id=self.command_ids)
+
+        async def send_to(worker):
+            ack = worker.acks[message['id']] = curio.Result()
+            if not await worker.send(message):
+                worker.acks.pop(message['id'], None)
+                return None
+            try:
+                return await curio.timeout_after(timeout, ack.unwrap)
+            except curio.TaskTimeout:
+                worker.acks.pop(message['id'], None)
+                return None
+
+        async with curio.TaskGroup() as group:
+            tasks = [await group.spawn(send_to, worker) for worker in self.workers]
+        return [task.result for task in tasks]
+
+    ''' This returns the last status of every worker, with the number of restarts and its process id '''
+    def status(self):
+        return [dict(worker.status, worker=worker.index, pid=worker.process.pid if worker.process else None, restarts=worker.restarts)
+                for worker in self.workers]
+
+    ''' This stops every worker (they stop their trains first) and waits for them to exit '''
+    async def stop(self):
+        self.stopping = True
+        await self.broadcast('quit')
+        for task in self.tasks:
+            await task.join()
+
+
+''' This reads the commands typed into the supervisor's terminal and runs them '''
+async def console(supervisor):
+    lines = curio.UniversalQueue()
+
+    ''' The terminal is read in a thread (reading it would block the curio loop), quit is sent if the terminal is closed '''
+    def read_terminal():
+        for line in sys.stdin:
+            lines.put(line)
+        lines.put('quit')
+
+    threading.Thread(target=read_terminal, daemon=True).start()
+    while True:
+        words = (await lines.get()).split()
+        if not words:
+            continue
+        parsed = parse_command(words)
+        if words[0] == 'status':
+            for worker_status in supervisor.status():
+                print(json.dumps(worker_status))
+        elif parsed is not None:
+            ''' Each worker's acknowledgement holds the receipt of each of its hubs '''
+            start = time.monotonic()
+            acks = await supervisor.broadcast(parsed[0], **parsed[1])
+            receipts = [receipt for ack in acks if ack is not None for receipt in ack.get('hubs', [])]
+            print(f'{parsed[0]}: acknowledged by {sum(ack is not None for ack in acks)} of {len(acks)} workers and queued for '
+                  f'{sum(receipt["queued"] for receipt in receipts)} of {len(receipts)} hubs in {(time.monotonic() - start) * 1000:.1f}ms')
+        elif words[0] == 'quit':
+            await supervisor.stop()
+            return
+        else:
+            print(f'Commands: status, quit, {CONSOLE_HELP}')
+
+''' This runs the supervisor until quit is typed '''
+async def supervise(lesson, hubs_data, workers=2, adapters=None, sim=False):
+    supervisor = Supervisor(lesson, hubs_data, workers, adapters, sim)
+    await supervisor.start()
+    await console(supervisor)
+
+
+''' This is the worker's end of the link to the supervisor '''
+class SupervisorLink:
+    def __init__(self, fd, index=0):
+        self.stream = Socket(socket.socket(fileno=fd)).as_stream()
+        self.index = index
+        self.trains = []
+        self.commands = 0
+
+    ''' This sends a message to the supervisor '''
+    async def send(self, message):
+        await self.stream.write((json.dumps(message) + '\n').encode())
+
+    ''' This returns the status of the worker and each of its trains '''
+    def status(self):
+        return {'trains': {train.hub_name: {'speed': getattr(getattr(train, 'motor', None), 'speed', None)} for train in self.trains},
+                'commands': self.commands}
+
+    ''' This runs for as long as the worker is running: it sends the status regularly and carries out the supervisor's commands '''
+    async def run(self, trains):
+        self.trains = trains
+        heartbeat = await curio.spawn(self.send_status, daemon=True)
+        try:
+            async for line in self.stream:
+                message = json.loads(line)
+                self.commands += 1
+                receipts = await self.run_command(message)
+                await self.send({'ack': message['id'], 'worker': self.index, 'trains': len(self.trains), 'hubs': receipts or []})
+                if message['command'] == 'quit':
+                    break
+        finally:
+            await heartbeat.cancel()
+
+    ''' This carries out one command on every train of this worker (through the worker's command bus, see command_bus.py),
+    and returns the receipt of each hub '''
+    async def run_command(self, message):
+        bus = fleet_bus() or FleetBus(self.trains)
+        args = {key: value for key, value in message.items() if key not in ('command', 'id')}
+        if message['command'] == 'quit':
+            ''' The trains are stopped before the worker exits '''
+            return await bus.stop()
+        if message['command'] not in BUS_COMMANDS:
+            logging.warning(f"Worker {self.index} was sent an unknown command: {message['command']}")
+            return []
+        return await bus.broadcast(message['command'], **args)
+
+    async def send_status(self):
+        while True:
+            await self.send(self.status())
+            await curio.sleep(STATUS_INTERVAL)
+
+
+''' This returns the link to the supervisor if this process is a worker (started by the supervisor), otherwise None '''
+def worker_link():
+    if LINK_FD_VARIABLE not in os.environ:
+        return None
+    return SupervisorLink(int(os.environ[LINK_FD_VARIABLE]), int(os.environ.get(WORKER_VARIABLE, 0)))
+
+''' This returns the hubs the supervisor gave this worker '''
+def worker_hubs():
+    return json.loads(os.environ[SHARD_VARIABLE])
+
+''' This returns True if the supervisor asked this worker to use simulated hubs '''
+def worker_simulated():
+    return os.environ.get(SIM_VARIABLE, '') not in ('', '0')
@@ -0,0 +1,289 @@
+''' This module records what the sensors and motors did during a run, so it can be looked at afterwards (the INFO log only shows some of it).
+
+It is switched off by default. Set the TRAIN_TELEMETRY environment variable to the file to record to, e.g.
+
+    TRAIN_TELEMETRY=session.tel python3 lesson3.py
+
+Every sensor reading (each call of train_sensor_change) and every command sent to a motor or LED is stored as one record:
+the time (seconds since the start of the session), the hub, what kind of value it is (e.g. train_sensor.sense_color or motor.set_speed)
+and the value. Each record is the same size (24 bytes), so:
+    * each hub keeps its records in a buffer that is set up once, recording packs the record into the next free slot
+      (no memory is allocated for each record), and when the buffer is full it is copied to the file in one go
+    * the file is set up at its full size when the session starts (TRAIN_TELEMETRY_RECORDS records, default 1,000,000 or 24MB)
+      and is memory-mapped. It is a ring as well, once it is full the oldest records are overwritten,
+      so a session lasting hours uses the same memory and disk space as a short one
+    * the buffers are copied to the file every TRAIN_TELEMETRY_INTERVAL seconds (default 1), so the file is never far behind
+
+The session can then be loaded into NumPy arrays for analysis (NumPy is only needed for this, not while recording):
+
+    session = load_session('session.tel')
+    speeds = session['value'][session['kind'] == session['kinds'].index('motor.set_speed')] '''
+
+import atexit
+import json
+import mmap
+import os
+import struct
+import time
+
+import curio
+
+
+''' This is the clock used for all timestamps (monotonic, so it can never jump backwards) '''
+clock = time.monotonic
+
+''' Each record is the time (8 bytes), the hub index (2 bytes), the kind index (1 byte), 5 bytes of padding and the value (8 bytes) '''
+RECORD = struct.Struct('<dHB5xd')
+
+''' The start of the file holds the header: an id, the version, the record size, the number of records the file can hold
+and the number written so far, followed by the hub names and kinds as JSON (padded to HEADER_SIZE) '''
+MAGIC = b'TRAINTEL'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQ')
+HEADER_SIZE = 65536
+
+''' These are the default sizes, the number of records in the file and in each hub's buffer '''
+FILE_RECORDS = int(os.environ.get('TRAIN_TELEMETRY_RECORDS', 1_000_000))
+BUFFER_RECORDS = 256
+FLUSH_INTERVAL = float(os.environ.get('TRAIN_TELEMETRY_INTERVAL', 1))
+
+''' The session being recorded (only one is opened, however many hubs are recorded) '''
+_session = None
+
+
+''' This returns True if the TRAIN_TELEMETRY environment variable has been set '''
+def telemetry_enabled():
+    return os.environ.get('TRAIN_TELEMETRY', '') not in ('', '0')
+
+
+''' This is the memory-mapped file that the records of every hub are copied to '''
+class TelemetryFile:
+    def __init__(self, file_path, capacity=FILE_RECORDS):
+        self.file_path = file_path
+        self.capacity = capacity
+        self.count = 0
+        self.start_time = clock()
+        self.hubs = []
+        self.kinds = []
+        self.info = {'started': time.time(), 'hubs': self.hubs, 'kinds': self.kinds}
+
+        ''' The recorder of each hub (see HubTelemetry), so their buffers can all be copied to the file '''
+        self.recorders = []
+
+        ''' The file is set up at its full size straight away, so it never has to grow while the trains are running '''
+        self.file = open(file_path, 'w+b')
+        self.file.truncate(HEADER_SIZE + capacity * RECORD.size)
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        self.write_header()
+        self.write_info()
+
+    ''' This writes the numbers at the start of the header (the number of records written is updated after every copy) '''
+    def write_header(self):
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, RECORD.size, self.capacity, self.count)
+
+    ''' This writes the hub names and kinds (only needed when a hub or kind is added) '''
+    def write_info(self):
+        info = json.dumps(self.info).encode()
+        if HEADER.size + len(info) > HEADER_SIZE:
+            raise ValueError('Too many hubs and kinds to fit in the telemetry file header')
+        self.mm[HEADER.size:HEADER.size + len(info)] = info
+        self.mm[HEADER.size + len(info):HEADER_SIZE] = bytes(HEADER_SIZE - HEADER.size - len(info))
+
+    ''' This returns the index of a hub, adding it to the header the first time it is seen '''
+    def hub_index(self, hub_name):
+        if hub_name not in self.hubs:
+            self.hubs.append(hub_name)
+            self.write_info()
+        return self.hubs.index(hub_name)
+
+    ''' This returns the index of a kind of value (e.g. motor.set_speed), adding it to the header the first time it is seen '''
+    def kind_index(self, kind):
+        if kind not in self.kinds:
+            if len(self.kinds) == 256:
+                raise ValueError('The telemetry file can only store 256 kinds of value')
+            self.kinds.append(kind)
+            self.write_info()
+        return self.kinds.index(kind)
+
+    ''' This copies packed records into the file, going back to the start of the file once the end is reached '''
+    def write(self, data):
+        records = len(data) // RECORD.size
+        while records:
+            position = self.count % self.capacity
+            n = min(records, self.capacity - position)
+            offset = HEADER_SIZE + position * RECORD.size
+            self.mm[offset:offset + n * RECORD.size] = data[:n * RECORD.size]
+            data = data[n * RECORD.size:]
+            records -= n
+            self.count += n
+        self.write_header()
+
+    ''' This copies every hub's buffer to the file '''
+    def flush(self):
+        for recorder in self.recorders:
+            recorder.flush()
+
+    ''' This writes everything to disk and closes the file '''
+    def close(self):
+        if self.mm.closed:
+            return
+        self.flush()
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+
+''' This is the recorder for one hub, with the buffer its records are packed into '''
+class HubTelemetry:
+    __slots__ = ('session', 'hub_index', 'buffer', 'view', 'used', 'kinds')
+
+    def __init__(self, session, hub_name, buffer_records=BUFFER_RECORDS):
+        self.session = session
+        self.hub_index = session.hub_index(hub_name)
+        self.buffer = bytearray(buffer_records * RECORD.size)
+        self.view = memoryview(self.buffer)
+        self.used = 0
+        session.recorders.append(self)
+
+        ''' The kind indexes this hub has looked up, so the header only has to be checked the first time '''
+        self.kinds = {}
+
+    ''' This stores one value (a number, or anything with a number value such as a Color), a value of None
+    (e.g. a capability the sensor has not reported yet) is not stored '''
+    def record(self, kind, value):
+        if value is None:
+            return
+        kind_index = self.kinds.get(kind)
+        if kind_index is None:
+            kind_index = self.kinds[kind] = self.session.kind_index(kind)
+        RECORD.pack_into(self.buffer, self.used * RECORD.size, clock() - self.session.start_time,
+                         self.hub_index, kind_index, getattr(value, 'value', value))
+        self.used += 1
+        if self.used * RECORD.size == len(self.buffer):
+            self.flush()
+
+    ''' This copies the records in the buffer to the file, and starts the buffer again from the beginning '''
+    def flush(self):
+        if self.used and not self.session.mm.closed:
+            self.session.write(self.view[:self.used * RECORD.size])
+        self.used = 0
+
+
+''' This returns the session being recorded, opening the file given by TRAIN_TELEMETRY the first time it is called '''
+def telemetry_session(file_path=None):
+    global _session
+    if _session is None:
+        _session = TelemetryFile(file_path or os.environ['TRAIN_TELEMETRY'])
+
+        ''' Makes sure the records still in the buffers are written before the script exits '''
+        atexit.register(close_session)
+    return _session
+
+''' This writes the last records and closes the file '''
+def close_session():
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+''' This adds the recording wrappers to a Train (the train's own functions and the attached motor/LED are left unchanged) '''
+def record_hub(hub, session=None):
+    session = session or telemetry_session()
+    recorder = HubTelemetry(session, hub.hub_name)
+    hub.telemetry = recorder
+
+    ''' bricknil looks up train_sensor_change on the hub every time, so setting it on the instance wraps it.
+    Each value the sensor reports is recorded before the train's own train_sensor_change is run '''
+    if hasattr(hub, 'train_sensor_change'):
+        sensor_change = hub.train_sensor_change
+        sensor = hub.peripherals.get('train_sensor')
+
+        ''' The name of each capability (and of each item, for capabilities that report a list) is made once here,
+        rather than for every reading. A capability that is not known yet is named the first time it is seen '''
+        names = {}
+        item_names = {}
+
+        def name_capability(capability):
+            names[capability] = f'{sensor.name}.{capability.name}'
+            n_datasets = getattr(sensor, 'datasets', {}).get(capability, (1,))[0]
+            item_names[capability] = [f'{names[capability]}.{i}' for i in range(n_datasets)]
+
+        async def recorded_sensor_change():
+            for capability, value in sensor.value.items():
+                if capability not in names:
+                    name_capability(capability)
+                if isinstance(value, list):
+                    kinds = item_names[capability]
+                    if len(value) > len(kinds):
+                        kinds.extend(f'{names[capability]}.{i}' for i in range(len(kinds), len(value)))
+                    for kind, item in zip(kinds, value):
+                        recorder.record(kind, item)
+                else:
+                    recorder.record(names[capability], value)
+            return await sensor_change()
+
+        if sensor is not None:
+            for capability in getattr(sensor, 'capability', ()):
+                name_capability(capability)
+            hub.train_sensor_change = recorded_sensor_change
+
+    ''' Wraps every motor and LED command function, so the commands actually sent to the hub are recorded '''
+    for peripheral in hub.peripherals.values():
+        for method_name in ('set_speed', 'ramp_speed', 'set_color'):
+            if hasattr(peripheral, method_name):
+                _record_command(peripheral, method_name, recorder)
+    return recorder
+
+''' This replaces a command function with one that records the value (the speed or colour) it was sent '''
+def _record_command(peripheral, method_name, recorder):
+    method = getattr(peripheral, method_name)
+    kind = f'{peripheral.name}.{method_name}'
+
+    async def recorded_command(value, *args, **kwargs):
+        recorder.record(kind, value)
+        return await method(value, *args, **kwargs)
+
+    setattr(peripheral, method_name, recorded_command)
+
+
+''' This runs in the background (spawned from run_fleet) and copies the buffers to the file at a regular interval '''
+async def flush_telemetry_periodically(interval=FLUSH_INTERVAL):
+    session = telemetry_session()
+    try:
+        while True:
+            await curio.sleep(interval)
+            session.flush()
+    finally:
+        ''' Copies one final time when the task is cancelled, so the end of the run is not lost '''
+        session.flush()
+
+
+''' This loads a recorded session into NumPy arrays, returned in a dict with:
+    * t, hub, kind and value: one array each, with one item per record (oldest first)
+    * hubs and kinds: the lists of names that the hub and kind indexes refer to
+    * started: the time (from time.time) the session started '''
+def load_session(file_path):
+    ''' NumPy is only needed to analyse a session, so it is only imported here (pip install numpy) '''
+    import numpy
+
+    with open(file_path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    magic, version, record_size, capacity, count = HEADER.unpack_from(header)
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError(f'{file_path} is not a telemetry file (or was written by a different version)')
+    info = json.loads(header[HEADER.size:].rstrip(b'\0'))
+
+    ''' The records are read straight from the file (memory-mapped), and the ring is put back in order, starting from the oldest record '''
+    dtype = numpy.dtype({'names': ['t', 'hub', 'kind', 'value'], 'formats': ['<f8', '<u2', 'u1', '<f8'],
+                         'offsets': [0, 8, 10, 16], 'itemsize': RECORD.size})
+    records = numpy.memmap(file_path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(capacity,))
+    if count <= capacity:
+        records = records[:count]
+    else:
+        records = numpy.roll(records, -(count % capacity))
+
+    ''' Each hub copies its buffer to the file separately, so the records are sorted by time (stable, so records with the same time keep their order) '''
+    records = records[numpy.argsort(records['t'], kind='stable')]
+    return {'t': numpy.array(records['t']), 'hub': numpy.array(records['hub']), 'kind': numpy.array(records['kind']),
+            'value': numpy.array(records['value']), 'hubs': info['hubs'], 'kinds': info['kinds'], 'started': info['started']}
@@ -0,0 +1,114 @@
+''' This module holds the parts of a lesson that are the same in every lesson: the Train base class,
+the function that creates a train for each hub in the mapping file, and the start up steps (scan, name the hubs, connect).
+
+A lesson only needs to attach its motors and sensors to a Train class and write its run function:
+
+    @attach(TrainMotor, name='motor')
+    class Train(TrainHub):
+        async def run(self):
+            ...
+
+    if __name__ == '__main__':
+        run_lesson(Train) '''
+
+import logging
+import sys
+from functools import partial
+
+import curio
+from bricknil.hub import PoweredUpHub
+
+from .sensor_waits import SensorWaitMixin
+from .sensor_modes import SensorModes
+from .reaction_rules import RuleRunner
+from .motor_commands import HubCommands, CommandedPeripheral, COMMAND_METHODS
+from .train_logging import HubLog
+from .hub_metrics import metrics_enabled, instrument_hub
+from .telemetry import telemetry_enabled, record_hub
+from .hubs import get_hubs, run_ble_scan
+from .fleet import start_fleet
+from .supervisor import worker_link, worker_hubs, worker_simulated
+from .loop_monitor import loop_activations
+
+
+''' This is the base class for the trains in the lessons, which are all Powered Up hubs (with wait_for_colour etc. from sensor_waits.py) '''
+class TrainHub(SensorWaitMixin, PoweredUpHub):
+    ''' The sensor modes each state of the run function needs, a lesson can set this to switch modes while it runs (see sensor_modes.py) '''
+    sensor_states = {}
+
+    ''' The table of reaction rules for the sensor, a lesson can set this instead of checking the values in its run function (see reaction_rules.py) '''
+    reaction_rules = None
+
+    ''' The train class stores all variables related to the train and motors (such as speed) '''
+    def __init__(self, name, ble_id, settings=None):
+        ''' This is where the parameters are passed to the Powered Up Hub class instance (these are mandatory, required by design) '''
+        super().__init__(name=name, ble_id=ble_id)
+
+        ''' This is where the parameters are stored in the Train class instance (although these are the same values as those passed to the Powered Up Hub class,
+        these are stored here to be used later for logging purposes) '''
+        self.hub_name = name
+        self.ble_id = ble_id
+
+        ''' These are the settings for this hub from the mapping file (e.g. its speed, see provisioning.py), a lesson uses its own value for any that are not set '''
+        self.settings = settings or {}
+
+        ''' This is the command layer that every motor and LED command goes through (see motor_commands.py) '''
+        self.commands = HubCommands(self)
+
+        ''' This is the logger for messages sent often (e.g. sensor values), it limits how many are logged a second (see train_logging.py) '''
+        self.log = HubLog(name)
+
+        ''' This switches the sensors between the modes listed in sensor_states (see sensor_modes.py) '''
+        self.sensor_modes = SensorModes(self, self.sensor_states)
+
+        ''' Each train runs the reaction rules with its own state (the table itself is shared by every train of the class) '''
+        if self.reaction_rules is not None:
+            self.rules = RuleRunner(self, self.reaction_rules)
+
+    ''' This is called by bricknil's attach for each motor and sensor, motors and LEDs are put behind the command layer '''
+    def attach_sensor(self, sensor):
+        super().attach_sensor(sensor)
+
+        ''' hub.peripherals still holds the motor or LED itself (which is what bricknil uses), self.motor etc. is the CommandedPeripheral '''
+        if any(hasattr(sensor, method_name) for method_name in COMMAND_METHODS):
+            setattr(self, sensor.name, CommandedPeripheral(sensor, self.commands))
+
+
+''' This creates a new instance of the lesson's Train class for a hub in the mapping file (called by start_fleet in fleet.py) '''
+def create_train(train_class, hub_info):
+    ''' Creates new instance of Train class for the hub '''
+    logging.info(f"Initiating hub name: {hub_info['hub_name']}, ble id: {hub_info['ble_id']}")
+    train = train_class(hub_info['hub_name'], ble_id=hub_info['ble_id'], settings=hub_info.get('settings'))
+
+    ''' If the TRAIN_METRICS environment variable is set, this adds the latency measurements to the train (see hub_metrics.py) '''
+    if metrics_enabled():
+        instrument_hub(train)
+
+    ''' If the TRAIN_TELEMETRY environment variable is set, every sensor reading and command is recorded to that file (see telemetry.py) '''
+    if telemetry_enabled():
+        record_hub(train)
+    return train
+
+''' This runs a lesson: scans for active hubs, checks the mapping file and then connects and starts each train '''
+def run_lesson(train_class, stream=None):
+    ''' If the lesson was started by the supervisor (see supervisor.py), it only runs the hubs it was given, without scanning '''
+    link = worker_link()
+    if link is not None:
+        if worker_simulated():
+            from .sim_hub import run_sim_fleet
+            curio.run(run_sim_fleet, partial(create_train, train_class), worker_hubs(), link, activations=loop_activations())
+        else:
+            start_fleet(partial(create_train, train_class), worker_hubs(), link=link)
+        return
+
+    ''' In streaming mode (python3 lessonN.py --stream) each hub is connected as soon as it is seen, rather than after the full scan (see fleet.py) '''
+    if stream is None:
+        stream = '--stream' in sys.argv
+
+    if not stream:
+        ''' This runs the initial scan of available Bluetooth hubs '''
+        run_ble_scan()
+
+    ''' This checks the mapping file (which contains details of the Bluetooth hubs), then connects and starts each train
+    (python3 lessonN.py --manifest hubs.csv sets up the hubs in the manifest first, without prompting for names, see provisioning.py) '''
+    start_fleet(partial(create_train, train_class), get_hubs(), stream=stream)
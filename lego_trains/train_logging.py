@@ -0,0 +1,120 @@
+''' This module sets up logging so that writing a log message never holds up the trains.
+
+With logging.basicConfig every logging.info call formats the message and writes it to the screen before returning,
+on the same thread as the curio loop that handles the sensors and motors. With a lot of messages (e.g. every sensor
+reading of every train), the writing becomes the slowest part of the loop and the trains react late. Here:
+    * setup_logging puts each log message on a queue, and a background thread formats and writes it
+    * HubLog limits how many messages a second each hub can log for the same thing (any extra messages are counted
+      and the count is added to the next message that is logged), and can log a sensor value only when it changes
+
+    setup_logging(logging.INFO)
+    self.log = HubLog(self.hub_name)
+    self.log.changed('colour', colour)
+
+The limits can be changed with the TRAIN_LOG_RATE (default 5 messages a second) and TRAIN_LOG_BURST (default 10)
+environment variables. '''
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+''' These are the default limits for each hub, for each type of message '''
+LOG_RATE = float(os.environ.get('TRAIN_LOG_RATE', 5))
+LOG_BURST = float(os.environ.get('TRAIN_LOG_BURST', 10))
+
+''' The background thread that writes the log messages (only one is started, however many times setup_logging is called) '''
+_listener = None
+
+
+''' This is the handler used on the curio loop's thread, it only puts the message on the queue '''
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    ''' The standard QueueHandler formats the message before putting it on the queue, this leaves that to the background thread '''
+    def prepare(self, record):
+        return record
+
+
+''' This replaces logging.basicConfig, sending everything that is logged through the queue to the background thread '''
+def setup_logging(level=logging.INFO, stream=None, fmt=logging.BASIC_FORMAT):
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return
+
+    ''' This is the handler that does the formatting and writing (to stderr unless another stream is given), in the background thread '''
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(fmt))
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+
+    ''' Any handlers that were already set up (e.g. by logging.basicConfig) are replaced by the queue '''
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+
+    ''' Makes sure the messages still on the queue are written before the script exits '''
+    atexit.register(stop_logging)
+
+''' This writes any messages still on the queue and stops the background thread '''
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+''' This is the logger for one hub, used for messages in the run loop and train_sensor_change '''
+class HubLog:
+    def __init__(self, hub_name, rate=LOG_RATE, burst=LOG_BURST, logger=None, clock=time.monotonic):
+        self.hub_name = hub_name
+        self.rate = rate
+        self.burst = burst
+        self.logger = logger or logging.getLogger()
+        self.clock = clock
+
+        ''' For each type of message: the tokens left, when they were last topped up, and how many messages were dropped since the last one was logged '''
+        self.buckets = {}
+
+        ''' The last value logged by changed, for each sensor value '''
+        self.last_values = {}
+        self.dropped = 0
+
+    ''' This logs a message, unless the hub has already logged too many of the same type (key) this second '''
+    def log(self, level, msg, *args, key=None):
+        ''' Nothing is done at all if the level is turned off (e.g. INFO messages when the level is WARNING) '''
+        if not self.logger.isEnabledFor(level):
+            return
+
+        ''' Each type of message has its own limit, by default the type is the message itself (before the args are added) '''
+        key = msg if key is None else key
+        now = self.clock()
+        tokens, updated, dropped = self.buckets.get(key, (self.burst, now, 0))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now, dropped + 1)
+            self.dropped += 1
+            return
+        self.buckets[key] = (tokens - 1, now, 0)
+
+        ''' The message is passed on with its args (rather than as an f-string), so it is only formatted in the background thread '''
+        if dropped:
+            msg += ' (%d similar messages not logged)'
+            args += (dropped,)
+        self.logger.log(level, '%s: ' + msg, self.hub_name, *args)
+
+    def info(self, msg, *args, key=None):
+        self.log(logging.INFO, msg, *args, key=key)
+
+    def debug(self, msg, *args, key=None):
+        self.log(logging.DEBUG, msg, *args, key=key)
+
+    ''' This logs a sensor value (e.g. the colour) only if it is different from the last value logged '''
+    def changed(self, name, value, level=logging.INFO):
+        if name in self.last_values and self.last_values[name] == value:
+            return
+        self.last_values[name] = value
+        self.log(level, '%s %s', name, value, key=name)
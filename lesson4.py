@@ -0,0 +1,95 @@
+from bricknil import attach
+from bricknil.sensor import TrainMotor, VisionSensor
+from bricknil.const import Color
+import logging
+from lego_trains.train import TrainHub, run_lesson
+from lego_trains.train_logging import setup_logging
+from lego_trains.sensor_filter import SensorFilter
+from lego_trains.block_signals import BlockSignals
+
+''' Lesson 4- This script connects to any active hubs and runs them all around the same loop of track, using block signals
+(see lego_trains/block_signals.py) to keep the trains apart. The track is split into blocks, with a coloured marker at the start of each block,
+and a train is only allowed into a block once the train in front has left it. Put each train in a different block before starting. '''
+
+''' This sets the logging level (can be changed from INFO to DEBUG or CRITICAL etc. if preferred) '''
+''' The messages are written by a background thread (see lego_trains/train_logging.py), so logging does not slow the trains down '''
+setup_logging(logging.INFO)
+
+''' These are the colours of the markers at the start of each block, in the order the trains pass them (each colour can only be used once) '''
+MARKER_COLOURS = [Color.red, Color.yellow, Color.green, Color.blue, Color.purple, Color.white]
+
+''' This is the signalling for the layout, shared by every train '''
+SIGNALS = BlockSignals(MARKER_COLOURS)
+
+''' This creates a new instance of a hub (train in this case) with the following attached to it:
+1 x train motor
+1 x colour/distance sensor (we only enable the colour sensor in this lesson)
+'''
+@attach(TrainMotor, name='motor')
+@attach(VisionSensor, name='train_sensor', capabilities=['sense_color'])
+class Train(TrainHub):
+    ''' The train class stores all variables related to the train and motors (such as speed) '''
+    def __init__(self, name, ble_id, settings=None):
+        ''' This passes the parameters to the TrainHub class (see lego_trains/train.py), which stores them as hub_name, ble_id and settings '''
+        super().__init__(name, ble_id, settings)
+        self.colour = None
+
+        ''' The speeds can be set for each hub with its speed and caution_speed settings (see lego_trains/provisioning.py) '''
+        self.top_speed = self.settings.get('speed', 20)
+        self.caution_speed = self.settings.get('caution_speed', 10)
+
+        ''' The signals this train uses, the block it is in (None until it reaches its first marker), and whether it is stopped waiting at a marker '''
+        self.signals = SIGNALS
+        self.block = None
+        self.held = False
+
+        ''' This filters the colour readings, a colour is only passed on once it has been seen for 0.03 seconds (see lego_trains/sensor_filter.py) '''
+        self.colour_filter = SensorFilter(min_dwell=0.03)
+
+    ''' This runs once the Train is detected '''
+    async def run(self):
+        logging.info(f"{self.hub_name} is running")
+
+        ''' The train does not know if the block in front is clear until it reaches a marker, so it starts at the caution speed '''
+        await self.motor.set_speed(self.caution_speed)
+
+        ''' This is a While loop that keeps the train going around the track '''
+        while True:
+            ''' This sleeps until the colour sensor detects the marker of a block (other than the block the train is already in) '''
+            colour = await self.wait_for_colour(lambda colour: colour in self.signals.marker_blocks and self.signals.marker_blocks[colour] != self.block)
+            block = self.signals.marker_blocks[colour]
+
+            ''' If another train is still in the block, the train stops at the marker until the block is released '''
+            if not self.signals.is_clear_for(self, block):
+                self.log.info('waiting for block %d', block)
+                self.held = True
+                await self.motor.set_speed(0)
+
+            ''' This moves the train into the block (releasing the block it was in), and asks for the next block as well '''
+            next_clear = await self.signals.enter(self, block)
+            self.block = block
+            self.held = False
+
+            ''' If the next block is clear the train goes on at the top speed, otherwise at the caution speed (so it can stop at the next marker) '''
+            await self.motor.set_speed(self.top_speed if next_clear else self.caution_speed)
+
+    ''' This is called by the signals when the train has been given a block it was waiting for '''
+    async def signal_clear(self, block):
+        ''' A train running at the caution speed can speed up again (a train stopped at a marker is started again by its run function) '''
+        if not self.held:
+            await self.motor.set_speed(self.top_speed)
+
+    ''' As we have attached a colour sensor we have to have a function to handle the sensor updates (mandatory) '''
+    async def train_sensor_change(self):
+        ''' This function updates the colour variable, based on the last value detected by the sensor '''
+        colour = Color(self.train_sensor.value[VisionSensor.capability.sense_color])
+
+        ''' The colour goes through the filter, once it is confirmed the colour variable is updated
+        and this wakes up the run function if it is waiting for this colour '''
+        await self.filter_sensor_change('colour', self.colour_filter, colour)
+
+
+''' This checks the script is being run directly (i.e. not as a thread) and if so scans for active hubs,
+then connects and starts each train (see lego_trains/train.py) '''
+if __name__ == '__main__':
+    run_lesson(Train)
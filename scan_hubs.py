@@ -1,14 +1,7 @@
 import logging
 import asyncio
 import json
-from bleak import BleakScanner
-import os
-
-''' This gets the root (top level) folder path (where this script is saved) '''
-ROOT = os.getcwd()
-
-''' This sets the path where the hub info will be saved as a JSON file '''
-MAPPING_FILE = f'{ROOT}/hubs/hub_mapping.json'
+from lego_trains.hub_registry import HubRegistry, MAPPING_FILE
 
 ''' This sets the logging level (can be changed from INFO to DEBUG or CRITICAL etc. if preferred), 
 so we can see what our script is trying to do (can be useful if something goes wrong) '''
@@ -19,58 +12,83 @@ async def discover_hubs():
     ''' This function scans for available Bluetooth devices and adds any newly discovered active hubs to the mapping file '''
     logging.info("Scanning for Smart Hubs...")
 
+    ''' bleak is only imported here (rather than at the top of the script), so the lessons can use the other functions in this script
+    without importing bleak, as it conflicts with bricknil '''
+    from bleak import BleakScanner
+
     ''' Scans for available hubs and then adds to the devices variable '''
     devices = await BleakScanner.discover(timeout=1)
 
-    ''' Loads existing hubs from the mapping file to the hubs variable as a Python list '''
-    hubs = load_existing_hubs()
+    ''' Loads existing hubs from the mapping file into the hub registry (see lego_trains/hub_registry.py) '''
+    registry = HubRegistry(MAPPING_FILE)
 
     ''' Count and then display the number of existing hubs '''
-    hub_count = len(hubs)
-    logging.info(f'{hub_count} hubs currently in mapping file.')
-
-    ''' Loops through the active Bluetooth devices'''
-    for dev in devices:
-        ''' Checks if Smart Hub is in the device name (that is the name used for Lego PoweredUp Hubs) '''
-        if dev.name and 'Smart Hub' in dev.name:
-            ''' Gets the device id '''
-            ble_id = dev.address
-
-            ''' Checks to see if the device id is in the hubs list (which was loaded from the mapping file) '''
-            if ble_id not in [h['ble_id'] for h in hubs]:
-                ''' If the device id is not in the hubs list/mapping list, assigns a default name of train_n, where n is the hub count + 1 '''
-                default_name = f"train_{hub_count + 1}"
-
-                ''' Appends the new hub to the hubs list and sets the new flat to True so the user will get prompted to name the hub later '''
-                hubs.append({'hub_name': default_name, 'ble_id': ble_id, 'new': True})
-
-    ''' Saves the hub list to the mapping file '''
-    save_hubs_to_json(hubs)
-
-''' This loads existing hubs from the mapping file '''
-def load_existing_hubs(file_path=MAPPING_FILE):
-    ''' Checks if the mapping file exists and returns the mappings, otherwise returns an empty list '''
-    if os.path.exists(file_path):
-        try:
-            ''' If the mapping file does exist then loads the data into memory '''
-            with open(file_path, 'r') as f:
-                ''' Returns the data as a list of Python dicts by using json.load '''
-                return json.load(f)
-        except json.JSONDecodeError:
-            ''' If the file is empty or contains invalid JSON, return an empty list '''
-            logging.info(f"{file_path} contains invalid JSON or is empty. A new mapping file will be created.")
-            return []
-    else:
-        ''' If the file doesn't exist, return an empty list '''
-        return []
+    logging.info(f'{len(registry)} hubs currently in mapping file.')
+
+    ''' Adds the device id of any Smart Hubs found in the scan that are not already in the registry '''
+    registry.add_new(dev.address for dev in devices if is_smart_hub(dev.name))
+
+    ''' Saves the hub list to the mapping file (this is skipped if no new hubs were found) '''
+    registry.save()
+
+''' This checks if Smart Hub is in the device name (that is the name used for Lego PoweredUp Hubs) '''
+def is_smart_hub(device_name):
+    return bool(device_name) and 'Smart Hub' in device_name
+
+''' This is the streaming version of discover_hubs, which reports each Smart Hub the moment it is seen rather than waiting for the scan to finish '''
+async def stream_hubs(timeout=10):
+    ''' Each hub is printed as a line of JSON (e.g. {"ble_id": "...", "hub_name": "train_1", "name": "Smart Hub", "rssi": -60}), which lego_trains/fleet.py reads
+    as the lines arrive and connects to the hub straight away. The scan ends early once every hub in the mapping file has been seen
+    (if the mapping file is empty or missing, e.g. the first time, it scans until the timeout so every hub can be found) '''
+    from bleak import BleakScanner
 
-''' This saves hubs to the mapping file '''
-def save_hubs_to_json(hubs, file_path=MAPPING_FILE):
-    ''' Creates a new mapping file and then overwrites (or creates if one does not exist) '''
-    with open(file_path, 'w') as f:
-        ''' Using json.dump saves the list of Python dicts to the mapping file as a JSON '''
-        json.dump(hubs, f, indent=4)
+    ''' Loads existing hubs from the mapping file, so we know when every known hub has been seen '''
+    registry = HubRegistry(MAPPING_FILE)
+    known_ids = {h['ble_id'] for h in registry}
+    logging.info(f'Streaming scan for Smart Hubs, waiting for {len(known_ids)} known hubs (timeout {timeout} seconds)...')
+
+    ''' Hubs waiting to be reported are kept in a priority queue, so if several arrive at once the strongest signal (highest RSSI) goes first '''
+    found = asyncio.PriorityQueue()
+    seen = set()
+
+    ''' This is called by bleak for every advertisement it receives '''
+    def on_detect(device, advertisement_data):
+        if is_smart_hub(device.name) and device.address not in seen:
+            seen.add(device.address)
+            rssi = advertisement_data.rssi if advertisement_data.rssi is not None else -999
+            found.put_nowait((-rssi, device.address, device.name))
+
+    scanner = BleakScanner(detection_callback=on_detect)
+    await scanner.start()
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        reported = set()
+        while not (known_ids and known_ids <= reported):
+            try:
+                negative_rssi, ble_id, name = await asyncio.wait_for(found.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            reported.add(ble_id)
+
+            ''' A hub that is not in the mapping file is added as soon as it is seen, so it is reported with its own automatic name (train_n),
+            rather than the name it advertises (every hub advertises Smart Hub), and is named the next time a lesson is started normally '''
+            hub_info = registry.add(ble_id)
+
+            ''' flush=True makes sure the line is sent straight away, rather than waiting in Python's output buffer '''
+            print(json.dumps({'ble_id': ble_id, 'hub_name': hub_info['hub_name'], 'name': name, 'rssi': -negative_rssi}), flush=True)
+    finally:
+        await scanner.stop()
+
+    ''' The new hubs are saved to the mapping file in one go (this is skipped if no new hubs were found) '''
+    registry.save()
 
 if __name__ == '__main__':
-    asyncio.run(discover_hubs())
+    import sys
+
+    ''' Running the script with --stream reports each hub as soon as it is seen (used by lego_trains/fleet.py) '''
+    if '--stream' in sys.argv:
+        asyncio.run(stream_hubs())
+    else:
+        asyncio.run(discover_hubs())
 